@@ -0,0 +1,151 @@
+"""
+Renders the ray tracer without a window, the event queue or any prompts,
+for running unattended. Run with -h for the options.
+"""
+
+import argparse, os, shutil, sys, time
+
+from modules.raytracing import stats
+from modules.raytracing.textures import Texture
+from quilt import QUILT_SUBFOLDER, QuiltRenderer, lowerPriority, stitchStreaming
+from rayTracer import BACKENDS, RayTracer
+from render import ShowTypes
+
+
+class QuiltRayTracer(QuiltRenderer, RayTracer):
+    """The ray tracer, rendered in chunks by the QuiltRenderer."""
+
+    def getSettings(self):
+        # The images the scene loaded, by the hash of their contents
+        return dict(
+            super().getSettings(),
+            backend=self.backend,
+            textures=Texture.getDigests(),
+        )
+
+
+def parseArguments(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("output", help="file to save the image to")
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--height", type=int, default=800)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="processes to render with, more than one renders as a quilt",
+    )
+    parser.add_argument(
+        "--quilt",
+        metavar="FOLDER",
+        help="keep the chunks in this quilt folder, to resume a render later",
+    )
+    parser.add_argument("--chunk-size", type=int, default=100)
+    parser.add_argument(
+        "--scalar",
+        action="store_true",
+        help="trace one ray at a time instead of in packets",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="python",
+        help="numba only renders scenes without textures",
+    )
+    parser.add_argument(
+        "--nice",
+        action="store_true",
+        help="render at low priority, to keep the machine usable",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="count rays and time intersections, with one worker only",
+    )
+    options = parser.parse_args(arguments)
+
+    if options.stats and (options.workers != 1 or options.quilt is not None):
+        parser.error("--stats needs one worker and no quilt")
+    return options
+
+
+def renderImage(options):
+    """Renders the whole image in this process and saves it."""
+    renderer = RayTracer(
+        options.width,
+        options.height,
+        show=ShowTypes.NoShow,
+        packet=not options.scalar,
+        backend=options.backend,
+        fileName=os.path.abspath(options.output),
+    )
+    if options.nice:
+        lowerPriority()
+
+    renderer.startImage()
+    if options.stats:
+        stats.enable(renderer)
+
+    for _ in renderer.render():
+        pass
+
+
+def renderQuilt(options):
+    """Renders the image in chunks with a pool of workers and stitches the
+    chunks into the output. Returns the seconds spent stitching."""
+    folderName = options.quilt
+    if folderName is None:
+        folderName = os.path.splitext(os.path.basename(options.output))[0]
+
+    renderer = QuiltRayTracer(
+        options.width,
+        options.height,
+        chunkSize=options.chunk_size,
+        packet=not options.scalar,
+        workers=options.workers,
+        backend=options.backend,
+        fileName=folderName,
+        lowPriority=options.nice,
+    )
+    renderer.startImage()
+    renderer.render()
+
+    startTime = time.time()
+    stitchStreaming(folderName, options.workers, os.path.abspath(options.output))
+
+    # Without a quilt folder to keep the chunks are only scratch space
+    if options.quilt is None:
+        shutil.rmtree(os.path.join(QUILT_SUBFOLDER, folderName))
+
+    return time.time() - startTime
+
+
+def main(arguments=None):
+    options = parseArguments(arguments)
+
+    startTime = time.time()
+    if options.workers == 1 and options.quilt is None:
+        stitchTime = 0.0
+        renderImage(options)
+    else:
+        stitchTime = renderQuilt(options)
+    totalTime = time.time() - startTime
+
+    pixels = options.width * options.height
+    print()
+    print(f"Saved {options.output}")
+    print(f"Resolution:   {options.width} x {options.height}")
+    print(f"Workers:      {options.workers}")
+    print(f"Render time:  {totalTime - stitchTime:.3f} seconds")
+    print(f"Stitch time:  {stitchTime:.3f} seconds")
+    print(f"Total time:   {totalTime:.3f} seconds")
+    print(f"Pixels/s:     {pixels / totalTime:,.0f}", flush=True)
+
+    collected = stats.disable()
+    if collected is not None:
+        print()
+        print(collected.report(), flush=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,406 @@
+"""
+Benchmarks the ray tracer on fixed reference scenes, reporting rays per
+second, the time of each progressive pass and peak memory, then times
+every intersect in objects.py. Run with -h for the options.
+"""
+
+import argparse, contextlib, io, os, sys, tempfile, time, timeit
+from multiprocessing import get_context
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+from rayTracer import BACKENDS, RECURSIVE_RAY_LIMIT, RayTracer
+from render import ShowTypes
+from modules.raytracing.objects import (
+    Cube,
+    Ellipsoids,
+    Plane,
+    Sphere,
+    TexturedCube,
+    TexturedPlane,
+    TexturedSphere,
+)
+from modules.raytracing.lights import PointLight
+from modules.raytracing.materials import Material, MaterialMirror, MaterialRefractive
+from modules.raytracing.ray import Ray, RayPacket
+from modules.utils.vector import vec
+
+# Fraction of pixels an adaptive render may get wrong for --adaptive to pass
+ADAPTIVE_WRONG = 0.01
+
+
+class SpheresTracer(RayTracer):
+    """400 small spheres in a grid over a plain floor."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        rng = np.random.default_rng(1234)
+
+        floor = Plane(
+            vec(0, 1, 0),
+            vec(0, -1, 0),
+            Material((0.2, 0.2, 0.2), (0.6, 0.6, 0.6), (1, 1, 1)),
+        )
+        objects = [floor]
+        for i in range(20):
+            for j in range(20):
+                color = rng.random(3)
+                objects.append(
+                    Sphere(
+                        0.2,
+                        vec(i * 0.5 - 4.75, rng.uniform(-0.8, 1.5), -2 - j * 0.5),
+                        Material(color * 0.3, color, (1, 1, 1)),
+                    )
+                )
+
+        self.scene.objects = objects
+        self.scene.lights = [PointLight(vec(1, 4, 0), vec(1, 1, 1))]
+        self.scene.finalize()
+
+
+class TexturesTracer(RayTracer):
+    """Every object textured, with a trilinear floor and wall."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        floor = TexturedPlane(
+            vec(0, 1, 0),
+            vec(0, -1, 0),
+            "./textures/floor.jpg",
+            scale_u=6.0,
+            scale_v=6.0,
+            filtering="trilinear",
+        )
+        floor.hittable = True
+        wall = TexturedPlane(
+            vec(0, 0, 1),
+            vec(0, 0, -12),
+            "./textures/escher.jpg",
+            scale_u=4.0,
+            scale_v=4.0,
+            filtering="trilinear",
+        )
+        wall.hittable = True
+
+        images = ["earth.png.jpg", "eye.webp", "tessellation.png", "sky.png"]
+        spheres = [
+            TexturedSphere(
+                0.6,
+                vec(i * 1.4 - 2.1, 0.2, -5),
+                "./textures/" + image,
+                vec(0, -1, 0),
+                vec(0, 0, 1),
+                filtering="bilinear",
+            )
+            for i, image in enumerate(images)
+        ]
+        dice = TexturedCube(
+            vec(0, -0.3, -3.5),
+            vec(0.3, 2, 0),
+            vec(0.5, 0, 1),
+            0.6,
+            *[f"./die/die{i}.png" for i in range(1, 7)],
+        )
+
+        self.scene.objects = [floor, wall, dice] + spheres
+        self.scene.finalize()
+
+
+class MirrorsTracer(RayTracer):
+    """Two facing mirrors around glass spheres, so rays bounce until
+    RECURSIVE_RAY_LIMIT."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        grey = ((0.5, 0.5, 0.5), (0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
+
+        floor = TexturedPlane(
+            vec(0, 1, 0),
+            vec(0, -1, 0),
+            "./textures/floor.jpg",
+            scale_u=6.0,
+            scale_v=6.0,
+        )
+        floor.hittable = True
+        mirrors = [
+            Plane(vec(1, 0, 0.05), vec(-1.5, 0, 0), MaterialMirror(*grey, 0.9)),
+            Plane(vec(-1, 0, 0.05), vec(1.5, 0, 0), MaterialMirror(*grey, 0.9)),
+        ]
+        spheres = [
+            Sphere(
+                0.4, vec(-0.5, 0, -3), MaterialRefractive(*grey, refractive_index=1.5)
+            ),
+            Sphere(
+                0.4, vec(0.5, 0.3, -4), MaterialRefractive(*grey, refractive_index=1.3)
+            ),
+            Sphere(0.3, vec(0, -0.4, -5), MaterialMirror(*grey)),
+        ]
+
+        self.scene.objects = [floor] + mirrors + spheres
+        self.scene.finalize()
+
+
+SCENES = {
+    "default": RayTracer,
+    "spheres": SpheresTracer,
+    "textures": TexturesTracer,
+    "mirrors": MirrorsTracer,
+}
+
+
+def countRays(scene):
+    """Counts the rays traced through the scene by wrapping its queries on
+    this instance. Returns the counts, which go up as rays are traced."""
+    counts = {"nearest": 0, "shadow": 0}
+
+    def wrap(name, key, rayArgument, packet):
+        query = getattr(scene, name)
+
+        def counted(*args, **kwargs):
+            counts[key] += len(args[rayArgument]) if packet else 1
+            return query(*args, **kwargs)
+
+        setattr(scene, name, counted)
+
+    wrap("nearestObject", "nearest", 0, False)
+    wrap("nearestObjects", "nearest", 0, True)
+    wrap("occluded", "shadow", 1, False)
+    wrap("occludedRays", "shadow", 1, True)
+    return counts
+
+
+def getPeakMemory():
+    """Peak resident memory of this process in bytes, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes everywhere but macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def benchmarkScene(name, width, height, packet, backend="python"):
+    """Renders a scene progressively, one pass per pixel size, and returns
+    its stats. Meant to run in a fresh process so the peak memory is only
+    this scene's."""
+    renderer = SCENES[name](
+        width, height, show=ShowTypes.PerImage, packet=packet, backend=backend
+    )
+
+    if backend == "numba":
+        from modules.raytracing import compiled
+
+        reason = compiled.findUnsupported(renderer.scene)
+        if reason is not None:
+            return {"name": name, "skipped": reason}
+
+        # Compile, or load from the cache, before timing
+        renderer.getColor(0, 0)
+
+    renderer.startImage()
+
+    # There is no window to show progress in
+    renderer.showProgress = lambda fps=60: None
+    counts = countRays(renderer.scene)
+
+    passTimes = []
+    pixelSize = renderer.pixelSize
+    startTime = passStart = lastStep = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in renderer.render():
+            # A pass ends at the last step taken at its pixel size
+            now = time.perf_counter()
+            if renderer.pixelSize != pixelSize:
+                passTimes.append((pixelSize, lastStep - passStart))
+                pixelSize = renderer.pixelSize
+                passStart = lastStep
+            lastStep = now
+    totalTime = time.perf_counter() - startTime
+
+    return {
+        "name": name,
+        "time": totalTime,
+        "passes": passTimes,
+        "primary": width * height,
+        "nearest": counts["nearest"],
+        "shadow": counts["shadow"],
+        "memory": getPeakMemory(),
+    }
+
+
+def renderHeadless(name, width, height, packet, adaptive):
+    """Renders a scene with NoShow, as batch.py does, into a throwaway
+    file, and returns the renderer."""
+    with tempfile.TemporaryDirectory() as folder:
+        renderer = SCENES[name](
+            width,
+            height,
+            show=ShowTypes.NoShow,
+            packet=packet,
+            adaptive=adaptive,
+            fileName=os.path.join(folder, "image.png"),
+        )
+        renderer.startImage()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in renderer.render():
+                pass
+    return renderer
+
+
+def compareAdaptive(name, width, height, packet):
+    """Renders a scene headless with and without adaptive subdivision.
+    Returns the pixels each traced, and how many adaptive pixels are
+    further than the tolerance from the full render."""
+    full = renderHeadless(name, width, height, packet, False)
+    adaptive = renderHeadless(name, width, height, packet, True)
+    difference = np.abs(adaptive.samples - full.samples).max(axis=2)
+    return (
+        int(full.sampled.sum()),
+        int(adaptive.sampled.sum()),
+        int((difference > adaptive.tolerance).sum()),
+    )
+
+
+def intersectBenchmarks(number, packetSize):
+    """Times intersect on a ray that hits and one that misses, and
+    intersectRays on a packet, for every object type that has its own.
+    Returns (name, hit us, miss us, packet ns per ray) tuples."""
+    material = Material((0.2, 0.2, 0.2), (0.6, 0.6, 0.6), (1, 1, 1))
+    objects = [
+        Sphere(1.0, vec(0, 0, -5), material),
+        Plane(vec(0, 0, 1), vec(0, 0, -5), material),
+        Ellipsoids(1.0, vec(0, 0, -5), vec(1, 2, 0.5), vec(0.3, 0.2, 0.1), material),
+        Cube(vec(0, 0, -5), vec(0.3, 0.1, 1), vec(0, 1, 0), 1.0, material),
+    ]
+
+    hit = Ray(vec(0, 0, 0), vec(0.05, 0.05, -1))
+    miss = Ray(vec(0, 0, 0), vec(0, 0.2, 1))
+    rng = np.random.default_rng(1234)
+    directions = np.column_stack(
+        [rng.uniform(-0.3, 0.3, (packetSize, 2)), -np.ones(packetSize)]
+    )
+    rays = RayPacket(vec(0, 0, 0), directions)
+
+    results = []
+    for o in objects:
+        hitTime = timeit.timeit(lambda: o.intersect(hit), number=number)
+        missTime = timeit.timeit(lambda: o.intersect(miss), number=number)
+        packetTime = timeit.timeit(lambda: o.intersectRays(rays), number=10)
+        results.append(
+            (
+                type(o).__name__,
+                hitTime / number * 1e6,
+                missTime / number * 1e6,
+                packetTime / 10 / packetSize * 1e9,
+            )
+        )
+    return results
+
+
+def printScene(stats):
+    print(f"{stats['name']}")
+    if "skipped" in stats:
+        print(f"  Skipped, {stats['skipped']}")
+        print(flush=True)
+        return
+
+    rays = stats["nearest"] + stats["shadow"]
+    memory = stats["memory"]
+    print(f"  Total time:    {stats['time']:.3f} seconds")
+    # The compiled backend never calls the scene queries that count rays
+    if rays:
+        print(f"  Rays:          {rays:,} ({stats['primary']:,} primary)")
+        print(f"  Rays/s:        {rays / stats['time']:,.0f}")
+    print(f"  Primary/s:     {stats['primary'] / stats['time']:,.0f}")
+    if rays:
+        print(f"  Shadow rays:   {stats['shadow']:,}")
+    if memory is not None:
+        print(f"  Peak memory:   {memory / 2**20:.1f} MB")
+    for pixelSize, passTime in stats["passes"]:
+        print(f"  Pass {pixelSize:3}:      {passTime:.3f} seconds")
+    print(flush=True)
+
+
+def parseArguments(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "scenes",
+        nargs="*",
+        metavar="scene",
+        help=f"scenes to render out of {', '.join(SCENES)}, all by default",
+    )
+    parser.add_argument("--width", type=int, default=200)
+    parser.add_argument("--height", type=int, default=200)
+    parser.add_argument(
+        "--scalar",
+        action="store_true",
+        help="trace one ray at a time instead of in packets",
+    )
+    parser.add_argument("--backend", choices=BACKENDS, default="python")
+    parser.add_argument(
+        "--number", type=int, default=2000, help="calls per intersect timing"
+    )
+    parser.add_argument("--packet-size", type=int, default=4096)
+    parser.add_argument(
+        "--no-scenes", action="store_true", help="only run the intersect timings"
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="only check headless adaptive renders against full ones",
+    )
+    options = parser.parse_args(arguments)
+
+    for name in options.scenes:
+        if name not in SCENES:
+            parser.error(f"unknown scene {name}")
+    return options
+
+
+def main(arguments=None):
+    options = parseArguments(arguments)
+    packet = not options.scalar
+    print(
+        f"{options.width} x {options.height}, packet={packet}, "
+        f"backend={options.backend}, RECURSIVE_RAY_LIMIT={RECURSIVE_RAY_LIMIT}"
+    )
+    print()
+
+    if options.adaptive:
+        # Fails when adaptive subdivision skips detail it should trace
+        failed = False
+        print("Adaptive       traced   full traced   wrong")
+        for name in options.scenes or SCENES:
+            fullTraced, traced, wrong = compareAdaptive(
+                name, options.width, options.height, packet
+            )
+            failed |= wrong > ADAPTIVE_WRONG * options.width * options.height
+            print(f"{name:12} {traced:8,}  {fullTraced:12,}  {wrong:6,}")
+        sys.exit(failed)
+
+    if not options.no_scenes:
+        # A fresh process per scene, so peak memory is not shared
+        context = get_context("spawn")
+        for name in options.scenes or SCENES:
+            with context.Pool(1) as pool:
+                stats = pool.apply(
+                    benchmarkScene,
+                    (name, options.width, options.height, packet, options.backend),
+                )
+            printScene(stats)
+
+    print("Intersect        hit us   miss us   packet ns/ray")
+    for name, hitTime, missTime, packetTime in intersectBenchmarks(
+        options.number, options.packet_size
+    ):
+        print(f"{name:14} {hitTime:8.2f}  {missTime:8.2f}  {packetTime:14.1f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
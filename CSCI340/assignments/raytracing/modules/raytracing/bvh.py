@@ -0,0 +1,292 @@
+"""
+Bounding volume hierarchy over the finite objects of a scene.
+Built top down, splitting with the surface area heuristic.
+"""
+
+import numpy as np
+
+from .ray import Ray, RayPacket
+
+# Cost of visiting a node relative to one intersect call
+TRAVERSAL_COST = 0.125
+
+# Leaves never hold more objects than this
+MAX_LEAF_SIZE = 4
+
+
+def surfaceArea(low, high):
+    """Surface area of the box with the given corners."""
+    d = np.maximum(high - low, 0)
+    return 2 * (d[..., 0] * d[..., 1] + d[..., 1] * d[..., 2] + d[..., 2] * d[..., 0])
+
+
+class BVHNode(object):
+    """A node of the hierarchy. Leaves have entries, a list of
+    (index, object) pairs, inner nodes have left and right children split
+    along axis, the left one holding the lower centroids."""
+
+    def __init__(self, low, high, entries=None, left=None, right=None, axis=0):
+        self.low = low
+        self.high = high
+        self.bounds = list(zip(low.tolist(), high.tolist()))
+        self.entries = entries
+        self.left = left
+        self.right = right
+        self.axis = axis
+
+    def isLeaf(self):
+        return self.entries is not None
+
+    def hit(self, origin, invDirection, maxDistance):
+        """Returns the distance the ray enters the box, or None if it misses
+        or enters beyond maxDistance. Takes plain tuples for speed."""
+        tNear = -np.inf
+        tFar = np.inf
+        for (low, high), o, inv in zip(self.bounds, origin, invDirection):
+            t1 = (low - o) * inv
+            t2 = (high - o) * inv
+            if t1 > t2:
+                t1, t2 = t2, t1
+            if t1 > tNear:
+                tNear = t1
+            if t2 < tFar:
+                tFar = t2
+        if tNear > tFar or tFar < 0 or tNear > maxDistance:
+            return None
+        return tNear
+
+    def hitRays(self, positions, invDirections, maxDistances):
+        """Returns a mask of the rays that enter the box before their
+        maxDistances."""
+        with np.errstate(invalid="ignore"):
+            t1 = (self.low - positions) * invDirections
+            t2 = (self.high - positions) * invDirections
+        tNear = np.fmax.reduce(np.fmin(t1, t2), axis=1)
+        tFar = np.fmin.reduce(np.fmax(t1, t2), axis=1)
+        return (tNear <= tFar) & (tFar >= 0) & (tNear <= maxDistances)
+
+
+class BVH(object):
+    """Bounding volume hierarchy over (index, object) pairs. Every object
+    must have bounds."""
+
+    def __init__(self, entries):
+        self.size = len(entries)
+        bounds = [o.getBounds() for _, o in entries]
+        lows = np.array([low for low, _ in bounds], dtype=np.float64)
+        highs = np.array([high for _, high in bounds], dtype=np.float64)
+        self.root = self.build(entries, lows, highs, np.arange(len(entries)))
+
+    def build(self, entries, lows, highs, items):
+        """Recursively builds a node over entries[items]."""
+        low = lows[items].min(axis=0)
+        high = highs[items].max(axis=0)
+        n = len(items)
+
+        if n == 1:
+            return BVHNode(low, high, [entries[i] for i in items])
+
+        centroids = (lows[items] + highs[items]) / 2
+        counts = np.arange(1, n)
+        bestCost = np.inf
+        bestAxis = 0
+
+        # Sweep each axis in centroid order for the cheapest split
+        for axis in range(3):
+            order = items[np.argsort(centroids[:, axis], kind="stable")]
+            leftAreas = surfaceArea(
+                np.minimum.accumulate(lows[order]), np.maximum.accumulate(highs[order])
+            )
+            rightAreas = surfaceArea(
+                np.minimum.accumulate(lows[order][::-1]),
+                np.maximum.accumulate(highs[order][::-1]),
+            )[::-1]
+            costs = leftAreas[:-1] * counts + rightAreas[1:] * counts[::-1]
+            split = np.argmin(costs)
+            if costs[split] < bestCost:
+                bestCost = costs[split]
+                bestOrder = order
+                bestSplit = split + 1
+                bestAxis = axis
+
+        area = surfaceArea(low, high)
+        splitCost = TRAVERSAL_COST + bestCost / area if area > 0 else 0
+        if n <= MAX_LEAF_SIZE and splitCost >= n:
+            return BVHNode(low, high, [entries[i] for i in items])
+
+        return BVHNode(
+            low,
+            high,
+            left=self.build(entries, lows, highs, bestOrder[:bestSplit]),
+            right=self.build(entries, lows, highs, bestOrder[bestSplit:]),
+            axis=bestAxis,
+        )
+
+    def nearest(
+        self,
+        ray: Ray,
+        maxDistance=np.inf,
+        minDistance=-np.inf,
+        exclude=None,
+        hittableOnly=False,
+    ):
+        """Returns the nearest object hit by the ray between minDistance and
+        maxDistance, and the distance to it. Skips exclude, and objects that
+        are not hittable if hittableOnly."""
+        origin = ray.position.tolist()
+        direction = ray.direction.tolist()
+        invDirection = [1 / d if d != 0 else np.inf for d in direction]
+        nearestObj = None
+        stack = [self.root]
+
+        while stack:
+            node = stack.pop()
+            if node.hit(origin, invDirection, maxDistance) is None:
+                continue
+
+            if not node.isLeaf():
+                # Near child on top, so its hits shrink maxDistance before
+                # the far child's box is tested
+                if direction[node.axis] < 0:
+                    stack.append(node.left)
+                    stack.append(node.right)
+                else:
+                    stack.append(node.right)
+                    stack.append(node.left)
+                continue
+
+            for _, o in node.entries:
+                if o is exclude or (hittableOnly and not o.hittable):
+                    continue
+                distance = o.intersect(ray)
+                if minDistance <= distance < maxDistance:
+                    nearestObj = o
+                    maxDistance = distance
+
+        return nearestObj, maxDistance
+
+    def nearestRays(
+        self,
+        rays: RayPacket,
+        indices,
+        distances,
+        minDistance=-np.inf,
+        exclude=None,
+        hittableOnly=False,
+    ):
+        """Updates indices and distances in place with any nearer hit
+        between minDistance and distances. Skips the object at index
+        exclude, and objects that are not hittable if hittableOnly."""
+        with np.errstate(divide="ignore"):
+            invDirections = 1 / rays.directions
+        stack = [(self.root, np.arange(len(rays)))]
+
+        while stack:
+            node, active = stack.pop()
+            active = active[
+                node.hitRays(
+                    rays.positions[active], invDirections[active], distances[active]
+                )
+            ]
+            if len(active) == 0:
+                continue
+
+            if not node.isLeaf():
+                # Near child first for each ray, so its hits shrink the
+                # distances before the far child's box is tested. Rays
+                # going down the axis visit the right child first.
+                backward = rays.directions[active, node.axis] < 0
+                forward = active[~backward]
+                backward = active[backward]
+                if len(forward):
+                    stack.append((node.right, forward))
+                if len(backward):
+                    stack.append((node.left, backward))
+                if len(forward):
+                    stack.append((node.left, forward))
+                if len(backward):
+                    stack.append((node.right, backward))
+                continue
+
+            for index, o in node.entries:
+                if index == exclude or (hittableOnly and not o.hittable):
+                    continue
+                hit = o.intersectRays(rays[active])
+                nearer = (hit >= minDistance) & (hit < distances[active])
+                indices[active[nearer]] = index
+                distances[active[nearer]] = hit[nearer]
+
+    def anyHit(
+        self, ray: Ray, maxDistance, minDistance=-np.inf, exclude=(), hittableOnly=False
+    ):
+        """Returns the first object found that the ray hits between
+        minDistance and maxDistance, or None. Skips objects in exclude, and
+        objects that are not hittable if hittableOnly."""
+        origin = ray.position.tolist()
+        invDirection = [1 / d if d != 0 else np.inf for d in ray.direction.tolist()]
+        stack = [self.root]
+
+        while stack:
+            node = stack.pop()
+            if node.hit(origin, invDirection, maxDistance) is None:
+                continue
+
+            if not node.isLeaf():
+                stack.append(node.right)
+                stack.append(node.left)
+                continue
+
+            for _, o in node.entries:
+                if o in exclude or (hittableOnly and not o.hittable):
+                    continue
+                if minDistance <= o.intersect(ray) < maxDistance:
+                    return o
+
+        return None
+
+    def anyHitRays(
+        self,
+        rays: RayPacket,
+        maxDistances,
+        blocked,
+        minDistance=-np.inf,
+        exclude=(),
+        hittableOnly=False,
+    ):
+        """Marks in blocked every ray that hits an object between
+        minDistance and maxDistances, skipping rays that are already
+        blocked. Returns the last object that blocked a ray, or None."""
+        with np.errstate(divide="ignore"):
+            invDirections = 1 / rays.directions
+        blocker = None
+        stack = [(self.root, np.flatnonzero(~blocked))]
+
+        while stack:
+            node, active = stack.pop()
+            active = active[~blocked[active]]
+            active = active[
+                node.hitRays(
+                    rays.positions[active], invDirections[active], maxDistances[active]
+                )
+            ]
+            if len(active) == 0:
+                continue
+
+            if not node.isLeaf():
+                stack.append((node.right, active))
+                stack.append((node.left, active))
+                continue
+
+            for _, o in node.entries:
+                if o in exclude or (hittableOnly and not o.hittable):
+                    continue
+                hit = o.intersectRays(rays[active])
+                hit = (hit >= minDistance) & (hit < maxDistances[active])
+                if hit.any():
+                    blocked[active[hit]] = True
+                    blocker = o
+                    active = active[~hit]
+                    if len(active) == 0:
+                        break
+
+        return blocker
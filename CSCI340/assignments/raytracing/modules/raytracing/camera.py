@@ -2,10 +2,10 @@
 Author: Liz Matthews, Geoff Matthews
 """
 
-from numpy import cross, radians, tan
+from numpy import asarray, cross, float64, newaxis, radians, tan
 from numpy.linalg import norm
 
-from .ray import Ray
+from .ray import Ray, RayPacket
 
 from ..utils.vector import lerp, normalize, vec
 
@@ -54,6 +54,12 @@ class Camera(object):
         self.ll = center - height / 2 * up - (width / 2) * right
         self.lr = center - height / 2 * up + (width / 2) * right
 
+        # Width of one pixel on the focus plane, once the resolution is known
+        self.planeWidth = width
+        self.pixelWidth = 0.0
+        if self.resolution is not None:
+            self.pixelWidth = width / self.resolution[0]
+
     def __init__(
         self,
         focus=vec(0, 0, 0),
@@ -63,17 +69,44 @@ class Camera(object):
         distance=2.5,
         aspect=4 / 3,
     ):
+        self.resolution = None
         self.set(focus, fwd, up, fov, distance, aspect)
 
+    def setResolution(self, width, height):
+        """Sets the image size in pixels, so rays know how wide a pixel is."""
+        self.resolution = (width, height)
+        self.pixelWidth = self.planeWidth / width
+
     def getRay(self, xPercent, yPercent, projection=ProjectionType.Perspective):
         """Returns a ray based on a percentage for the x and y coordinate."""
         p0 = lerp(self.ul, self.ur, xPercent)
         p1 = lerp(self.ll, self.lr, xPercent)
         rayEndPoint = lerp(p0, p1, yPercent)
         if projection == ProjectionType.Perspective:
-            return Ray(self.position, rayEndPoint - self.position)
+            return Ray(
+                self.position,
+                rayEndPoint - self.position,
+                spread=self.pixelWidth / self.distance,
+            )
+        else:
+            return Ray(self.position, rayEndPoint, footprint=self.pixelWidth)
+
+    def getRays(self, xPercents, yPercents, projection=ProjectionType.Perspective):
+        """Returns a RayPacket based on arrays of percentages for the x and y
+        coordinates."""
+        xPercents = asarray(xPercents, dtype=float64)[:, newaxis]
+        yPercents = asarray(yPercents, dtype=float64)[:, newaxis]
+        p0 = lerp(self.ul, self.ur, xPercents)
+        p1 = lerp(self.ll, self.lr, xPercents)
+        rayEndPoints = lerp(p0, p1, yPercents)
+        if projection == ProjectionType.Perspective:
+            return RayPacket(
+                self.position,
+                rayEndPoints - self.position,
+                spreads=self.pixelWidth / self.distance,
+            )
         else:
-            return Ray(self.position, rayEndPoint)
+            return RayPacket(self.position, rayEndPoints, footprints=self.pixelWidth)
 
     def getPosition(self):
         """Getter method for position."""
@@ -0,0 +1,619 @@
+"""
+Numba compiled backend for the ray tracer. compileScene flattens the
+objects, materials, lights and BVH of a scene into arrays, and traceRays
+traces a packet of rays over them in parallel, shading them the same way
+as RayTracer.getColorR. Covers spheres, planes, ellipsoids and cubes with
+plain, mirror and refractive materials, lit by point lights.
+
+The kernels are cached on disk, so they are only compiled on the first run.
+"""
+
+from collections import namedtuple
+from math import sqrt
+
+import numpy as np
+from numba import njit, prange
+
+from ..utils.definitions import EPSILON
+from .lights import PointLight
+from .materials import MATERIALS, Material, MaterialMirror, MaterialRefractive
+from .objects import Cube, Ellipsoids, Plane, Sphere, invR
+
+# Kinds of object, in the order of OBJECT_TYPES
+SPHERE, PLANE, ELLIPSOID, CUBE = range(4)
+OBJECT_TYPES = (Sphere, Plane, Ellipsoids, Cube)
+
+# Kinds of material, in the order of MATERIAL_TYPES
+PLAIN, MIRROR, REFRACTIVE = range(3)
+MATERIAL_TYPES = (Material, MaterialMirror, MaterialRefractive)
+
+CompiledScene = namedtuple(
+    "CompiledScene",
+    [
+        # (N,) kind of each object
+        "kinds",
+        # (N, 3) position of each object
+        "positions",
+        # (N, 4) sphere radius, plane normal, ellipsoid radius and stretch,
+        # or cube half length
+        "params",
+        # (N, 3, 3) ellipsoid inverse rotation, or cube axes as rows
+        "bases",
+        # (N,) whether each object is lit and casts shadows
+        "hittable",
+        # (N,) kind of each material
+        "materialKinds",
+        # (N, 3, 3) ambient, diffuse and specular colors
+        "colors",
+        # (N, 5) shine, specular coefficient, reflective factor, refractive
+        # index and transparency factor
+        "materialParams",
+        # (L, 3) point light positions
+        "lights",
+        # indices of the objects outside the BVH
+        "unbounded",
+        # (K, 2, 3) low and high corner of each BVH node
+        "nodeBounds",
+        # (K, 2) left and right child of each node, -1 for leaves
+        "nodeChildren",
+        # (K,) axis each inner node is split along
+        "nodeAxes",
+        # (K, 2) start and count of each leaf's objects in items
+        "nodeItems",
+        # object indices of the leaves, in order
+        "items",
+        # entries a traversal stack needs
+        "stackSize",
+        # (3,) color of rays that hit nothing
+        "fog",
+    ],
+)
+
+
+def findUnsupported(scene):
+    """Returns why the compiled backend cannot render the scene, or None
+    if it can. Only the exact types are supported, since subclasses such as
+    the textured objects change how they are shaded."""
+    for o in scene.objects:
+        if type(o) not in OBJECT_TYPES:
+            return f"{type(o).__name__} objects are not supported"
+        if type(o.material) not in MATERIAL_TYPES:
+            return f"{type(o.material).__name__} is not supported"
+    for l in scene.lights:
+        if type(l) is not PointLight:
+            return f"{type(l).__name__} is not supported"
+    return None
+
+
+def getRotation(angle):
+    """The matrix that applies invR with the ellipsoid angles."""
+    return np.array(invR(*np.eye(3), *angle), dtype=np.float64)
+
+
+def flattenBVH(bvh):
+    """Returns the nodes of a BVH as (bounds, children, split axes, items
+    per node, items, depth) arrays, with each left child right after its
+    parent."""
+    bounds, children, axes, nodeItems, items = [], [], [], [], []
+
+    def visit(node, depth):
+        index = len(bounds)
+        bounds.append((node.low, node.high))
+        children.append([-1, -1])
+        axes.append(node.axis)
+        nodeItems.append([len(items), 0])
+
+        if node.isLeaf():
+            nodeItems[index][1] = len(node.entries)
+            items.extend(i for i, _ in node.entries)
+            return depth
+
+        children[index][0] = len(bounds)
+        leftDepth = visit(node.left, depth + 1)
+        children[index][1] = len(bounds)
+        return max(leftDepth, visit(node.right, depth + 1))
+
+    depth = visit(bvh.root, 0)
+    return (
+        np.array(bounds, dtype=np.float64),
+        np.array(children, dtype=np.int64),
+        np.array(axes, dtype=np.int64),
+        np.array(nodeItems, dtype=np.int64),
+        np.array(items, dtype=np.int64),
+        depth,
+    )
+
+
+def compileScene(scene, fog):
+    """Flattens a finalized scene into a CompiledScene. Raises a ValueError
+    if the scene has anything the backend does not support."""
+    reason = findUnsupported(scene)
+    if reason is not None:
+        raise ValueError(f"The numba backend cannot render this scene: {reason}")
+
+    n = len(scene.objects)
+    kinds = np.empty(n, dtype=np.int64)
+    positions = np.empty((n, 3), dtype=np.float64)
+    params = np.zeros((n, 4), dtype=np.float64)
+    bases = np.zeros((n, 3, 3), dtype=np.float64)
+    hittable = np.empty(n, dtype=np.bool_)
+    materialKinds = np.empty(n, dtype=np.int64)
+
+    for i, o in enumerate(scene.objects):
+        kinds[i] = OBJECT_TYPES.index(type(o))
+        positions[i] = o.position
+        hittable[i] = o.hittable
+
+        if kinds[i] == SPHERE:
+            params[i, 0] = o.radius
+        elif kinds[i] == PLANE:
+            params[i, :3] = o.normal
+        elif kinds[i] == ELLIPSOID:
+            params[i] = (o.radius, *o.stretch)
+            bases[i] = getRotation(o.angle)
+        else:
+            params[i, 0] = o.length / 2
+            bases[i] = o.axes
+
+        materialKinds[i] = MATERIAL_TYPES.index(type(o.material))
+
+    # Every object's material properties, gathered from MATERIALS by id
+    ids = np.array([o.getMaterialId() for o in scene.objects], dtype=np.int64)
+    colors = np.stack(
+        [MATERIALS.ambient[ids], MATERIALS.diffuse[ids], MATERIALS.specular[ids]],
+        axis=1,
+    ).astype(np.float64)
+    materialParams = np.stack(
+        [
+            MATERIALS.shine[ids],
+            MATERIALS.specCoeff[ids],
+            MATERIALS.reflectivity[ids],
+            MATERIALS.refractiveIndex[ids],
+            MATERIALS.transparency[ids],
+        ],
+        axis=1,
+    ).astype(np.float64)
+
+    if scene.bvh is not None:
+        nodeBounds, nodeChildren, nodeAxes, nodeItems, items, depth = flattenBVH(
+            scene.bvh
+        )
+        unbounded = [i for i, _ in scene.unbounded]
+    else:
+        nodeBounds = np.empty((0, 2, 3), dtype=np.float64)
+        nodeChildren = np.empty((0, 2), dtype=np.int64)
+        nodeAxes = np.empty(0, dtype=np.int64)
+        nodeItems = np.empty((0, 2), dtype=np.int64)
+        items = np.empty(0, dtype=np.int64)
+        depth = 0
+        unbounded = range(n)
+
+    return CompiledScene(
+        kinds,
+        positions,
+        params,
+        bases,
+        hittable,
+        materialKinds,
+        colors,
+        materialParams,
+        np.array([l.point for l in scene.lights], dtype=np.float64).reshape(-1, 3),
+        np.array(unbounded, dtype=np.int64),
+        nodeBounds,
+        nodeChildren,
+        nodeAxes,
+        nodeItems,
+        items,
+        # Each inner node popped pushes both children
+        depth + 2,
+        np.array(fog, dtype=np.float64),
+    )
+
+
+# Vectors in the kernels are tuples, which stay out of the heap. Division
+# by zero gives inf or nan the same as numpy, instead of raising.
+
+
+@njit(cache=True, error_model="numpy")
+def row(array, i):
+    return (array[i, 0], array[i, 1], array[i, 2])
+
+
+@njit(cache=True, error_model="numpy")
+def add(a, b):
+    return (a[0] + b[0], a[1] + b[1], a[2] + b[2])
+
+
+@njit(cache=True, error_model="numpy")
+def sub(a, b):
+    return (a[0] - b[0], a[1] - b[1], a[2] - b[2])
+
+
+@njit(cache=True, error_model="numpy")
+def scale(a, s):
+    return (a[0] * s, a[1] * s, a[2] * s)
+
+
+@njit(cache=True, error_model="numpy")
+def dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+@njit(cache=True, error_model="numpy")
+def normalize(a):
+    mag = sqrt(dot(a, a))
+    if mag == 0.0:
+        return (1.0, 0.0, 0.0)
+    return scale(a, 1 / mag)
+
+
+@njit(cache=True, error_model="numpy")
+def transform(m, a):
+    """m @ a, for a 3 by 3 matrix m."""
+    return (dot(row(m, 0), a), dot(row(m, 1), a), dot(row(m, 2), a))
+
+
+@njit(cache=True, error_model="numpy")
+def transformTransposed(m, a):
+    """m.T @ a, for a 3 by 3 matrix m."""
+    return add(
+        add(scale(row(m, 0), a[0]), scale(row(m, 1), a[1])), scale(row(m, 2), a[2])
+    )
+
+
+@njit(cache=True, error_model="numpy")
+def solveQuadratic(a, b, c):
+    """Nearest positive root of a t^2 + b t + c, or inf."""
+    disc = (b * b) - (4 * a * c)
+    sqrt_disc = sqrt(max(0.0, disc))
+
+    sol_1 = (-b - sqrt_disc) / (2 * a)
+    sol_2 = (-b + sqrt_disc) / (2 * a)
+
+    hit_point = sol_1 if sol_1 > 0 and sol_2 > sol_1 else sol_2
+    if disc > 0 and hit_point > 0:
+        return hit_point
+    return np.inf
+
+
+@njit(cache=True, error_model="numpy")
+def intersect(scene, i, o, d):
+    """Distance along the ray to object i, the same as its intersect."""
+    kind = scene.kinds[i]
+    p = sub(o, row(scene.positions, i))
+    params = scene.params[i]
+
+    if kind == SPHERE:
+        return solveQuadratic(1.0, 2 * dot(p, d), dot(p, p) - params[0] * params[0])
+
+    if kind == PLANE:
+        normal = (params[0], params[1], params[2])
+        distance = -dot(p, normal) / dot(d, normal)
+        if abs(distance) > EPSILON:
+            return distance
+        return np.inf
+
+    if kind == ELLIPSOID:
+        p = transform(scene.bases[i], p)
+        v = transform(scene.bases[i], d)
+        s = (params[1], params[2], params[3])
+
+        vs = (v[0] / s[0], v[1] / s[1], v[2] / s[2])
+        ps = (p[0] / s[0], p[1] / s[1], p[2] / s[2])
+        return solveQuadratic(
+            dot(vs, vs), 2 * dot(vs, ps), dot(ps, ps) - params[0] ** 2
+        )
+
+    # Slab test in the cube's basis
+    p = transform(scene.bases[i], p)
+    v = transform(scene.bases[i], d)
+    hl = params[0]
+
+    maxEntry = -np.inf
+    minExit = np.inf
+    for axis in range(3):
+        if v[axis] == 0:
+            if abs(p[axis]) > hl:
+                return np.inf
+            continue
+
+        entry = (-hl - p[axis]) / v[axis]
+        exit = (hl - p[axis]) / v[axis]
+        if entry > exit:
+            entry, exit = exit, entry
+        maxEntry = max(maxEntry, entry)
+        minExit = min(minExit, exit)
+
+    if maxEntry < minExit:
+        return maxEntry
+    return np.inf
+
+
+@njit(cache=True, error_model="numpy")
+def getNormal(scene, i, x):
+    """Normal of object i at the point x, the same as its getNormal."""
+    kind = scene.kinds[i]
+    p = sub(x, row(scene.positions, i))
+    params = scene.params[i]
+
+    if kind == SPHERE:
+        return normalize(p)
+
+    if kind == PLANE:
+        return (params[0], params[1], params[2])
+
+    if kind == ELLIPSOID:
+        p = transform(scene.bases[i], p)
+        r2 = params[0] ** 2
+        p = (
+            2 * p[0] / (r2 * params[1] ** 2),
+            2 * p[1] / (r2 * params[2] ** 2),
+            2 * p[2] / (r2 * params[3] ** 2),
+        )
+        return normalize(transformTransposed(scene.bases[i], p))
+
+    # The face whose axis the point is furthest along
+    p = transform(scene.bases[i], p)
+    axis = 0
+    for a in range(1, 3):
+        if abs(p[a]) > abs(p[axis]):
+            axis = a
+    normal = row(scene.bases[i], axis)
+    if p[axis] < 0:
+        return scale(normal, -1.0)
+    return normal
+
+
+@njit(cache=True, error_model="numpy")
+def hitBox(bounds, o, inv, maxDistance):
+    """Whether the ray enters the box before maxDistance, the same as
+    BVHNode.hit."""
+    tNear = -np.inf
+    tFar = np.inf
+    for axis in range(3):
+        t1 = (bounds[0, axis] - o[axis]) * inv[axis]
+        t2 = (bounds[1, axis] - o[axis]) * inv[axis]
+        if t1 > t2:
+            t1, t2 = t2, t1
+        if t1 > tNear:
+            tNear = t1
+        if t2 < tFar:
+            tFar = t2
+    return not (tNear > tFar or tFar < 0 or tNear > maxDistance)
+
+
+@njit(cache=True, error_model="numpy")
+def findHit(scene, o, d, maxDistance, exclude, anyHit, stack):
+    """Returns the index of the nearest object the ray hits between EPSILON
+    and maxDistance, or -1, and the distance to it. Skips the object at
+    index exclude. If anyHit, returns the first hittable object found
+    instead, for shadow rays. stack is scratch space for the BVH."""
+    nearest = -1
+
+    for k in range(len(scene.unbounded)):
+        i = scene.unbounded[k]
+        if i == exclude or (anyHit and not scene.hittable[i]):
+            continue
+        distance = intersect(scene, i, o, d)
+        if EPSILON <= distance and distance < maxDistance:
+            nearest = i
+            maxDistance = distance
+            if anyHit:
+                return nearest, maxDistance
+
+    if len(scene.nodeBounds) == 0:
+        return nearest, maxDistance
+
+    inv = (
+        1 / d[0] if d[0] != 0 else np.inf,
+        1 / d[1] if d[1] != 0 else np.inf,
+        1 / d[2] if d[2] != 0 else np.inf,
+    )
+    stack[0] = 0
+    top = 1
+
+    while top > 0:
+        top -= 1
+        node = stack[top]
+        if not hitBox(scene.nodeBounds[node], o, inv, maxDistance):
+            continue
+
+        if scene.nodeChildren[node, 0] >= 0:
+            # Near child on top, so its hits shrink maxDistance before the
+            # far child's box is tested
+            near, far = scene.nodeChildren[node, 0], scene.nodeChildren[node, 1]
+            if d[scene.nodeAxes[node]] < 0:
+                near, far = far, near
+            stack[top] = far
+            stack[top + 1] = near
+            top += 2
+            continue
+
+        start = scene.nodeItems[node, 0]
+        for k in range(start, start + scene.nodeItems[node, 1]):
+            i = scene.items[k]
+            if i == exclude or (anyHit and not scene.hittable[i]):
+                continue
+            distance = intersect(scene, i, o, d)
+            if EPSILON <= distance and distance < maxDistance:
+                nearest = i
+                maxDistance = distance
+                if anyHit:
+                    return nearest, maxDistance
+
+    return nearest, maxDistance
+
+
+@njit(cache=True, error_model="numpy")
+def shade(scene, i, x, normal, d, stack):
+    """Ambient color of object i plus the diffuse and specular light from
+    every light that reaches x."""
+    colors = scene.colors[i]
+    ambient = row(colors, 0)
+    diffuse = row(colors, 1)
+    specular = row(colors, 2)
+    shine = scene.materialParams[i, 0]
+    specCoeff = scene.materialParams[i, 1]
+
+    color = ambient
+    for l in range(len(scene.lights)):
+        light = row(scene.lights, l)
+        toLight = sub(light, x)
+        lightVector = normalize(toLight)
+
+        blocker, _ = findHit(
+            scene,
+            light,
+            scale(lightVector, -1.0),
+            sqrt(dot(toLight, toLight)),
+            i,
+            True,
+            stack,
+        )
+        if blocker >= 0:
+            continue
+
+        color = add(
+            color, scale(sub(diffuse, color), max(dot(normal, lightVector), 1e-13))
+        )
+        reflection = normalize(sub(lightVector, d))
+        color = add(
+            color,
+            scale(sub(specular, color), (dot(reflection, normal) ** shine) * specCoeff),
+        )
+
+    return color
+
+
+@njit(cache=True, error_model="numpy")
+def pushRay(rays, count, o, d, level, weight):
+    """Puts a ray on the rays stack and returns the new count."""
+    rays[count, 0], rays[count, 1], rays[count, 2] = o
+    rays[count, 3], rays[count, 4], rays[count, 5] = d
+    rays[count, 6] = level
+    rays[count, 7] = weight
+    return count + 1
+
+
+@njit(cache=True, error_model="numpy")
+def traceRay(scene, o, d, limit, rays, stack):
+    """Color of one ray. Instead of recursing, every reflected or refracted
+    ray goes on the rays stack as (position, direction, level, weight), with
+    the weight it is lerped into the final color with."""
+    count = pushRay(rays, 0, o, d, 0, 1.0)
+    color = (0.0, 0.0, 0.0)
+
+    while count > 0:
+        count -= 1
+        o = row(rays, count)
+        d = (rays[count, 3], rays[count, 4], rays[count, 5])
+        level = rays[count, 6]
+        weight = rays[count, 7]
+
+        i, distance = findHit(scene, o, d, np.inf, -1, False, stack)
+        if i < 0:
+            color = add(
+                color, scale((scene.fog[0], scene.fog[1], scene.fog[2]), weight)
+            )
+            continue
+
+        x = add(o, scale(d, distance))
+        normal = normalize(getNormal(scene, i, x))
+
+        if not scene.hittable[i]:
+            color = add(color, scale(row(scene.colors[i], 1), weight))
+            continue
+
+        kind = scene.materialKinds[i]
+        if kind == PLAIN or level >= limit:
+            color = add(color, scale(shade(scene, i, x, normal, d, stack), weight))
+            continue
+
+        reflection = sub(d, scale(normal, 2 * dot(d, normal)))
+        reflectionFrom = add(x, scale(reflection, 0.001))
+
+        if kind == MIRROR:
+            factor = scene.materialParams[i, 2]
+            lit = shade(scene, i, x, normal, d, stack)
+            color = add(color, scale(lit, weight * (1 - factor)))
+            count = pushRay(
+                rays,
+                count,
+                reflectionFrom,
+                normalize(reflection),
+                level + 1,
+                weight * factor,
+            )
+            continue
+
+        n_r = 1.0
+        n_t = scene.materialParams[i, 3]
+        n = normal
+
+        # check if we are entering something or leaving something
+        if dot(d, n) > 0.001:
+            n_r, n_t = n_t, n_r
+            n = scale(n, -1.0)
+
+        cos_theta = -dot(d, n)
+        n_ratio = n_r / n_t
+        cos_phi = 1 - (n_ratio * n_ratio) * (1 - cos_theta**2)
+
+        if cos_phi < 0.001:
+            # Total internal reflection
+            refraction = sub(d, scale(n, 2 * dot(d, n)))
+            refractionFrom = add(x, scale(refraction, EPSILON))
+        else:
+            refraction = add(
+                scale(n, n_ratio * cos_theta - sqrt(cos_phi)), scale(d, n_ratio)
+            )
+            refractionFrom = add(x, scale(refraction, 0.01))
+
+        R_0 = ((n_r - n_t) / (n_r + n_t)) ** 2
+        R_theta = R_0 + ((1 - R_0) * ((1 - abs(dot(d, normal))) ** 5))
+        transparency = scene.materialParams[i, 4]
+
+        # lerp(lerp(ambient, refracted, transparency), reflected, R_theta)
+        color = add(
+            color,
+            scale(row(scene.colors[i], 0), weight * (1 - R_theta) * (1 - transparency)),
+        )
+        count = pushRay(
+            rays,
+            count,
+            reflectionFrom,
+            normalize(reflection),
+            level + 1,
+            weight * R_theta,
+        )
+        count = pushRay(
+            rays,
+            count,
+            refractionFrom,
+            normalize(refraction),
+            level + 1,
+            weight * (1 - R_theta) * transparency,
+        )
+
+    return color
+
+
+@njit(cache=True, error_model="numpy", parallel=True)
+def traceRays(scene, positions, directions, limit):
+    """Colors of a packet of rays, given as (N, 3) arrays, reflecting and
+    refracting up to limit times. Traces the rays in parallel."""
+    colors = np.empty((len(positions), 3), dtype=np.float64)
+
+    for r in prange(len(positions)):
+        # Each level of recursion leaves at most one ray waiting
+        rays = np.empty((limit + 2, 8), dtype=np.float64)
+        stack = np.empty(scene.stackSize, dtype=np.int64)
+
+        color = traceRay(
+            scene, row(positions, r), row(directions, r), limit, rays, stack
+        )
+        colors[r, 0] = color[0]
+        colors[r, 1] = color[1]
+        colors[r, 2] = color[2]
+
+    return colors
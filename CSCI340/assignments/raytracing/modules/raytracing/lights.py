@@ -1,12 +1,14 @@
 from abc import ABC, abstractmethod
 import numpy as np
 
-from ..utils.vector import normalize
+from ..utils.vector import normalize, normalizeRows
 
 
 class AbstractLight(ABC):
     def __init__(self, color):
         self.color = color
+        # The last object found blocking a shadow ray to this light
+        self.lastOccluder = None
 
     def getColor(self):
         """Returns the color of the light"""
@@ -34,6 +36,14 @@ class PointLight(AbstractLight):
     def getDistance(self, point):
         return np.linalg.norm(point - self.point)
 
+    def getVectorsToLight(self, points):
+        """Returns an (N, 3) array of vectors pointing towards the light"""
+        return normalizeRows(self.point - points)
+
+    def getDistances(self, points):
+        """Returns an (N,) array of distances to the light"""
+        return np.linalg.norm(points - self.point, axis=1)
+
 
 class DirectionalLight(AbstractLight):
     def __init__(self, ray, color):
@@ -2,12 +2,11 @@
 Author: Liz Matthews, Geoff Matthews
 """
 
-from numpy import clip
+from weakref import finalize
+from numpy import array, broadcast_to, clip, empty, float32, int64
 from typing_extensions import override
 from ..utils.vector import vec
 
-from pygame import image
-
 # Must be less than 1
 AMBIENT_MULTIPLE = 0.45
 
@@ -15,38 +14,182 @@ AMBIENT_MULTIPLE = 0.45
 SPECULAR_MULTIPLE = 1.6
 
 
+def constant(*args):
+    """A vec that can not be changed, so it is safe to hand out without
+    copying it."""
+    v = vec(*args)
+    v.flags.writeable = False
+    return v
+
+
+# Properties a material does not have to give, and their values
+DEFAULTS = {"reflectivity": 0.0, "refractiveIndex": 1.0, "transparency": 0.0}
+
+
+class MaterialRow(object):
+    """Read-only views of one row of a MaterialTable, as attributes named
+    like its columns: (3,) views of the colors and 0-d views of the rest.
+    The table points them at its new columns when it grows."""
+
+
+class MaterialTable(object):
+    """Properties of every registered material as a structure of float32
+    arrays, one row per material id: ambient, diffuse and specular are
+    (M, 3) arrays and shine, specCoeff, reflectivity, refractiveIndex and
+    transparency are (M,) arrays, so the properties of many materials are
+    gathered with one index, like table.diffuse[ids].
+    The table is the only copy of the properties, so the columns are read
+    only. rows holds a MaterialRow per id, to read one material without
+    indexing. The row of a material that is gone is reused, so views of
+    it are only valid while its material lives."""
+
+    def __init__(self, capacity=16):
+        self.count = 0
+        self.free = []
+        self.rows = []
+        self.columns = {
+            "ambient": empty((capacity, 3), dtype=float32),
+            "diffuse": empty((capacity, 3), dtype=float32),
+            "specular": empty((capacity, 3), dtype=float32),
+            "shine": empty(capacity, dtype=float32),
+            "specCoeff": empty(capacity, dtype=float32),
+            "reflectivity": empty(capacity, dtype=float32),
+            "refractiveIndex": empty(capacity, dtype=float32),
+            "transparency": empty(capacity, dtype=float32),
+        }
+        self.setViews()
+
+    def __len__(self):
+        return self.count - len(self.free)
+
+    def setViews(self):
+        # The columns as attributes, without the rows never registered
+        for name, column in self.columns.items():
+            column.flags.writeable = False
+            setattr(self, name, column[: self.count])
+
+    def setRowViews(self, index):
+        for name, column in self.columns.items():
+            setattr(self.rows[index], name, column[index, ...])
+
+    def register(self, **properties):
+        """Adds a row with the given properties and returns its id."""
+        if self.free:
+            index = self.free.pop()
+        else:
+            if self.count == len(self.columns["shine"]):
+                # Double the capacity, so registering stays cheap
+                for name, column in self.columns.items():
+                    grown = empty((2 * len(column),) + column.shape[1:], column.dtype)
+                    grown[: self.count] = column
+                    self.columns[name] = grown
+                for i in range(self.count):
+                    self.setRowViews(i)
+            index = self.count
+            self.count += 1
+            self.rows.append(MaterialRow())
+
+        row = {**DEFAULTS, **properties}
+        for name, column in self.columns.items():
+            column.flags.writeable = True
+            column[index] = row[name]
+
+        self.setViews()
+        self.setRowViews(index)
+        return index
+
+    def release(self, index):
+        """Frees the row index for the next register to reuse. Views of
+        it handed out before then show the new material's properties."""
+        self.free.append(index)
+
+    def getIds(self, materials):
+        """(len(materials),) array of the ids of materials."""
+        return array([m.id for m in materials], dtype=int64)
+
+
+# Every Material registers itself here when it is made
+MATERIALS = MaterialTable()
+
+
 class Material(object):
     """A class to contain all properties of a material.
     Contains ambient, diffuse, specular colors.
     Contains shininess property.
-    Contains specular coefficient."""
+    Contains specular coefficient.
+    The properties live only in MATERIALS, in the row id, and can not be
+    changed, so the getters return views of the row without copying. The
+    views are only valid while the material lives, as its row is reused
+    after."""
 
-    def __init__(self, ambient, diffuse, specular, shine=100, specCoeff=1.0):
-        self.ambient = vec(*ambient)
-        self.diffuse = vec(*diffuse)
-        self.specular = vec(*specular)
-        self.shine = shine
-        self.specCoeff = specCoeff
+    def __init__(
+        self, ambient, diffuse, specular, shine=100, specCoeff=1.0, **properties
+    ):
+        self.id = MATERIALS.register(
+            ambient=ambient,
+            diffuse=diffuse,
+            specular=specular,
+            shine=shine,
+            specCoeff=specCoeff,
+            **properties,
+        )
+        self.row = MATERIALS.rows[self.id]
+        # Give the row back once nothing uses this material
+        finalize(self, MATERIALS.release, self.id)
 
     def getAmbient(self):
         """Getter method for ambient color."""
-        return vec(self.ambient)
+        return self.row.ambient
 
     def getDiffuse(self):
         """Getter method for diffuse color."""
-        return vec(self.diffuse)
+        return self.row.diffuse
 
     def getSpecular(self):
         """Getter method for specular color."""
-        return vec(self.specular)
+        return self.row.specular
 
     def getShine(self):
         """Getter method for shininess factor."""
-        return vec(self.shine)
+        return self.row.shine
 
     def getSpecularCoefficient(self):
         """Getter method for specular coefficient."""
-        return vec(self.specCoeff)
+        return self.row.specCoeff
+
+    def getReflectivity(self):
+        """Getter method for how much of a reflection is mixed in."""
+        return self.row.reflectivity
+
+    def getRefractiveIndex(self):
+        """Getter method for the refractive index."""
+        return self.row.refractiveIndex
+
+    def getTransparency(self):
+        """Getter method for how much of a refraction is mixed in."""
+        return self.row.transparency
+
+    def getAmbients(self, points, footprints=0.0):
+        """Ambient colors for an (N, 3) array of points. The footprints of
+        the rays that hit them do not change a plain color."""
+        return broadcast_to(self.getAmbient(), points.shape)
+
+    def getDiffuses(self, points, footprints=0.0):
+        """Diffuse colors for an (N, 3) array of points."""
+        return broadcast_to(self.getDiffuse(), points.shape)
+
+    def getSpeculars(self, points, footprints=0.0):
+        """Specular colors for an (N, 3) array of points."""
+        return broadcast_to(self.getSpecular(), points.shape)
+
+    def getColors(self, points, footprints=0.0):
+        """Ambient, diffuse and specular colors for an (N, 3) array of
+        points."""
+        return (
+            self.getAmbients(points, footprints),
+            self.getDiffuses(points, footprints),
+            self.getSpeculars(points, footprints),
+        )
 
     def getRecursiveRay(self):
         return False
@@ -65,8 +208,9 @@ class MaterialMirror(Material):
         shine=100,
         specCoeff=1.0,
     ):
-        super().__init__(ambient, diffuse, specular, shine, specCoeff)
-        self.reflective_factor = reflective_factor
+        super().__init__(
+            ambient, diffuse, specular, shine, specCoeff, reflectivity=reflective_factor
+        )
 
     def getRecursiveRay(self):
         return True
@@ -83,9 +227,15 @@ class MaterialRefractive(Material):
         shine=100,
         specCoeff=1.0,
     ):
-        super().__init__(ambient, diffuse, specular, shine, specCoeff)
-        self.refractive_index = refractive_index
-        self.transparency_factor = transparency_factor
+        super().__init__(
+            ambient,
+            diffuse,
+            specular,
+            shine,
+            specCoeff,
+            refractiveIndex=refractive_index,
+            transparency=transparency_factor,
+        )
 
     def getRecursiveRay(self):
         return True
@@ -95,29 +245,118 @@ class MaterialRefractive(Material):
 
 
 class Material3D(object):
-    def __init__(self, pattern, shine=100, specCoeff=1.0):
+    def __init__(
+        self,
+        pattern,
+        shine=100,
+        specCoeff=1.0,
+        vectorized=False,
+        volume=None,
+        filtered=False,
+    ):
         self.pattern = pattern
-        self.shine = shine
-        self.specCoeff = specCoeff
+        self.shine = constant(shine)
+        self.specCoeff = constant(specCoeff)
 
-    def getAmbient(self, x, y, z):
-        return self.pattern(x, y, z) * AMBIENT_MULTIPLE
+        # Colors that depend on the point have no row in MATERIALS
+        self.id = None
 
-    def getDiffuse(self, x, y, z):
-        """Getter method for diffuse color."""
+        # Whether pattern also takes arrays of x, y and z and returns an
+        # (N, 3) array of colors, like the NoisePatterns do, so a packet
+        # is shaded in one call instead of one per point
+        self.vectorized = vectorized
+
+        # Whether pattern takes a filterWidth keyword like the NoisePatterns
+        # do, to be given the footprint of each hit and skip the octaves of
+        # noise too fine to see in it
+        self.filtered = filtered
+
+        # A NoiseVolume baked from the pattern to look colors up in instead
+        self.volume = volume
+        if volume is not None:
+            self.pattern = volume.sample
+            self.vectorized = True
+            self.filtered = False
+
+    def getPattern(self, x, y, z, footprint=0.0):
+        """Color of the pattern, filtered by the footprint if it can be."""
+        if self.filtered:
+            return self.pattern(x, y, z, filterWidth=footprint)
         return self.pattern(x, y, z)
 
-    def getSpecular(self, x, y, z):
+    def getAmbient(self, x, y, z, footprint=0.0):
+        return self.getPattern(x, y, z, footprint) * AMBIENT_MULTIPLE
+
+    def getDiffuse(self, x, y, z, footprint=0.0):
+        """Getter method for diffuse color."""
+        return self.getPattern(x, y, z, footprint)
+
+    def getSpecular(self, x, y, z, footprint=0.0):
         """Getter method for specular color."""
-        return clip(self.pattern(x, y, z) * SPECULAR_MULTIPLE, 0.0, 1.0)
+        return clip(self.getPattern(x, y, z, footprint) * SPECULAR_MULTIPLE, 0.0, 1.0)
+
+    def getColor(self, x, y, z, footprint=0.0):
+        """Ambient, diffuse and specular colors at x, y and z, from one
+        evaluation of the pattern instead of three."""
+        color = self.getPattern(x, y, z, footprint)
+        return (
+            color * AMBIENT_MULTIPLE,
+            color,
+            clip(color * SPECULAR_MULTIPLE, 0.0, 1.0),
+        )
 
     def getShine(self):
         """Getter method for shininess factor."""
-        return vec(self.shine)
+        return self.shine
 
     def getSpecularCoefficient(self):
         """Getter method for specular coefficient."""
-        return vec(self.specCoeff)
+        return self.specCoeff
+
+    def getAmbients(self, points, footprints=0.0):
+        """Ambient colors for an (N, 3) array of points, with the footprint
+        of the ray that hit each."""
+        if self.vectorized:
+            return array(self.getAmbient(*points.T, footprints), dtype=float32)
+        footprints = broadcast_to(footprints, len(points))
+        return array(
+            [self.getAmbient(*p, f) for p, f in zip(points, footprints)],
+            dtype=float32,
+        )
+
+    def getDiffuses(self, points, footprints=0.0):
+        """Diffuse colors for an (N, 3) array of points."""
+        if self.vectorized:
+            return array(self.getDiffuse(*points.T, footprints), dtype=float32)
+        footprints = broadcast_to(footprints, len(points))
+        return array(
+            [self.getDiffuse(*p, f) for p, f in zip(points, footprints)],
+            dtype=float32,
+        )
+
+    def getSpeculars(self, points, footprints=0.0):
+        """Specular colors for an (N, 3) array of points."""
+        if self.vectorized:
+            return array(self.getSpecular(*points.T, footprints), dtype=float32)
+        footprints = broadcast_to(footprints, len(points))
+        return array(
+            [self.getSpecular(*p, f) for p, f in zip(points, footprints)],
+            dtype=float32,
+        )
+
+    def getColors(self, points, footprints=0.0):
+        """Ambient, diffuse and specular colors for an (N, 3) array of
+        points, from one evaluation of the pattern instead of three."""
+        if self.vectorized:
+            colors = self.getPattern(*points.T, footprints)
+        else:
+            footprints = broadcast_to(footprints, len(points))
+            colors = array([self.getPattern(*p, f) for p, f in zip(points, footprints)])
+        return (
+            array(colors * AMBIENT_MULTIPLE, dtype=float32),
+            array(colors, dtype=float32),
+            array(clip(colors * SPECULAR_MULTIPLE, 0.0, 1.0), dtype=float32),
+        )
 
     def getRecursiveRay(self):
         return False
@@ -5,8 +5,6 @@ Author: Liz Matthews, Geoff Matthews
 import numpy as np
 from abc import ABC, abstractmethod
 
-import pygame
-
 from ..raytracing.materials import (
     AMBIENT_MULTIPLE,
     SPECULAR_MULTIPLE,
@@ -16,13 +14,43 @@ from ..raytracing.materials import (
 
 from ..utils.definitions import EPSILON
 
-from .ray import Ray
-from ..utils.vector import normalize, rotate, vec
+from .ray import Ray, RayPacket
+from .textures import Texture
+from ..utils.vector import dotRows, normalize, normalizeRows, rotate, vec
 from numpy import cos, sin
 
 WHITE_MATERIAL = Material((1.0, 1.0, 1.0), (1.0, 1.0, 1.0), (1.0, 1.0, 1.0), 0, 0)
 
 
+class SurfaceInteraction(object):
+    """What shading a hit needs, looked up once and reused for every light
+    and secondary ray: the point, its normal, the footprint of the ray
+    there, the texture coordinates for objects that have them, and the
+    colors and highlight of the material at the point."""
+
+    def __init__(
+        self,
+        point,
+        normal,
+        footprint,
+        ambient,
+        diffuse,
+        specular,
+        shine,
+        specularCoefficient,
+        uv=None,
+    ):
+        self.point = point
+        self.normal = normal
+        self.footprint = footprint
+        self.uv = uv
+        self.ambient = ambient
+        self.diffuse = diffuse
+        self.specular = specular
+        self.shine = shine
+        self.specularCoefficient = specularCoefficient
+
+
 def rotZ(x, y, z, theta):
     return (x * cos(theta) - y * sin(theta), x * sin(theta) + y * cos(theta), z)
 
@@ -49,26 +77,29 @@ def invR(x, y, z, xa, ya, za):
 
 class Object3D(ABC):
     """Abstract base class for all objects in the raytraced scene.
-    Has a position, material.
+    Has a position, material and the material's row in MATERIALS.
     Has getter methods for all material properties.
     Has abstract methods intersect and getNormal."""
 
     def __init__(self, pos, material):
         self.position = np.array(pos)
         self.material = material
+        self.materialId = material.id
         self.hittable = True
 
-    def getAmbient(self, intersection=None):
+    def getAmbient(self, intersection=None, footprint=0.0):
         """Getter method for the material's ambient color.
-        Intersection parameter is unused for Ray Tracing Basics."""
+        Intersection parameter is unused for Ray Tracing Basics.
+        Footprint is the width of the ray where it hits, textures use it
+        to pick how much to filter."""
         return self.material.getAmbient()
 
-    def getDiffuse(self, intersection=None):
+    def getDiffuse(self, intersection=None, footprint=0.0):
         """Getter method for the material's diffuse color.
         Intersection parameter is unused for Ray Tracing Basics."""
         return self.material.getDiffuse()
 
-    def getSpecular(self, intersection=None):
+    def getSpecular(self, intersection=None, footprint=0.0):
         """Getter method for the material's specular color.
         Intersection parameter is unused for Ray Tracing Basics."""
         return self.material.getSpecular()
@@ -82,6 +113,52 @@ class Object3D(ABC):
         Intersection parameter is unused for Ray Tracing Basics."""
         return self.material.getSpecularCoefficient()
 
+    def getMaterialId(self):
+        """Getter method for the material's row in MATERIALS, None for a
+        Material3D."""
+        return self.materialId
+
+    def getAmbients(self, intersections, footprints=0.0):
+        """Ambient colors for an (N, 3) array of intersections, with a
+        footprint for each."""
+        return self.material.getAmbients(intersections, footprints)
+
+    def getDiffuses(self, intersections, footprints=0.0):
+        """Diffuse colors for an (N, 3) array of intersections."""
+        return self.material.getDiffuses(intersections, footprints)
+
+    def getSpeculars(self, intersections, footprints=0.0):
+        """Specular colors for an (N, 3) array of intersections."""
+        return self.material.getSpeculars(intersections, footprints)
+
+    def getColors(self, intersections, footprints=0.0):
+        """Ambient, diffuse and specular colors for an (N, 3) array of
+        intersections. Override when the three can share their work."""
+        return (
+            self.getAmbients(intersections, footprints),
+            self.getDiffuses(intersections, footprints),
+            self.getSpeculars(intersections, footprints),
+        )
+
+    def getColor(self, intersection, footprint=0.0):
+        """Same as getColors, for one intersection."""
+        return (
+            self.getAmbient(intersection, footprint),
+            self.getDiffuse(intersection, footprint),
+            self.getSpecular(intersection, footprint),
+        )
+
+    def getInteraction(self, intersection, normal, footprint=0.0):
+        """The SurfaceInteraction of a hit at intersection."""
+        return SurfaceInteraction(
+            intersection,
+            normal,
+            footprint,
+            *self.getColor(intersection, footprint),
+            self.getShine(),
+            self.getSpecularCoefficient(),
+        )
+
     @abstractmethod
     def intersect(self, ray):
         """Find the intersection for the given object. Must override."""
@@ -92,6 +169,27 @@ class Object3D(ABC):
         """Find the normal for the given object. Must override."""
         pass
 
+    def getBounds(self):
+        """Returns the (low, high) corners of an axis aligned box around the
+        object, or None if the object is unbounded."""
+        return None
+
+    def intersectRays(self, rays: RayPacket):
+        """Find the intersection distances for every ray in a RayPacket.
+        Override with array math, this falls back to one ray at a time."""
+        return np.array(
+            [
+                self.intersect(Ray(p, d))
+                for p, d in zip(rays.positions, rays.directions)
+            ],
+            dtype=np.float32,
+        )
+
+    def getNormals(self, intersections):
+        """Find the normals for an (N, 3) array of intersections.
+        Override with array math, this falls back to one point at a time."""
+        return np.array([self.getNormal(p) for p in intersections], dtype=np.float32)
+
 
 class Sphere(Object3D):
     def __init__(self, radius, pos, material):
@@ -127,14 +225,50 @@ class Sphere(Object3D):
 
         return np.where(hit_bool, hit_point, np.inf)
 
+    def intersectRays(self, rays: RayPacket):
+        # Same quadratic as intersect, one row per ray.
+        p = rays.positions - self.position
+        v = rays.directions
+
+        b = 2 * dotRows(p, v)
+        c = dotRows(p, p) - self.radius * self.radius
+
+        disc = (b * b) - (4 * c)
+        sqrt_disc = np.sqrt(np.maximum(0, disc))
+
+        sol_1 = (-b - sqrt_disc) / 2
+        sol_2 = (-b + sqrt_disc) / 2
+
+        hit_point = np.where((sol_1 > 0) & (sol_2 > sol_1), sol_1, sol_2)
+        hit_bool = (disc > 0) & (hit_point > 0)
+
+        return np.where(hit_bool, hit_point, np.inf)
+
     def getNormal(self, intersection):
         return normalize(vec(intersection - self.position))
 
+    def getBounds(self):
+        return self.position - self.radius, self.position + self.radius
+
+    def getNormals(self, intersections):
+        return normalizeRows(intersections - self.position)
+
 
 class TexturedSphere(Sphere):
-    def __init__(self, radius, pos, img, up, forward, scale_u=1.0, scale_v=1.0):
+    def __init__(
+        self,
+        radius,
+        pos,
+        img,
+        up,
+        forward,
+        scale_u=1.0,
+        scale_v=1.0,
+        filtering="nearest",
+    ):
         super().__init__(radius, pos, WHITE_MATERIAL)
-        self.image = pygame.image.load(img)
+        self.texture = Texture.load(img)
+        self.filtering = filtering
         self.scale_u = scale_u
         self.scale_v = scale_v
 
@@ -148,7 +282,8 @@ class TexturedSphere(Sphere):
 
         return
 
-    def getDiffuse(self, intersection=None):
+    def getUV(self, intersection):
+        """Percentages along the texture for the given intersection."""
         d = intersection - self.position
         d = normalize(
             np.array(
@@ -162,18 +297,77 @@ class TexturedSphere(Sphere):
         percent_u = (u % self.scale_u) / self.scale_u
         percent_v = (v % self.scale_v) / self.scale_v
 
-        img_x = int(percent_u * self.image.get_width())
-        img_y = int(percent_v * self.image.get_height())
+        return percent_u, percent_v
 
-        pixel = self.image.get_at((img_x, img_y))[:-1]
+    def getUVFootprint(self, footprint):
+        """Converts a footprint in world units to texture percentages."""
+        return footprint / (np.pi * self.radius * min(self.scale_u, self.scale_v))
 
-        return vec(list(map(lambda x: x / 255.0, pixel)))
+    def getUVs(self, intersections):
+        """Same as getUV, for an (N, 3) array of intersections."""
+        d = intersections - self.position
+        d = normalizeRows(
+            np.stack(
+                [dotRows(d, self.right), dotRows(d, self.up), dotRows(d, self.forward)],
+                axis=1,
+            )
+        )
+
+        u = 0.5 + np.arctan2(d[:, 2], d[:, 0]) / (2 * np.pi)
+        v = np.arccos(d[:, 1]) / np.pi
+
+        percent_u = (u % self.scale_u) / self.scale_u
+        percent_v = (v % self.scale_v) / self.scale_v
+
+        return percent_u, percent_v
+
+    def getDiffuse(self, intersection=None, footprint=0.0):
+        return self.texture.sample(
+            *self.getUV(intersection), self.filtering, self.getUVFootprint(footprint)
+        )
 
-    def getAmbient(self, intersection=None):
-        return self.getDiffuse(intersection)
+    def getAmbient(self, intersection=None, footprint=0.0):
+        return self.getDiffuse(intersection, footprint)
 
-    def getSpecular(self, intersection=None):
-        return self.getDiffuse(intersection)
+    def getSpecular(self, intersection=None, footprint=0.0):
+        return self.getDiffuse(intersection, footprint)
+
+    def getColor(self, intersection, footprint=0.0):
+        diffuse = self.getDiffuse(intersection, footprint)
+        return diffuse, diffuse, diffuse
+
+    def getInteraction(self, intersection, normal, footprint=0.0):
+        # One texture lookup, its coordinates kept with the hit
+        uv = self.getUV(intersection)
+        diffuse = self.texture.sample(
+            *uv, self.filtering, self.getUVFootprint(footprint)
+        )
+        return SurfaceInteraction(
+            intersection,
+            normal,
+            footprint,
+            diffuse,
+            diffuse,
+            diffuse,
+            self.getShine(),
+            self.getSpecularCoefficient(),
+            uv,
+        )
+
+    def getDiffuses(self, intersections, footprints=0.0):
+        return self.texture.sample(
+            *self.getUVs(intersections), self.filtering, self.getUVFootprint(footprints)
+        )
+
+    def getAmbients(self, intersections, footprints=0.0):
+        return self.getDiffuses(intersections, footprints)
+
+    def getSpeculars(self, intersections, footprints=0.0):
+        return self.getDiffuses(intersections, footprints)
+
+    def getColors(self, intersections, footprints=0.0):
+        diffuses = self.getDiffuses(intersections, footprints)
+        return diffuses, diffuses, diffuses
 
 
 class SphereTextured3D(Sphere):
@@ -181,22 +375,29 @@ class SphereTextured3D(Sphere):
         self.position = pos
         self.radius = radius
         self.material = material
+        self.materialId = material.id
 
-    def getAmbient(self, intersection):
+    def getAmbient(self, intersection, footprint=0.0):
         x, y, z = intersection
-        return self.material.getAmbient(x, y, z)
+        return self.material.getAmbient(x, y, z, footprint)
 
-    def getDiffuse(self, intersection=None):
+    def getDiffuse(self, intersection=None, footprint=0.0):
         """Getter method for the material's diffuse color.
         Intersection parameter is unused for Ray Tracing Basics."""
         x, y, z = intersection
-        return self.material.getDiffuse(x, y, z)
+        return self.material.getDiffuse(x, y, z, footprint)
 
-    def getSpecular(self, intersection=None):
+    def getSpecular(self, intersection=None, footprint=0.0):
         """Getter method for the material's specular color.
         Intersection parameter is unused for Ray Tracing Basics."""
         x, y, z = intersection
-        return self.material.getSpecular(x, y, z)
+        return self.material.getSpecular(x, y, z, footprint)
+
+    def getColors(self, intersections, footprints=0.0):
+        return self.material.getColors(intersections, footprints)
+
+    def getColor(self, intersection, footprint=0.0):
+        return self.material.getColor(*intersection, footprint)
 
 
 class Plane(Object3D):
@@ -212,37 +413,64 @@ class Plane(Object3D):
             return intersect
         return np.inf
 
+    def intersectRays(self, rays: RayPacket):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            intersect = dotRows(self.position - rays.positions, self.normal) / (
+                dotRows(rays.directions, self.normal)
+            )
+        return np.where(np.abs(intersect) > EPSILON, intersect, np.inf)
+
     def getNormal(self, intersection):
         return self.normal
 
+    def getNormals(self, intersections):
+        return np.broadcast_to(self.normal, intersections.shape)
+
 
 class PlaneTextured3D(Plane):
     def __init__(self, normal, pos, material: Material3D):
         super().__init__(normal, pos, material)
 
-    def getAmbient(self, intersection):
+    def getAmbient(self, intersection, footprint=0.0):
         x, y, z = intersection
-        return self.material.getAmbient(x, y, z)
+        return self.material.getAmbient(x, y, z, footprint)
 
-    def getDiffuse(self, intersection=None):
+    def getDiffuse(self, intersection=None, footprint=0.0):
         """Getter method for the material's diffuse color.
         Intersection parameter is unused for Ray Tracing Basics."""
         x, y, z = intersection
-        return self.material.getDiffuse(x, y, z)
+        return self.material.getDiffuse(x, y, z, footprint)
 
-    def getSpecular(self, intersection=None):
+    def getSpecular(self, intersection=None, footprint=0.0):
         """Getter method for the material's specular color.
         Intersection parameter is unused for Ray Tracing Basics."""
         x, y, z = intersection
-        return self.material.getSpecular(x, y, z)
+        return self.material.getSpecular(x, y, z, footprint)
+
+    def getColors(self, intersections, footprints=0.0):
+        return self.material.getColors(intersections, footprints)
+
+    def getColor(self, intersection, footprint=0.0):
+        return self.material.getColor(*intersection, footprint)
 
 
 class TexturedPlane(Plane):
-    def __init__(self, normal, pos, img, u=None, v=None, scale_u=1.0, scale_v=1.0):
+    def __init__(
+        self,
+        normal,
+        pos,
+        img,
+        u=None,
+        v=None,
+        scale_u=1.0,
+        scale_v=1.0,
+        filtering="nearest",
+    ):
         super().__init__(
             normal, pos, Material((1.0, 1.0, 1.0), (1.0, 1.0, 1.0), (1.0, 1.0, 1.0))
         )
-        self.image = pygame.image.load(img)
+        self.texture = Texture.load(img)
+        self.filtering = filtering
         self.name = img
         self.hittable = False
 
@@ -260,13 +488,8 @@ class TexturedPlane(Plane):
         self.scale_u = scale_u
         self.scale_v = scale_v
 
-    def getAmbient(self, intersection=None):
-        return self.getDiffuse(intersection) * AMBIENT_MULTIPLE
-
-    def getSpecular(self, intersection=None):
-        return self.getAmbient(intersection)
-
-    def getDiffuse(self, intersection=None):
+    def getUV(self, intersection):
+        """Percentages along the texture for the given intersection."""
         p = intersection - self.position
 
         coord_u = np.dot(self.u, p) - 0.5
@@ -275,12 +498,74 @@ class TexturedPlane(Plane):
         percent_u = (coord_u % self.scale_u) / self.scale_u
         percent_v = (coord_v % self.scale_v) / self.scale_v
 
-        img_x = int(percent_u * self.image.get_width())
-        img_y = int(percent_v * self.image.get_height())
+        return percent_u, percent_v
+
+    def getUVFootprint(self, footprint):
+        """Converts a footprint in world units to texture percentages."""
+        return footprint / min(self.scale_u, self.scale_v)
 
-        pixel = self.image.get_at((img_x, img_y))[:-1]
+    def getUVs(self, intersections):
+        """Same as getUV, for an (N, 3) array of intersections."""
+        p = intersections - self.position
 
-        return vec(list(map(lambda x: x / 255.0, pixel)))
+        coord_u = dotRows(p, self.u) - 0.5
+        coord_v = dotRows(p, self.v) - 0.5
+
+        percent_u = (coord_u % self.scale_u) / self.scale_u
+        percent_v = (coord_v % self.scale_v) / self.scale_v
+
+        return percent_u, percent_v
+
+    def getAmbient(self, intersection=None, footprint=0.0):
+        return self.getDiffuse(intersection, footprint) * AMBIENT_MULTIPLE
+
+    def getSpecular(self, intersection=None, footprint=0.0):
+        return self.getAmbient(intersection, footprint)
+
+    def getDiffuse(self, intersection=None, footprint=0.0):
+        return self.texture.sample(
+            *self.getUV(intersection), self.filtering, self.getUVFootprint(footprint)
+        )
+
+    def getAmbients(self, intersections, footprints=0.0):
+        return self.getDiffuses(intersections, footprints) * AMBIENT_MULTIPLE
+
+    def getSpeculars(self, intersections, footprints=0.0):
+        return self.getAmbients(intersections, footprints)
+
+    def getDiffuses(self, intersections, footprints=0.0):
+        return self.texture.sample(
+            *self.getUVs(intersections), self.filtering, self.getUVFootprint(footprints)
+        )
+
+    def getColors(self, intersections, footprints=0.0):
+        diffuses = self.getDiffuses(intersections, footprints)
+        ambients = diffuses * AMBIENT_MULTIPLE
+        return ambients, diffuses, ambients
+
+    def getColor(self, intersection, footprint=0.0):
+        diffuse = self.getDiffuse(intersection, footprint)
+        ambient = diffuse * AMBIENT_MULTIPLE
+        return ambient, diffuse, ambient
+
+    def getInteraction(self, intersection, normal, footprint=0.0):
+        # One texture lookup, its coordinates kept with the hit
+        uv = self.getUV(intersection)
+        diffuse = self.texture.sample(
+            *uv, self.filtering, self.getUVFootprint(footprint)
+        )
+        ambient = diffuse * AMBIENT_MULTIPLE
+        return SurfaceInteraction(
+            intersection,
+            normal,
+            footprint,
+            ambient,
+            diffuse,
+            ambient,
+            self.getShine(),
+            self.getSpecularCoefficient(),
+            uv,
+        )
 
 
 class Ellipsoids(Object3D):
@@ -314,8 +599,8 @@ class Ellipsoids(Object3D):
 
         sqrt_disc = np.sqrt(np.maximum(0, disc))
 
-        sol_1 = (-b - sqrt_disc) / 2
-        sol_2 = (-b + sqrt_disc) / 2
+        sol_1 = (-b - sqrt_disc) / (2 * a)
+        sol_2 = (-b + sqrt_disc) / (2 * a)
 
         hit_point = np.where((sol_1 > 0) & (sol_2 > sol_1), sol_1, sol_2)
         hit_bool = (disc > 0) & (hit_point > 0)
@@ -333,26 +618,74 @@ class Ellipsoids(Object3D):
         )
         return normalize(rot(x, y, z, ax, ay, az))
 
+    def getBounds(self):
+        # Semi-axes are the rotated local axes scaled by radius * stretch
+        ax, ay, az = self.angle
+        axes = np.array([rot(*e, ax, ay, az) for e in np.eye(3)])
+        semiAxes = axes * (self.radius * self.stretch)[:, np.newaxis]
+        extent = np.sqrt((semiAxes**2).sum(axis=0))
+        return self.position - extent, self.position + extent
+
+    def intersectRays(self, rays: RayPacket):
+        ax, ay, az = self.angle
+        p = rays.positions - self.position
+        p = np.stack(invR(p[:, 0], p[:, 1], p[:, 2], ax, ay, az), axis=1)
+        v = rays.directions
+        v = np.stack(invR(v[:, 0], v[:, 1], v[:, 2], ax, ay, az), axis=1)
+        s = self.stretch
+
+        vs = v / s
+        ps = p / s
+
+        a = dotRows(vs, vs)
+        b = 2 * dotRows(vs, ps)
+        c = dotRows(ps, ps) - self.radius**2
+
+        disc = (b * b) - (4 * a * c)
+
+        sqrt_disc = np.sqrt(np.maximum(0, disc))
+
+        sol_1 = (-b - sqrt_disc) / (2 * a)
+        sol_2 = (-b + sqrt_disc) / (2 * a)
+
+        hit_point = np.where((sol_1 > 0) & (sol_2 > sol_1), sol_1, sol_2)
+        hit_bool = (disc > 0) & (hit_point > 0)
+        return np.where(hit_bool, hit_point, np.inf)
+
+    def getNormals(self, intersections):
+        ax, ay, az = self.angle
+        p = intersections - self.position
+        x, y, z = invR(p[:, 0], p[:, 1], p[:, 2], ax, ay, az)
+        scale = 2 / ((self.radius**2) * (self.stretch**2))
+        x, y, z = x * scale[0], y * scale[1], z * scale[2]
+        return normalizeRows(np.stack(rot(x, y, z, ax, ay, az), axis=1))
+
 
 class EllipsoidsTextured3D(Ellipsoids):
     def __init__(self, radius, pos, stretch, angle, material: Material3D):
         super().__init__(radius, pos, stretch, angle, material)
 
-    def getAmbient(self, intersection):
+    def getAmbient(self, intersection, footprint=0.0):
         x, y, z = intersection
-        return self.material.getAmbient(x, y, z)
+        return self.material.getAmbient(x, y, z, footprint)
 
-    def getDiffuse(self, intersection=None):
+    def getDiffuse(self, intersection=None, footprint=0.0):
         """Getter method for the material's diffuse color.
         Intersection parameter is unused for Ray Tracing Basics."""
         x, y, z = intersection
-        return self.material.getDiffuse(x, y, z)
+        return self.material.getDiffuse(x, y, z, footprint)
 
-    def getSpecular(self, intersection=None):
+    def getSpecular(self, intersection=None, footprint=0.0):
         """Getter method for the material's specular color.
         Intersection parameter is unused for Ray Tracing Basics."""
         x, y, z = intersection
-        return self.material.getSpecular(x, y, z)
+        return self.material.getSpecular(x, y, z, footprint)
+
+    def getColors(self, intersections, footprints=0.0):
+        return self.material.getColors(intersections, footprints)
+
+    def getColor(self, intersection, footprint=0.0):
+        return self.material.getColor(*intersection, footprint)
 
 
 # TODO: Later:
@@ -369,7 +702,6 @@ class EllipsoidsTextured3D(Ellipsoids):
 class Cube(Object3D):
     def __init__(self, pos, forward, up, length, material):
         super().__init__(pos, material)
-        self.last_intersection = None
         hl = length / 2
         self.length = length
 
@@ -382,6 +714,10 @@ class Cube(Object3D):
         z_axis = np.cross(y_axis, x_axis)
         self.z_axis = z_axis = normalize(z_axis)
 
+        # Rows are the local axes, so axes @ v is v in the cube's basis
+        self.axes = np.array([x_axis, y_axis, z_axis])
+
+        # Faces in order +x, -x, +y, -y, +z, -z
         self.planes = [
             Plane(x_axis, pos + x_axis * hl, material),
             Plane(-x_axis, pos - x_axis * hl, material),
@@ -391,45 +727,144 @@ class Cube(Object3D):
             Plane(-z_axis, pos - z_axis * hl, material),
         ]
 
-    def getAmbient(self, intersection=None):
-        return self.last_intersection.getAmbient(intersection)
+    def getAmbient(self, intersection=None, footprint=0.0):
+        return self.planes[self.getFace(intersection)].getAmbient(
+            intersection, footprint
+        )
 
-    def getDiffuse(self, intersection=None):
-        return self.last_intersection.getDiffuse(intersection)
+    def getDiffuse(self, intersection=None, footprint=0.0):
+        return self.planes[self.getFace(intersection)].getDiffuse(
+            intersection, footprint
+        )
+
+    def getColor(self, intersection, footprint=0.0):
+        ambient, diffuse, _ = self.planes[self.getFace(intersection)].getColor(
+            intersection, footprint
+        )
+        return ambient, diffuse, self.getSpecular(intersection, footprint)
+
+    def getInteraction(self, intersection, normal, footprint=0.0):
+        # The normal from getNormal already names the face, which looks its
+        # colors up itself, while the cube's own material gives the highlight
+        surface = self.planes[self.getNormalFace(normal)]
+        hit = surface.getInteraction(intersection, normal, footprint)
+        hit.specular = self.getSpecular(intersection, footprint)
+        hit.shine = self.getShine()
+        hit.specularCoefficient = self.getSpecularCoefficient()
+        return hit
 
     def intersect(self, ray: Ray):
-        entries = 0
+        """Slab test in the cube's basis. Returns the distance to where the
+        ray enters the cube, or inf if it misses. The distance is negative
+        if the cube is behind the ray or contains its position. Shading
+        finds the face from the intersection, see getFace."""
+        p = (self.axes @ (ray.position - self.position)).tolist()
+        v = (self.axes @ ray.direction).tolist()
+        hl = self.length / 2
+
         maxEntry = -np.inf
         minExit = np.inf
 
-        for surface in self.planes:
-            # does the ray intersect with the given plane
-            intersect = surface.intersect(ray)
-            intersect_point = ray.getPositionAt(intersect)
-            # if it doesnt we dont need to do the follows
-            if intersect == np.inf:
+        for axis in range(3):
+            if v[axis] == 0:
+                # Parallel to this slab, so it has to start between its planes
+                if abs(p[axis]) > hl:
+                    return np.inf
                 continue
-            # check if exiting
-            if surface.getNormal(intersect).dot(ray.direction) > 0.000000000001:
-                # if exiting add to exit
-                if intersect < minExit:
-                    minExit = intersect
-            else:
-                entries = 1
-                if intersect > maxEntry:
-                    maxEntry = intersect
-                    self.last_intersection = surface
-
-        if entries == 0:
-            return np.inf
+
+            entry = (-hl - p[axis]) / v[axis]
+            exit = (hl - p[axis]) / v[axis]
+            if entry > exit:
+                entry, exit = exit, entry
+
+            if entry > maxEntry:
+                maxEntry = entry
+            if exit < minExit:
+                minExit = exit
 
         if maxEntry < minExit:
             return maxEntry
 
         return np.inf
 
+    def getFace(self, intersection):
+        """Index into self.planes of the face the intersection lies on."""
+        return self.getFaces(intersection[np.newaxis])[0]
+
     def getNormal(self, intersection):
-        return self.last_intersection.getNormal(intersection)
+        return self.planes[self.getFace(intersection)].getNormal(intersection)
+
+    def getNormalFace(self, normal):
+        """Index into self.planes of the face with the given outward normal."""
+        local = self.axes @ normal
+        axis = np.argmax(np.abs(local))
+        return 2 * axis + (local[axis] < 0)
+
+    def getBounds(self):
+        extent = np.abs(self.axes).sum(axis=0) * self.length / 2
+        return self.position - extent, self.position + extent
+
+    def intersectRays(self, rays: RayPacket):
+        """Same as intersect, for every ray in a RayPacket."""
+        p = (rays.positions - self.position) @ self.axes.T
+        v = rays.directions @ self.axes.T
+        hl = self.length / 2
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t1 = (-hl - p) / v
+            t2 = (hl - p) / v
+
+        entries = np.nan_to_num(np.fmin(t1, t2), nan=-np.inf)
+        exits = np.nan_to_num(np.fmax(t1, t2), nan=np.inf)
+
+        maxEntry = entries.max(axis=1)
+        return np.where(maxEntry < exits.min(axis=1), maxEntry, np.inf)
+
+    def getFaces(self, intersections):
+        """Index into self.planes of the face each intersection lies on."""
+        local = (intersections - self.position) @ self.axes.T
+        axis = np.argmax(np.abs(local), axis=1)
+        negative = local[np.arange(len(local)), axis] < 0
+        return 2 * axis + negative
+
+    def getNormals(self, intersections):
+        normals = np.array([surface.normal for surface in self.planes])
+        return normals[self.getFaces(intersections)]
+
+    def getAmbients(self, intersections, footprints=0.0):
+        faces = self.getFaces(intersections)
+        colors = np.empty(intersections.shape, dtype=np.float32)
+        for i, surface in enumerate(self.planes):
+            mask = faces == i
+            if mask.any():
+                colors[mask] = surface.getAmbients(
+                    intersections[mask], np.broadcast_to(footprints, faces.shape)[mask]
+                )
+        return colors
+
+    def getDiffuses(self, intersections, footprints=0.0):
+        faces = self.getFaces(intersections)
+        colors = np.empty(intersections.shape, dtype=np.float32)
+        for i, surface in enumerate(self.planes):
+            mask = faces == i
+            if mask.any():
+                colors[mask] = surface.getDiffuses(
+                    intersections[mask], np.broadcast_to(footprints, faces.shape)[mask]
+                )
+        return colors
+
+    def getColors(self, intersections, footprints=0.0):
+        # Faces found once, each looking up its ambient and diffuse together
+        faces = self.getFaces(intersections)
+        ambients = np.empty(intersections.shape, dtype=np.float32)
+        diffuses = np.empty(intersections.shape, dtype=np.float32)
+        for i, surface in enumerate(self.planes):
+            mask = faces == i
+            if mask.any():
+                ambients[mask], diffuses[mask], _ = surface.getColors(
+                    intersections[mask], np.broadcast_to(footprints, faces.shape)[mask]
+                )
+        return ambients, diffuses, self.getSpeculars(intersections, footprints)
 
 
 class TexturedCube(Cube):
@@ -448,6 +883,7 @@ class TexturedCube(Cube):
         cube_aligned=True,
         scale_u=1.0,
         scale_v=1.0,
+        filtering="nearest",
     ):
         super().__init__(
             pos,
@@ -474,6 +910,7 @@ class TexturedCube(Cube):
                     v=self.y_axis,
                     scale_u=scale_u,
                     scale_v=scale_v,
+                    filtering=filtering,
                 ),
                 TexturedPlane(
                     -self.x_axis,
@@ -483,6 +920,7 @@ class TexturedCube(Cube):
                     v=self.y_axis,
                     scale_u=scale_u,
                     scale_v=scale_v,
+                    filtering=filtering,
                 ),
                 TexturedPlane(
                     self.y_axis,
@@ -492,6 +930,7 @@ class TexturedCube(Cube):
                     v=self.z_axis,
                     scale_u=scale_u,
                     scale_v=scale_v,
+                    filtering=filtering,
                 ),
                 TexturedPlane(
                     -self.y_axis,
@@ -501,6 +940,7 @@ class TexturedCube(Cube):
                     v=self.z_axis,
                     scale_u=scale_u,
                     scale_v=scale_v,
+                    filtering=filtering,
                 ),
                 TexturedPlane(
                     self.z_axis,
@@ -510,6 +950,7 @@ class TexturedCube(Cube):
                     v=self.y_axis,
                     scale_u=scale_u,
                     scale_v=scale_v,
+                    filtering=filtering,
                 ),
                 TexturedPlane(
                     -self.z_axis,
@@ -519,6 +960,7 @@ class TexturedCube(Cube):
                     v=self.y_axis,
                     scale_u=scale_u,
                     scale_v=scale_v,
+                    filtering=filtering,
                 ),
             ]
         else:
@@ -529,6 +971,7 @@ class TexturedCube(Cube):
                     left,
                     scale_u=scale_u,
                     scale_v=scale_v,
+                    filtering=filtering,
                 ),
                 TexturedPlane(
                     -self.x_axis,
@@ -536,6 +979,7 @@ class TexturedCube(Cube):
                     down,
                     scale_u=scale_u,
                     scale_v=scale_v,
+                    filtering=filtering,
                 ),
                 TexturedPlane(
                     self.y_axis,
@@ -543,6 +987,7 @@ class TexturedCube(Cube):
                     up_t,
                     scale_u=scale_u,
                     scale_v=scale_v,
+                    filtering=filtering,
                 ),
                 TexturedPlane(
                     -self.y_axis,
@@ -550,6 +995,7 @@ class TexturedCube(Cube):
                     right,
                     scale_u=scale_u,
                     scale_v=scale_v,
+                    filtering=filtering,
                 ),
                 TexturedPlane(
                     self.z_axis,
@@ -557,6 +1003,7 @@ class TexturedCube(Cube):
                     front,
                     scale_u=scale_u,
                     scale_v=scale_v,
+                    filtering=filtering,
                 ),
                 TexturedPlane(
                     -self.z_axis,
@@ -564,6 +1011,7 @@ class TexturedCube(Cube):
                     back,
                     scale_u=scale_u,
                     scale_v=scale_v,
+                    filtering=filtering,
                 ),
             ]
 
@@ -572,18 +1020,37 @@ class CubeTextured3D(Cube):
     def __init__(self, pos, forward, up, length, material):
         super().__init__(pos, forward, up, length, material)
 
-    def getAmbient(self, intersection):
+    def getAmbients(self, intersections, footprints=0.0):
+        return self.material.getAmbients(intersections, footprints)
+
+    def getDiffuses(self, intersections, footprints=0.0):
+        return self.material.getDiffuses(intersections, footprints)
+
+    def getSpeculars(self, intersections, footprints=0.0):
+        return self.material.getSpeculars(intersections, footprints)
+
+    def getColors(self, intersections, footprints=0.0):
+        return self.material.getColors(intersections, footprints)
+
+    def getColor(self, intersection, footprint=0.0):
+        return self.material.getColor(*intersection, footprint)
+
+    def getInteraction(self, intersection, normal, footprint=0.0):
+        # The pattern runs through the whole cube, so no face is needed
+        return Object3D.getInteraction(self, intersection, normal, footprint)
+
+    def getAmbient(self, intersection, footprint=0.0):
         x, y, z = intersection
-        return self.material.getAmbient(x, y, z)
+        return self.material.getAmbient(x, y, z, footprint)
 
-    def getDiffuse(self, intersection=None):
+    def getDiffuse(self, intersection=None, footprint=0.0):
         """Getter method for the material's diffuse color.
         Intersection parameter is unused for Ray Tracing Basics."""
         x, y, z = intersection
-        return self.material.getDiffuse(x, y, z)
+        return self.material.getDiffuse(x, y, z, footprint)
 
-    def getSpecular(self, intersection=None):
+    def getSpecular(self, intersection=None, footprint=0.0):
         """Getter method for the material's specular color.
         Intersection parameter is unused for Ray Tracing Basics."""
         x, y, z = intersection
-        return self.material.getSpecular(x, y, z)
+        return self.material.getSpecular(x, y, z, footprint)
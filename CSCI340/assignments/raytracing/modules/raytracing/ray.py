@@ -1,10 +1,18 @@
-from ..utils.vector import normalize, vec
+import numpy as np
+
+from ..utils.vector import normalize, normalizeRows, vec
 
 
 class Ray(object):
-    def __init__(self, position, direction):
+    """A ray with a position and direction. Footprint is the width the ray
+    covers at its position, and spread how much that grows per unit of
+    distance, so a camera ray covers about one pixel wherever it lands."""
+
+    def __init__(self, position, direction, footprint=0.0, spread=0.0):
         self.position = vec(position)
         self.direction = normalize(vec(direction))
+        self.footprint = footprint
+        self.spread = spread
 
     def __repr__(self):
         return "Ray: " + repr(self.position) + repr(self.direction)
@@ -15,6 +23,49 @@ class Ray(object):
     def getPositionAt(self, distance):
         return self.position + distance * self.direction
 
+    def getFootprintAt(self, distance):
+        return self.footprint + distance * self.spread
+
+
+class RayPacket(object):
+    """A batch of rays stored as (N, 3) float32 arrays of positions and
+    directions, for tracing many rays at once. Footprints and spreads are
+    (N,) arrays, the same as for a Ray."""
+
+    def __init__(self, positions, directions, footprints=0.0, spreads=0.0):
+        directions = np.asarray(directions, dtype=np.float32)
+        self.positions = np.array(
+            np.broadcast_to(positions, directions.shape), dtype=np.float32
+        )
+        self.directions = normalizeRows(directions)
+        self.footprints = np.array(
+            np.broadcast_to(footprints, len(directions)), dtype=np.float32
+        )
+        self.spreads = np.array(
+            np.broadcast_to(spreads, len(directions)), dtype=np.float32
+        )
+
+    def __len__(self):
+        return len(self.directions)
+
+    def __repr__(self):
+        return f"RayPacket: {len(self)} rays"
+
+    def __getitem__(self, mask):
+        """Returns the packet of rays selected by a mask or index array."""
+        packet = RayPacket.__new__(RayPacket)
+        packet.positions = self.positions[mask]
+        packet.directions = self.directions[mask]
+        packet.footprints = self.footprints[mask]
+        packet.spreads = self.spreads[mask]
+        return packet
+
+    def getPositionsAt(self, distances):
+        return self.positions + distances[:, np.newaxis] * self.directions
+
+    def getFootprintsAt(self, distances):
+        return self.footprints + distances * self.spreads
+
 
 if __name__ == "__main__":
     r = Ray((2, 0, 0), (-1, 0, 0))
@@ -11,6 +11,7 @@ from .camera import Camera
 from ..utils.vector import vec
 from .materials import Material
 from .lights import PointLight
+from .bvh import BVH
 
 
 class Scene(object):
@@ -32,9 +33,30 @@ class Scene(object):
         self.objects = []
         self.lights = []
         self.camera = Camera(focus, direction, up, fov, distance, aspect)
+        self.bvh = None
+        self.unbounded = []
+
+    def finalize(self, useBVH=True):
+        """Call once the objects are set up. Builds a bounding volume
+        hierarchy over the finite objects if useBVH, leaving unbounded
+        objects such as planes to be checked one by one. Must be called
+        again if self.objects changes."""
+        self.bvh = None
+        self.unbounded = list(enumerate(self.objects))
+
+        if useBVH:
+            bounded = [(i, o) for i, o in self.unbounded if o.getBounds() is not None]
+            self.unbounded = [
+                (i, o) for i, o in self.unbounded if o.getBounds() is None
+            ]
+            if bounded:
+                self.bvh = BVH(bounded)
 
     def nearestObject(self, ray):
         """Returns the nearest collision object and the distance to the object."""
+        if self.bvh is not None:
+            return self.nearestObjectBVH(ray)
+
         distances = [o.intersect(ray) for o in self.objects]
         nearestObj = None
         minDistance = np.inf
@@ -48,9 +70,28 @@ class Scene(object):
 
         return nearestObj, minDistance
 
+    def nearestObjectBVH(self, ray):
+        nearestObj = None
+        minDistance = np.inf
+
+        for _, o in self.unbounded:
+            distance = o.intersect(ray)
+            if EPSILON <= distance < minDistance:
+                nearestObj = o
+                minDistance = distance
+
+        obj, distance = self.bvh.nearest(ray, minDistance, EPSILON)
+        if obj is not None:
+            return obj, distance
+
+        return nearestObj, minDistance
+
     def shadowed(self, obj, ray):
         """Returns the nearest collision object and the distance to the object,
         excluding obj."""
+        if self.bvh is not None:
+            return self.shadowedBVH(obj, ray)
+
         distances = [
             o.intersect(ray) for o in self.objects if o is not obj and o.hittable
         ]
@@ -60,3 +101,120 @@ class Scene(object):
                 minDistance = distances[i]
 
         return minDistance
+
+    def shadowedBVH(self, obj, ray):
+        minDistance = np.inf
+        for _, o in self.unbounded:
+            if o is not obj and o.hittable:
+                distance = o.intersect(ray)
+                if distance < minDistance:
+                    minDistance = distance
+
+        _, minDistance = self.bvh.nearest(
+            ray, minDistance, exclude=obj, hittableOnly=True
+        )
+        return minDistance
+
+    def occluded(self, obj, ray, maxDistance, light=None):
+        """Returns True as soon as any hittable object other than obj is hit
+        closer than maxDistance. Tests the light's last occluder first and
+        remembers the new one."""
+        exclude = (obj,)
+        if light is not None and light.lastOccluder is not None:
+            o = light.lastOccluder
+            if o is not obj and EPSILON <= o.intersect(ray) < maxDistance:
+                return True
+            exclude = (obj, o)
+
+        blocker = None
+        objects = self.unbounded if self.bvh is not None else enumerate(self.objects)
+        for _, o in objects:
+            if o in exclude or not o.hittable:
+                continue
+            if EPSILON <= o.intersect(ray) < maxDistance:
+                blocker = o
+                break
+
+        if blocker is None and self.bvh is not None:
+            blocker = self.bvh.anyHit(ray, maxDistance, EPSILON, exclude, True)
+
+        if blocker is None:
+            return False
+
+        if light is not None:
+            light.lastOccluder = blocker
+        return True
+
+    def nearestObjects(self, rays):
+        """Returns the index into self.objects of the nearest collision object
+        for every ray in a RayPacket (-1 for no collision) and the distances."""
+        nearestIndices = np.full(len(rays), -1)
+        minDistances = np.full(len(rays), np.inf, dtype=np.float32)
+
+        objects = self.unbounded if self.bvh is not None else enumerate(self.objects)
+        for i, o in objects:
+            distances = o.intersectRays(rays)
+            nearer = (distances >= EPSILON) & (distances < minDistances)
+            nearestIndices[nearer] = i
+            minDistances[nearer] = distances[nearer]
+
+        if self.bvh is not None:
+            self.bvh.nearestRays(rays, nearestIndices, minDistances, EPSILON)
+
+        return nearestIndices, minDistances
+
+    def shadowedRays(self, index, rays):
+        """Returns the distance to the nearest collision for every ray in a
+        RayPacket, excluding the object at index."""
+        minDistances = np.full(len(rays), np.inf, dtype=np.float32)
+
+        objects = self.unbounded if self.bvh is not None else enumerate(self.objects)
+        for i, o in objects:
+            if i != index and o.hittable:
+                minDistances = np.fmin(minDistances, o.intersectRays(rays))
+
+        if self.bvh is not None:
+            self.bvh.nearestRays(
+                rays,
+                np.full(len(rays), -1),
+                minDistances,
+                exclude=index,
+                hittableOnly=True,
+            )
+
+        return minDistances
+
+    def occludedRays(self, index, rays, maxDistances, light=None):
+        """Returns a mask of the rays in a RayPacket that hit any hittable
+        object other than the object at index closer than maxDistances.
+        Tests the light's last occluder first and remembers the new one."""
+        blocked = np.zeros(len(rays), dtype=bool)
+        exclude = (self.objects[index],)
+        blocker = None
+
+        objects = self.unbounded if self.bvh is not None else enumerate(self.objects)
+        if light is not None and light.lastOccluder is not None:
+            objects = [(None, light.lastOccluder)] + list(objects)
+
+        for _, o in objects:
+            if o in exclude or not o.hittable:
+                continue
+            exclude += (o,)
+            active = np.flatnonzero(~blocked)
+            if len(active) == 0:
+                break
+            distances = o.intersectRays(rays[active])
+            hit = (distances >= EPSILON) & (distances < maxDistances[active])
+            if hit.any():
+                blocked[active[hit]] = True
+                blocker = o
+
+        if self.bvh is not None and not blocked.all():
+            blocker = (
+                self.bvh.anyHitRays(rays, maxDistances, blocked, EPSILON, exclude, True)
+                or blocker
+            )
+
+        if light is not None and blocker is not None:
+            light.lastOccluder = blocker
+        return blocked
@@ -0,0 +1,147 @@
+"""
+Optional counters and timers for the ray tracer. enable() wraps the
+queries and intersect methods of one tracer to measure them, and
+disable() puts them back, so a tracer without stats runs the same code
+it always did.
+"""
+
+import time
+from collections import Counter
+
+# Kinds of rays, in the order they are reported
+RAY_KINDS = ("primary", "shadow", "reflection", "refraction")
+
+# The stats being collected, or None when stats are off. The tracer checks
+# this before counting the reflection and refraction rays it makes.
+collector = None
+
+
+class TraceStats(object):
+    """Rays traced by kind, intersection tests by primitive type, rays at
+    each recursion depth, and the time spent tracing and finding
+    intersections."""
+
+    def __init__(self):
+        self.rays = Counter()
+        self.intersections = Counter()
+        self.depths = Counter()
+        self.traceTime = 0.0
+        self.intersectionTime = 0.0
+
+        # (owner, name, previous instance attribute or None) per wrapper
+        self.wrapped = []
+
+    def countRays(self, kind, number=1):
+        self.rays[kind] += number
+
+    def getShadingTime(self):
+        """Time tracing that was not spent finding intersections."""
+        return self.traceTime - self.intersectionTime
+
+    def wrap(self, owner, name, wrapper):
+        """Replaces owner.name with wrapper(owner.name) on the instance."""
+        self.wrapped.append((owner, name, owner.__dict__.get(name)))
+        setattr(owner, name, wrapper(getattr(owner, name)))
+
+    def unwrap(self):
+        for owner, name, previous in reversed(self.wrapped):
+            if previous is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, previous)
+        self.wrapped = []
+
+    def report(self):
+        """Returns the stats as lines of text."""
+        lines = ["Rays"]
+        for kind in RAY_KINDS:
+            lines.append(f"  {kind:18}{self.rays[kind]:>14,}")
+
+        lines.append("Intersection tests")
+        for kind, count in self.intersections.most_common():
+            lines.append(f"  {kind:18}{count:>14,}")
+
+        lines.append("Rays by recursion depth")
+        for depth in range(max(self.depths, default=-1) + 1):
+            lines.append(f"  {depth:<18}{self.depths[depth]:>14,}")
+
+        lines.append(f"Tracing time:       {self.traceTime:.3f} seconds")
+        lines.append(f"Intersection time:  {self.intersectionTime:.3f} seconds")
+        lines.append(f"Shading time:       {self.getShadingTime():.3f} seconds")
+        return "\n".join(lines)
+
+
+def enable(tracer):
+    """Starts collecting stats for a ray tracer and returns them. Wraps the
+    objects in tracer.scene.objects at the time of the call."""
+    global collector
+    disable()
+    stats = collector = TraceStats()
+
+    def timeTracing(method, packet):
+        def trace(*args, **kwargs):
+            stats.rays["primary"] += len(args[0]) if packet else 1
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stats.traceTime += time.perf_counter() - start
+
+        return trace
+
+    def countDepth(method, packet):
+        def trace(rays, r_level=0):
+            stats.depths[r_level] += len(rays) if packet else 1
+            return method(rays, r_level)
+
+        return trace
+
+    def timeQuery(method, kind, rayArgument, packet):
+        def query(*args, **kwargs):
+            if kind is not None:
+                stats.rays[kind] += len(args[rayArgument]) if packet else 1
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stats.intersectionTime += time.perf_counter() - start
+
+        return query
+
+    def countTests(method, primitive, packet):
+        def intersect(rays):
+            stats.intersections[primitive] += len(rays) if packet else 1
+            return method(rays)
+
+        return intersect
+
+    stats.wrap(tracer, "getColor", lambda m: timeTracing(m, False))
+    stats.wrap(tracer, "getColors", lambda m: timeTracing(m, True))
+    stats.wrap(tracer, "getColorR", lambda m: countDepth(m, False))
+    stats.wrap(tracer, "getColorsR", lambda m: countDepth(m, True))
+
+    scene = tracer.scene
+    stats.wrap(scene, "nearestObject", lambda m: timeQuery(m, None, 0, False))
+    stats.wrap(scene, "nearestObjects", lambda m: timeQuery(m, None, 0, True))
+    stats.wrap(scene, "shadowed", lambda m: timeQuery(m, "shadow", 1, False))
+    stats.wrap(scene, "occluded", lambda m: timeQuery(m, "shadow", 1, False))
+    stats.wrap(scene, "shadowedRays", lambda m: timeQuery(m, "shadow", 1, True))
+    stats.wrap(scene, "occludedRays", lambda m: timeQuery(m, "shadow", 1, True))
+
+    for o in scene.objects:
+        primitive = type(o).__name__
+        stats.wrap(o, "intersect", lambda m: countTests(m, primitive, False))
+        stats.wrap(o, "intersectRays", lambda m: countTests(m, primitive, True))
+
+    return stats
+
+
+def disable():
+    """Stops collecting stats and puts the wrapped methods back. Returns
+    the stats collected, or None if stats were off."""
+    global collector
+    stats = collector
+    if stats is not None:
+        stats.unwrap()
+    collector = None
+    return stats
@@ -0,0 +1,159 @@
+"""
+Image textures decoded once into numpy arrays and sampled in batches.
+"""
+
+import hashlib, os
+
+import numpy as np
+
+# Decoded textures are saved here, named by the hash of the image file, so
+# later runs and worker processes map them from disk instead of decoding
+CACHE_FOLDER = "texture_cache"
+
+
+class Texture(object):
+    """An image stored as a contiguous (height, width, 3) float32 array of
+    colors between 0 and 1. Sample with percentages along u and v."""
+
+    # Decoded textures by file name, so each file is only decoded once
+    _loaded = {}
+
+    def __init__(self, pixels, name=None, digest=None):
+        self.pixels = np.ascontiguousarray(pixels, dtype=np.float32)
+        self.height, self.width = self.pixels.shape[:2]
+        self.name = name
+        # SHA-1 of the image file, for anything keyed by its contents
+        self.digest = digest
+        self.mipmaps = None
+
+    @classmethod
+    def load(cls, fileName):
+        """Loads and decodes an image file, reusing it if already loaded."""
+        if fileName not in cls._loaded:
+            pixels, digest = cls.loadPixels(fileName)
+            cls._loaded[fileName] = cls(pixels, fileName, digest)
+        return cls._loaded[fileName]
+
+    @classmethod
+    def getDigests(cls):
+        """SHA-1 of every loaded image file, by file name."""
+        return {name: texture.digest for name, texture in cls._loaded.items()}
+
+    @staticmethod
+    def loadPixels(fileName):
+        """Decoded pixels of an image file, and the SHA-1 of the file.
+        Memory maps the pixels from CACHE_FOLDER if the same image was
+        decoded before, otherwise decodes and caches them. The cache is
+        keyed by the contents of the file, so an edited image is decoded
+        again."""
+        with open(fileName, "rb") as image:
+            digest = hashlib.sha1(image.read()).hexdigest()
+        cachePath = os.path.join(CACHE_FOLDER, digest + ".npy")
+
+        if os.path.exists(cachePath):
+            return np.load(cachePath, mmap_mode="r"), digest
+
+        # Only needed to decode, which the cache mostly saves
+        import pygame
+
+        surface = pygame.image.load(fileName)
+        # surfarray is indexed [x, y], textures are indexed [y, x]
+        pixels = pygame.surfarray.array3d(surface).swapaxes(0, 1) / 255.0
+        pixels = np.ascontiguousarray(pixels, dtype=np.float32)
+
+        # Written to a temporary file first so other processes never map
+        # half of one
+        os.makedirs(CACHE_FOLDER, exist_ok=True)
+        tempPath = f"{cachePath}.{os.getpid()}.tmp"
+        with open(tempPath, "wb") as cache:
+            np.save(cache, pixels)
+        os.replace(tempPath, cachePath)
+
+        return pixels, digest
+
+    def sample(self, u, v, filtering="nearest", footprint=0.0):
+        """Colors at percentages u and v, which may be scalars or arrays of
+        any shape. Filtering is "nearest", "bilinear" or "trilinear".
+        Trilinear picks a mipmap level from the footprint, the width of each
+        sample in the same percentages as u and v."""
+        u = np.asarray(u)
+        v = np.asarray(v)
+
+        if filtering == "trilinear":
+            return self.sampleTrilinear(u, v, footprint)
+        if filtering == "bilinear":
+            return self.sampleBilinear(u, v)
+        return self.sampleNearest(u, v)
+
+    def getMipmaps(self):
+        """Returns the mipmap pyramid, built on first use. Level 0 is this
+        texture, each level after is half the size of the one before."""
+        if self.mipmaps is None:
+            self.mipmaps = [self]
+            pixels = self.pixels
+            while max(pixels.shape[:2]) > 1:
+                # Average pairs of rows then pairs of columns. An odd last
+                # row or column is repeated to make its pair, not dropped,
+                # so every level still spans the whole texture.
+                h, w = pixels.shape[:2]
+                if h > 1:
+                    if h % 2:
+                        pixels = np.concatenate([pixels, pixels[-1:]])
+                    pixels = (pixels[0::2] + pixels[1::2]) / 2
+                if w > 1:
+                    if w % 2:
+                        pixels = np.concatenate([pixels, pixels[:, -1:]], axis=1)
+                    pixels = (pixels[:, 0::2] + pixels[:, 1::2]) / 2
+                self.mipmaps.append(Texture(pixels, self.name))
+        return self.mipmaps
+
+    def sampleTrilinear(self, u, v, footprint):
+        mipmaps = self.getMipmaps()
+        shape = u.shape
+        u = u.ravel()
+        v = v.ravel()
+
+        # Level where one texel covers the footprint
+        texels = np.broadcast_to(footprint, shape).ravel() * max(
+            self.width, self.height
+        )
+        lod = np.clip(np.log2(np.maximum(texels, 1e-12)), 0, len(mipmaps) - 1)
+        low = np.floor(lod).astype(int)
+        high = np.minimum(low + 1, len(mipmaps) - 1)
+        frac = (lod - low).astype(np.float32)
+
+        colors = np.zeros((len(u), 3), dtype=np.float32)
+        for level in np.union1d(low, high):
+            weights = np.where(low == level, 1 - frac, 0) + np.where(
+                high == level, frac, 0
+            )
+            used = weights > 0
+            colors[used] += (
+                mipmaps[level].sampleBilinear(u[used], v[used])
+                * weights[used, np.newaxis]
+            )
+
+        return colors.reshape(shape + (3,))
+
+    def sampleNearest(self, u, v):
+        x = (u * self.width).astype(int) % self.width
+        y = (v * self.height).astype(int) % self.height
+        return self.pixels[y, x]
+
+    def sampleBilinear(self, u, v):
+        # Texel centers sit at half steps, wrap around the edges to tile
+        x = u * self.width - 0.5
+        y = v * self.height - 0.5
+        x0 = np.floor(x)
+        y0 = np.floor(y)
+        xFrac = (x - x0)[..., np.newaxis].astype(np.float32)
+        yFrac = (y - y0)[..., np.newaxis].astype(np.float32)
+
+        x0 = x0.astype(int) % self.width
+        y0 = y0.astype(int) % self.height
+        x1 = (x0 + 1) % self.width
+        y1 = (y0 + 1) % self.height
+
+        top = self.pixels[y0, x0] * (1 - xFrac) + self.pixels[y0, x1] * xFrac
+        bottom = self.pixels[y1, x0] * (1 - xFrac) + self.pixels[y1, x1] * xFrac
+        return top * (1 - yFrac) + bottom * yFrac
@@ -0,0 +1,201 @@
+"""
+Patterns baked into tileable 3D volumes of colors, looked up with
+trilinear interpolation instead of evaluating noise at every hit.
+"""
+
+import hashlib, os
+
+import numpy as np
+
+from ..utils.noise import NoisePatterns
+from ..utils.patterns import CompiledPattern
+
+# Baked volumes are saved here, named by their settings, so later runs and
+# worker processes map them from disk instead of baking again
+VOLUME_FOLDER = "volume_cache"
+
+# Random points the pattern and the volume are compared at after a bake
+ERROR_POINTS = 4096
+
+
+def getNoiseKey(pattern):
+    """What the noise of pattern is made from, when it is a NoisePatterns
+    method or a compiled pattern graph: the SHA-1 of the noise tables, and
+    which machines use them. None for other patterns."""
+    owner = getattr(pattern, "__self__", None)
+    if isinstance(owner, NoisePatterns):
+        tables = owner.getTables()
+        machines = (owner.backend, owner.noiseId)
+    elif isinstance(pattern, CompiledPattern):
+        used = [
+            node.parameters[0]
+            for node in pattern.order
+            if node.operation in ("noise2d", "noise3d")
+        ]
+        tables = [table for machine in used for table in machine.getTables()]
+        machines = tuple(type(machine).__name__ for machine in used)
+    else:
+        return None
+
+    digest = hashlib.sha1()
+    for table in tables:
+        digest.update(np.ascontiguousarray(table).tobytes())
+    return machines, digest.hexdigest()
+
+
+class NoiseVolume(object):
+    """A pattern sampled on a (resolution, resolution, resolution, 3) float32
+    grid of colors, indexed [x, y, z], spanning a box of size from origin.
+    Lookups wrap around, so the volume repeats every size along each axis.
+    That is seamless when the pattern repeats too, like clouds3DTiled with
+    mods equal to the size."""
+
+    def __init__(self, colors, origin, size, error=None):
+        self.colors = np.ascontiguousarray(colors, dtype=np.float32)
+        self.resolution = self.colors.shape[0]
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.size = np.broadcast_to(np.asarray(size, dtype=np.float64), (3,))
+
+        # Largest difference from the pattern measured after baking, or None
+        # when loaded from disk
+        self.error = error
+
+    @classmethod
+    def bake(
+        cls, pattern, origin, size, resolution=32, errorBound=None, maxResolution=128
+    ):
+        """Samples pattern, which takes arrays of x, y and z and returns an
+        array of colors like the NoisePatterns do, at resolution points
+        along each axis. With an errorBound the resolution doubles until the
+        largest difference between the volume and the pattern at random
+        points is at most errorBound, or the resolution is maxResolution."""
+        origin = np.asarray(origin, dtype=np.float64)
+        size = np.broadcast_to(np.asarray(size, dtype=np.float64), (3,))
+
+        points, expected = cls.getErrorPoints(pattern, origin, size)
+
+        while True:
+            colors = cls.sampleGrid(pattern, origin, size, resolution)
+            volume = cls(colors, origin, size)
+            volume.error = volume.measureError(points, expected)
+
+            if errorBound is None or volume.error <= errorBound:
+                return volume
+            if resolution >= maxResolution:
+                return volume
+            resolution = min(resolution * 2, maxResolution)
+
+    @staticmethod
+    def getErrorPoints(pattern, origin, size):
+        """The random points a bake is checked at, the same every time, and
+        the colors of pattern there."""
+        rng = np.random.default_rng(0)
+        points = origin + rng.random((ERROR_POINTS, 3)) * size
+        return points, pattern(*points.T)
+
+    def measureError(self, points, expected):
+        """Largest difference from the expected colors at points."""
+        return float(np.abs(self.sample(*points.T) - expected).max())
+
+    @staticmethod
+    def sampleGrid(pattern, origin, size, resolution):
+        """Colors of pattern on the grid, one slab of x at a time to keep
+        the noise's temporary arrays small."""
+        steps = np.arange(resolution) / resolution
+        y, z = np.meshgrid(
+            origin[1] + steps * size[1], origin[2] + steps * size[2], indexing="ij"
+        )
+
+        colors = np.empty((resolution,) * 3 + (3,), dtype=np.float32)
+        for i, step in enumerate(steps):
+            x = np.full_like(y, origin[0] + step * size[0])
+            colors[i] = pattern(x, y, z)
+        return colors
+
+    @classmethod
+    def load(
+        cls,
+        name,
+        pattern,
+        origin,
+        size,
+        resolution=32,
+        errorBound=None,
+        maxResolution=128,
+        key=None,
+    ):
+        """Memory maps the volume baked for name with these settings from
+        VOLUME_FOLDER, or bakes and saves it the first time. The file is
+        also named by the noise tables of NoisePatterns and compiled
+        patterns, see getNoiseKey, and by key. Change name or key when the
+        pattern's code changes, so it is baked again. With an errorBound a
+        loaded volume is checked against the pattern again, and baked
+        again if it is off by more and could be finer."""
+        settings = (
+            key,
+            getNoiseKey(pattern),
+            tuple(np.ravel(origin).tolist()),
+            tuple(np.ravel(size).tolist()),
+            resolution,
+            errorBound,
+            maxResolution,
+        )
+        digest = hashlib.sha1(repr(settings).encode()).hexdigest()
+        path = os.path.join(VOLUME_FOLDER, f"{name}-{digest[:16]}.npy")
+
+        if os.path.exists(path):
+            volume = cls(np.load(path, mmap_mode="r"), origin, size)
+            if errorBound is None:
+                return volume
+
+            volume.error = volume.measureError(
+                *cls.getErrorPoints(pattern, volume.origin, volume.size)
+            )
+            if volume.error <= errorBound or volume.resolution >= maxResolution:
+                return volume
+
+        volume = cls.bake(pattern, origin, size, resolution, errorBound, maxResolution)
+        volume.save(path)
+        return volume
+
+    def save(self, path):
+        # Written to a temporary file first so other processes never map
+        # half of one
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tempPath = f"{path}.{os.getpid()}.tmp"
+        with open(tempPath, "wb") as volume:
+            np.save(volume, self.colors)
+        os.replace(tempPath, path)
+
+    def sample(self, x, y, z):
+        """Colors at x, y and z, which may be scalars or arrays of any
+        shape, interpolated between the eight nearest grid points."""
+        x, y, z = np.broadcast_arrays(x, y, z)
+        shape = x.shape
+
+        low = []
+        high = []
+        fracs = []
+        for coordinates, origin, size in zip((x, y, z), self.origin, self.size):
+            grid = (coordinates.ravel() - origin) / size * self.resolution
+            floor = np.floor(grid)
+            fracs.append((grid - floor)[:, np.newaxis].astype(np.float32))
+            floor = floor.astype(int) % self.resolution
+            low.append(floor)
+            high.append((floor + 1) % self.resolution)
+
+        (x0, y0, z0), (x1, y1, z1) = low, high
+        xFrac, yFrac, zFrac = fracs
+        c = self.colors
+
+        # lerp along x, then y, then z
+        c00 = c[x0, y0, z0] * (1 - xFrac) + c[x1, y0, z0] * xFrac
+        c10 = c[x0, y1, z0] * (1 - xFrac) + c[x1, y1, z0] * xFrac
+        c01 = c[x0, y0, z1] * (1 - xFrac) + c[x1, y0, z1] * xFrac
+        c11 = c[x0, y1, z1] * (1 - xFrac) + c[x1, y1, z1] * xFrac
+
+        c0 = c00 * (1 - yFrac) + c10 * yFrac
+        c1 = c01 * (1 - yFrac) + c11 * yFrac
+        colors = c0 * (1 - zFrac) + c1 * zFrac
+
+        return colors.reshape(shape + (3,))
@@ -1,8 +1,10 @@
-import pygame
 import numpy as np
 
 
 def makeColor(name):
+    # Only here, so importing this module doesn't load pygame
+    import pygame
+
     pyColor = pygame.Color(name)
     npColor = np.array(pyColor[:-1]) / 255
     return npColor
@@ -16,16 +18,19 @@ def safeMultiply(vector, multiplier):
     return newVector
 
 
+# makeColor of each pygame color name, written out
 COLORS = {
-    "blue": makeColor("blue"),
-    "white": makeColor("white"),
-    "black": makeColor("black"),
-    "red": makeColor("red"),
-    "yellow": makeColor("yellow"),
-    "marble1": makeColor("seagreen1"),
-    "marble2": makeColor("seagreen4"),
-    "wood1": makeColor("sienna1"),
-    "wood2": makeColor("sienna4"),
+    "blue": np.array((0, 0, 255)) / 255,
+    "white": np.array((255, 255, 255)) / 255,
+    "black": np.array((0, 0, 0)) / 255,
+    "red": np.array((255, 0, 0)) / 255,
+    "yellow": np.array((255, 255, 0)) / 255,
+    # seagreen1 and seagreen4
+    "marble1": np.array((84, 255, 159)) / 255,
+    "marble2": np.array((46, 139, 87)) / 255,
+    # sienna1 and sienna4
+    "wood1": np.array((255, 130, 71)) / 255,
+    "wood2": np.array((139, 71, 38)) / 255,
 }
 
 EPSILON = 1e-11
@@ -3,23 +3,118 @@ Author: Liz Matthews, Geoff Matthews
 Noise manager class
 """
 
+import math
+from multiprocessing import shared_memory
 import numpy as np
-from .vector import smerp, lerp
+from .vector import smerp, smerpArray, lerp
 from .definitions import COLORS
+from . import patterns
+
+# Skew and unskew factors between the square grid and the simplex grid
+F2 = 0.5 * (math.sqrt(3.0) - 1.0)
+G2 = (3.0 - math.sqrt(3.0)) / 6.0
+F3 = 1.0 / 3.0
+G3 = 1.0 / 6.0
+
+# Simplex gradients, toward the middles of the edges of a cube
+GRADIENTS = (
+    (1, 1, 0),
+    (-1, 1, 0),
+    (1, -1, 0),
+    (-1, -1, 0),
+    (1, 0, 1),
+    (-1, 0, 1),
+    (1, 0, -1),
+    (-1, 0, -1),
+    (0, 1, 1),
+    (0, -1, 1),
+    (0, 1, -1),
+    (0, -1, -1),
+)
+GRADIENT_ARRAY = np.array(GRADIENTS, dtype=np.float64)
+
+# Machines a NoisePatterns switches between
+NOISE_MACHINES = 5
+
+
+def makeTables(seeds, nvalues=256, minimum=0, maximum=1):
+    """Shuffled values and permutations for every seed, as the rows of two
+    (len(seeds), nvalues) arrays. A seed is an int or a numpy random
+    generator to shuffle with. Each int seed gets a RandomState of its own,
+    never the global one, so the tables do not depend on what else uses
+    numpy's random numbers or on the order machines are made in, and are
+    the same tables np.random.seed(seed) always gave."""
+    seeds = list(seeds)
+    ordered = np.linspace(minimum, maximum, nvalues)
+    values = np.empty((len(seeds), nvalues))
+    permutations = np.empty((len(seeds), nvalues), dtype=np.int64)
+    for row, seed in enumerate(seeds):
+        rng = seed if hasattr(seed, "permutation") else np.random.RandomState(seed)
+        values[row] = rng.permutation(ordered)
+        permutations[row] = rng.permutation(nvalues)
+    return values, permutations
+
+
+def shareTables(tables):
+    """Copies (values, permutations) tables into a new block of shared
+    memory. Returns the block, which the caller closes and unlinks when no
+    process needs it, and a description that attachTables turns back into
+    the tables in any process."""
+    arrays = [np.ascontiguousarray(t) for t in tables]
+    block = shared_memory.SharedMemory(create=True, size=sum(a.nbytes for a in arrays))
+    description = [block.name]
+    offset = 0
+    for a in arrays:
+        shared = np.ndarray(a.shape, a.dtype, buffer=block.buf, offset=offset)
+        shared[...] = a
+        description.append((a.shape, a.dtype.str, offset))
+        offset += a.nbytes
+    return block, tuple(description)
+
+
+def attachTables(description):
+    """The block and the (values, permutations) tables described by
+    shareTables, viewed in place instead of copied. The tables are only
+    valid while the block is open, so keep it with them."""
+    name, *arrays = description
+    block = shared_memory.SharedMemory(name=name)
+    tables = tuple(
+        np.ndarray(shape, dtype, buffer=block.buf, offset=offset)
+        for shape, dtype, offset in arrays
+    )
+    return block, tables
 
 
 class NoiseMachine:
     def __init__(
-        self, noctaves=5, octaveDilation=2, minimum=0, maximum=1, nvalues=256, seed=1234
+        self,
+        noctaves=5,
+        octaveDilation=2,
+        minimum=0,
+        maximum=1,
+        nvalues=256,
+        seed=1234,
+        tables=None,
     ):
         self.noctaves = noctaves
         self.octaveDilation = octaveDilation
-        self.nvalues = nvalues
-        self.values = np.linspace(minimum, maximum, nvalues)
-        self.permutations = np.arange(0, nvalues, 1)
-        np.random.seed(seed)
-        np.random.shuffle(self.values)
-        np.random.shuffle(self.permutations)
+        self.minimum = minimum
+        self.maximum = maximum
+        # The average of any octave, what octaves too fine to see fade to
+        self.mean = (minimum + maximum) / 2
+
+        # tables are the (values, permutations) of another machine, from
+        # getTables, to use instead of shuffling new ones
+        if tables is None:
+            values, permutations = makeTables([seed], nvalues, minimum, maximum)
+            tables = values[0], permutations[0]
+        self.values, self.permutations = tables
+        self.nvalues = len(self.values)
+
+    def getTables(self):
+        """The shuffled (values, permutations) this machine's noise is made
+        from, to make the same machine elsewhere."""
+        return self.values, self.permutations
 
     # One-dimensional noise
     def intNoise(self, i):
@@ -31,12 +126,90 @@ class NoiseMachine:
         xFrac = x - np.floor(x)
         return smerp(a, b, xFrac)
 
-    def noise(self, x):
+    def noise(self, x, filterWidth=0.0):
         s = 0.0
         for i in range(self.noctaves):
-            s += self.smerpNoise(x * self.octaveDilation**i) / 2**i
+            s += (
+                self.filterOctave(
+                    i, filterWidth, self.smerpNoise, x * self.octaveDilation**i
+                )
+                / 2**i
+            )
         return s * 0.5
 
+    # The noise takes a filterWidth, the width of the area a sample stands
+    # for, like a ray's footprint. Octaves finer than that only alias, so
+    # they fade to their mean from a quarter to half of their lattice
+    # spacing, the Nyquist limit, and are not evaluated past it.
+    def getOctaveWeight(self, octave, filterWidth):
+        """How much of an octave to keep, from 1 down to 0 for its mean."""
+        spacing = 1 / self.octaveDilation**octave
+        return min(max(2 - 4 * filterWidth / spacing, 0.0), 1.0)
+
+    def filterOctave(self, octave, filterWidth, octaveNoise, *coordinates):
+        """octaveNoise at the coordinates, faded to the mean by
+        getOctaveWeight. Skips octaveNoise once the weight is 0."""
+        weight = self.getOctaveWeight(octave, filterWidth)
+        if weight <= 0.0:
+            return self.mean
+        noise = octaveNoise(*coordinates)
+        if weight >= 1.0:
+            return noise
+        return self.mean + weight * (noise - self.mean)
+
+    # Array versions of the noise below take numpy arrays of coordinates of
+    # any shape, evaluate every octave at once along a new first axis, and
+    # match the scalar versions. The filterWidth may be an array too.
+    def getOctaves(self, *coordinates):
+        """Broadcasts the coordinates together and scales them for each
+        octave, along a new first axis."""
+        coordinates = np.broadcast_arrays(
+            *[np.asarray(c, dtype=np.float64) for c in coordinates]
+        )
+        shape = (self.noctaves,) + (1,) * coordinates[0].ndim
+        dilations = np.power(self.octaveDilation, np.arange(self.noctaves))
+        return [c * dilations.reshape(shape) for c in coordinates]
+
+    def sumOctaves(self, octaves):
+        """Sums noise along the first axis, halving each octave's weight."""
+        shape = (self.noctaves,) + (1,) * (octaves.ndim - 1)
+        weights = np.power(2.0, np.arange(self.noctaves)).reshape(shape)
+        return (octaves / weights).sum(axis=0) * 0.5
+
+    def fractalArray(self, octaveNoise, coordinates, filterWidth, mods=()):
+        """Sums octaveNoise over the octaves, faded by getOctaveWeight for
+        each point. mods are scaled along with the coordinates, for tiled
+        noise."""
+        octaves = self.getOctaves(*coordinates)
+        shape = (self.noctaves,) + (1,) * (octaves[0].ndim - 1)
+        dilations = np.power(self.octaveDilation, np.arange(self.noctaves))
+        dilations = dilations.reshape(shape)
+        weights = np.clip(2 - 4 * np.asarray(filterWidth) * dilations, 0.0, 1.0)
+        weights = np.broadcast_to(weights, octaves[0].shape)
+
+        # The first octaves every point sees are evaluated together. Finer
+        # ones only where they are seen, which are the near points.
+        seen = weights.reshape(self.noctaves, -1).all(axis=1)
+        together = self.noctaves if seen.all() else int(np.argmin(seen))
+
+        noise = np.full(octaves[0].shape, float(self.mean))
+        noise[:together] = octaveNoise(
+            *[c[:together] for c in octaves],
+            *[mod * dilations[:together] for mod in mods],
+        )
+        for i in range(together, self.noctaves):
+            kept = weights[i] > 0.0
+            if kept.any():
+                noise[i][kept] = octaveNoise(
+                    *[c[i][kept] for c in octaves],
+                    *[mod * dilations[i] for mod in mods],
+                )
+
+        noise = np.where(
+            weights >= 1.0, noise, self.mean + weights * (noise - self.mean)
+        )
+        return self.sumOctaves(noise)
+
     # Three-dimensional noise:
     def intNoise3d(self, i, j, k):
         """Given i , j and k, return a pseudo-random value.
@@ -80,12 +253,48 @@ class NoiseMachine:
 
         return smerp(n0, n1, zFrac)
 
-    def noise3d(self, x, y, z):
+    def smerpNoise3dArray(self, x, y, z):
+        """Same as smerpNoise3d, for arrays of x, y and z."""
+        i = np.floor(x).astype(np.int64)
+        j = np.floor(y).astype(np.int64)
+        k = np.floor(z).astype(np.int64)
+        xFrac = x - i
+        yFrac = y - j
+        zFrac = z - k
+
+        # randoms at eight corners, looked up for every point at once
+        n000 = self.intNoise3d(i, j, k)
+        n100 = self.intNoise3d(i + 1, j, k)
+        n010 = self.intNoise3d(i, j + 1, k)
+        n001 = self.intNoise3d(i, j, k + 1)
+        n110 = self.intNoise3d(i + 1, j + 1, k)
+        n111 = self.intNoise3d(i + 1, j + 1, k + 1)
+        n011 = self.intNoise3d(i, j + 1, k + 1)
+        n101 = self.intNoise3d(i + 1, j, k + 1)
+
+        n01 = smerpArray(n001, n101, xFrac)
+        n00 = smerpArray(n000, n100, xFrac)
+        n11 = smerpArray(n011, n111, xFrac)
+        n10 = smerpArray(n010, n110, xFrac)
+
+        n1 = smerpArray(n01, n11, yFrac)
+        n0 = smerpArray(n00, n10, yFrac)
+
+        return smerpArray(n0, n1, zFrac)
+
+    def noise3dArray(self, x, y, z, filterWidth=0.0):
+        """Same as noise3d, for arrays of x, y and z."""
+        return self.fractalArray(self.smerpNoise3dArray, (x, y, z), filterWidth)
+
+    def noise3d(self, x, y, z, filterWidth=0.0):
         """Cumulative noise at x,y and z using smerp."""
         s = 0.0
         for i in range(self.noctaves):
             s += (
-                self.smerpNoise3d(
+                self.filterOctave(
+                    i,
+                    filterWidth,
+                    self.smerpNoise3d,
                     x * self.octaveDilation**i,
                     y * self.octaveDilation**i,
                     z * self.octaveDilation**i,
@@ -121,24 +330,51 @@ class NoiseMachine:
         # smerp along y
         return smerp(nx0, nx1, yFrac)
 
-    def noise2d(self, x, y):
+    def smerpNoise2dArray(self, x, y):
+        """Same as smerpNoise2d, for arrays of x and y."""
+        i = np.floor(x).astype(np.int64)
+        j = np.floor(y).astype(np.int64)
+        xFrac = x - i
+        yFrac = y - j
+
+        n00 = self.intNoise2d(i, j)
+        n10 = self.intNoise2d(i + 1, j)
+        n01 = self.intNoise2d(i, j + 1)
+        n11 = self.intNoise2d(i + 1, j + 1)
+
+        nx0 = smerpArray(n00, n10, xFrac)
+        nx1 = smerpArray(n01, n11, xFrac)
+        return smerpArray(nx0, nx1, yFrac)
+
+    def noise2dArray(self, x, y, filterWidth=0.0):
+        """Same as noise2d, for arrays of x and y."""
+        return self.fractalArray(self.smerpNoise2dArray, (x, y), filterWidth)
+
+    def noise2d(self, x, y, filterWidth=0.0):
         """Cumulative noise at x and y using smerp."""
         s = 0.0
         for i in range(self.noctaves):
             s += (
-                self.smerpNoise2d(
-                    x * self.octaveDilation**i, y * self.octaveDilation**i
+                self.filterOctave(
+                    i,
+                    filterWidth,
+                    self.smerpNoise2d,
+                    x * self.octaveDilation**i,
+                    y * self.octaveDilation**i,
                 )
                 / 2**i
             )
         return s * 0.5
 
-    def noise2dTiled(self, x, y, xMod, yMod):
+    def noise2dTiled(self, x, y, xMod, yMod, filterWidth=0.0):
         """Cumulative noise at x and y using smerp, tilable."""
         s = 0.0
         for i in range(self.noctaves):
             s += (
-                self.smerpNoise2dTiled(
+                self.filterOctave(
+                    i,
+                    filterWidth,
+                    self.smerpNoise2dTiled,
                     x * self.octaveDilation**i,
                     y * self.octaveDilation**i,
                     xMod * self.octaveDilation**i,
@@ -167,6 +403,330 @@ class NoiseMachine:
         # smerp along y
         return smerp(nx0, nx1, yFrac)
 
+    def noise2dTiledArray(self, x, y, xMod, yMod, filterWidth=0.0):
+        """Same as noise2dTiled, for arrays of x and y."""
+        return self.fractalArray(
+            self.smerpNoise2dTiledArray, (x, y), filterWidth, (xMod, yMod)
+        )
+
+    def smerpNoise2dTiledArray(self, x, y, xMod, yMod):
+        """Same as smerpNoise2dTiled, for arrays of x and y. xMod and yMod
+        broadcast against them."""
+        i = np.floor(x).astype(np.int64)
+        j = np.floor(y).astype(np.int64)
+        xFrac = x - i
+        yFrac = y - j
+
+        n00 = self.intNoise2d(i % xMod, j % yMod)
+        n10 = self.intNoise2d((i + 1) % xMod, j % yMod)
+        n01 = self.intNoise2d(i % xMod, (j + 1) % yMod)
+        n11 = self.intNoise2d((i + 1) % xMod, (j + 1) % yMod)
+
+        nx0 = smerpArray(n00, n10, xFrac)
+        nx1 = smerpArray(n01, n11, xFrac)
+        return smerpArray(nx0, nx1, yFrac)
+
+    # Three-dimensional noise, tilable
+    def noise3dTiled(self, x, y, z, xMod, yMod, zMod, filterWidth=0.0):
+        """Cumulative noise at x, y and z using smerp, repeating every xMod,
+        yMod and zMod. Takes scalars or arrays of x, y and z."""
+        return self.fractalArray(
+            self.smerpNoise3dTiledArray, (x, y, z), filterWidth, (xMod, yMod, zMod)
+        )
+
+    def smerpNoise3dTiledArray(self, x, y, z, xMod, yMod, zMod):
+        """Same as smerpNoise3dArray, tilable. The mods broadcast against x,
+        y and z."""
+        i = np.floor(x).astype(np.int64)
+        j = np.floor(y).astype(np.int64)
+        k = np.floor(z).astype(np.int64)
+        xFrac = x - i
+        yFrac = y - j
+        zFrac = z - k
+
+        i0 = i % xMod
+        j0 = j % yMod
+        k0 = k % zMod
+        i1 = (i + 1) % xMod
+        j1 = (j + 1) % yMod
+        k1 = (k + 1) % zMod
+
+        n000 = self.intNoise3d(i0, j0, k0)
+        n100 = self.intNoise3d(i1, j0, k0)
+        n010 = self.intNoise3d(i0, j1, k0)
+        n001 = self.intNoise3d(i0, j0, k1)
+        n110 = self.intNoise3d(i1, j1, k0)
+        n111 = self.intNoise3d(i1, j1, k1)
+        n011 = self.intNoise3d(i0, j1, k1)
+        n101 = self.intNoise3d(i1, j0, k1)
+
+        n01 = smerpArray(n001, n101, xFrac)
+        n00 = smerpArray(n000, n100, xFrac)
+        n11 = smerpArray(n011, n111, xFrac)
+        n10 = smerpArray(n010, n110, xFrac)
+
+        n1 = smerpArray(n01, n11, yFrac)
+        n0 = smerpArray(n00, n10, yFrac)
+
+        return smerpArray(n0, n1, zFrac)
+
+
+class SimplexNoiseMachine(NoiseMachine):
+    """Simplex noise behind the same noise2d and noise3d interface, with the
+    same octaves and range. Each octave blends 3 corners in 2D and 4 in 3D,
+    where value noise blends 4 and 8. 1D and tiled noise are still the
+    value noise of NoiseMachine, from the same permutations."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Components of the gradient each permutation picks, so the array
+        # versions look them up with the last hash instead of gathering
+        # rows of GRADIENT_ARRAY
+        gradients = GRADIENT_ARRAY[self.permutations % len(GRADIENTS)]
+        self.gradientX, self.gradientY, self.gradientZ = gradients.T.copy()
+
+        # Indexing a list with Python ints is faster for the scalar versions
+        self.permutationList = self.permutations.tolist()
+
+    def gradient2d(self, i, j):
+        """Given i and j, return the index of a pseudo-random gradient."""
+        p = self.permutationList
+        a = p[j % self.nvalues]
+        return p[(i + a) % self.nvalues] % len(GRADIENTS)
+
+    def gradient3d(self, i, j, k):
+        """Given i, j and k, return the index of a pseudo-random gradient."""
+        p = self.permutationList
+        a = p[j % self.nvalues]
+        b = p[(i + a) % self.nvalues]
+        return p[(k + b) % self.nvalues] % len(GRADIENTS)
+
+    def hash2dArray(self, i, j):
+        """Same as gradient2d, for arrays, as an index into gradientX, Y
+        and Z. take with mode="wrap" is the modulo without the temporary."""
+        a = np.take(self.permutations, j, mode="wrap")
+        return (i + a) % self.nvalues
+
+    def hash3dArray(self, i, j, k):
+        """Same as gradient3d, for arrays, as an index into gradientX, Y
+        and Z."""
+        a = np.take(self.permutations, j, mode="wrap")
+        b = np.take(self.permutations, i + a, mode="wrap")
+        return (k + b) % self.nvalues
+
+    def toRange(self, n):
+        """Maps simplex noise from -1 to 1 into minimum to maximum."""
+        return self.minimum + (n + 1) * 0.5 * (self.maximum - self.minimum)
+
+    # Two-dimensional noise
+    def corner2d(self, x, y, i, j):
+        """Contribution of corner i, j at offset x, y from it."""
+        t = 0.5 - x * x - y * y
+        if t < 0:
+            return 0.0
+        g = GRADIENTS[self.gradient2d(i, j)]
+        t *= t
+        return t * t * (g[0] * x + g[1] * y)
+
+    def simplexNoise2d(self, x, y):
+        """Simplex noise at x and y, for one octave."""
+        # Skew into the simplex grid to find the cell, then back
+        s = (x + y) * F2
+        i = math.floor(x + s)
+        j = math.floor(y + s)
+        t = (i + j) * G2
+        x0 = x - (i - t)
+        y0 = y - (j - t)
+
+        # Which triangle of the cell x and y are in
+        i1 = int(x0 > y0)
+        j1 = 1 - i1
+
+        n = self.corner2d(x0, y0, i, j)
+        n += self.corner2d(x0 - i1 + G2, y0 - j1 + G2, i + i1, j + j1)
+        n += self.corner2d(x0 - 1 + 2 * G2, y0 - 1 + 2 * G2, i + 1, j + 1)
+        return self.toRange(70 * n)
+
+    def noise2d(self, x, y, filterWidth=0.0):
+        """Cumulative simplex noise at x and y."""
+        s = 0.0
+        for i in range(self.noctaves):
+            s += (
+                self.filterOctave(
+                    i,
+                    filterWidth,
+                    self.simplexNoise2d,
+                    x * self.octaveDilation**i,
+                    y * self.octaveDilation**i,
+                )
+                / 2**i
+            )
+        return s * 0.5
+
+    def corner2dArray(self, x, y, i, j):
+        """Same as corner2d, for arrays."""
+        t = np.maximum(0.5 - x * x - y * y, 0.0)
+        h = self.hash2dArray(i, j)
+        t *= t
+        return t * t * (self.gradientX[h] * x + self.gradientY[h] * y)
+
+    def simplexNoise2dArray(self, x, y):
+        """Same as simplexNoise2d, for arrays of x and y."""
+        s = (x + y) * F2
+        i = np.floor(x + s).astype(np.int64)
+        j = np.floor(y + s).astype(np.int64)
+        t = (i + j) * G2
+        x0 = x - (i - t)
+        y0 = y - (j - t)
+
+        i1 = (x0 > y0).astype(np.int64)
+        j1 = 1 - i1
+
+        n = self.corner2dArray(x0, y0, i, j)
+        n += self.corner2dArray(x0 - i1 + G2, y0 - j1 + G2, i + i1, j + j1)
+        n += self.corner2dArray(x0 - 1 + 2 * G2, y0 - 1 + 2 * G2, i + 1, j + 1)
+        return self.toRange(70 * n)
+
+    def noise2dArray(self, x, y, filterWidth=0.0):
+        """Same as noise2d, for arrays of x and y."""
+        return self.fractalArray(self.simplexNoise2dArray, (x, y), filterWidth)
+
+    # Three-dimensional noise
+    def corner3d(self, x, y, z, i, j, k):
+        """Contribution of corner i, j, k at offset x, y, z from it."""
+        t = 0.6 - x * x - y * y - z * z
+        if t < 0:
+            return 0.0
+        g = GRADIENTS[self.gradient3d(i, j, k)]
+        t *= t
+        return t * t * (g[0] * x + g[1] * y + g[2] * z)
+
+    def simplexNoise3d(self, x, y, z):
+        """Simplex noise at x, y and z, for one octave."""
+        s = (x + y + z) * F3
+        i = math.floor(x + s)
+        j = math.floor(y + s)
+        k = math.floor(z + s)
+        t = (i + j + k) * G3
+        x0 = x - (i - t)
+        y0 = y - (j - t)
+        z0 = z - (k - t)
+
+        # Which of the six tetrahedra of the cell x, y and z are in, as the
+        # offsets of its second and third corners
+        i1 = int(x0 >= y0 and x0 >= z0)
+        j1 = int(y0 > x0 and y0 >= z0)
+        k1 = int(z0 > x0 and z0 > y0)
+        i2 = int(x0 >= y0 or x0 >= z0)
+        j2 = int(y0 > x0 or y0 >= z0)
+        k2 = int(z0 > x0 or z0 > y0)
+
+        n = self.corner3d(x0, y0, z0, i, j, k)
+        n += self.corner3d(
+            x0 - i1 + G3, y0 - j1 + G3, z0 - k1 + G3, i + i1, j + j1, k + k1
+        )
+        n += self.corner3d(
+            x0 - i2 + 2 * G3, y0 - j2 + 2 * G3, z0 - k2 + 2 * G3, i + i2, j + j2, k + k2
+        )
+        n += self.corner3d(
+            x0 - 1 + 3 * G3, y0 - 1 + 3 * G3, z0 - 1 + 3 * G3, i + 1, j + 1, k + 1
+        )
+        return self.toRange(32 * n)
+
+    def noise3d(self, x, y, z, filterWidth=0.0):
+        """Cumulative simplex noise at x, y and z."""
+        s = 0.0
+        for i in range(self.noctaves):
+            s += (
+                self.filterOctave(
+                    i,
+                    filterWidth,
+                    self.simplexNoise3d,
+                    x * self.octaveDilation**i,
+                    y * self.octaveDilation**i,
+                    z * self.octaveDilation**i,
+                )
+                / 2**i
+            )
+        return s * 0.5
+
+    def corner3dArray(self, x, y, z, i, j, k):
+        """Same as corner3d, for arrays."""
+        t = np.maximum(0.6 - x * x - y * y - z * z, 0.0)
+        h = self.hash3dArray(i, j, k)
+        t *= t
+        return (
+            t
+            * t
+            * (self.gradientX[h] * x + self.gradientY[h] * y + self.gradientZ[h] * z)
+        )
+
+    def simplexNoise3dArray(self, x, y, z):
+        """Same as simplexNoise3d, for arrays of x, y and z."""
+        s = (x + y + z) * F3
+        i = np.floor(x + s).astype(np.int64)
+        j = np.floor(y + s).astype(np.int64)
+        k = np.floor(z + s).astype(np.int64)
+        t = (i + j + k) * G3
+        x0 = x - (i - t)
+        y0 = y - (j - t)
+        z0 = z - (k - t)
+
+        i1 = ((x0 >= y0) & (x0 >= z0)).astype(np.int64)
+        j1 = ((y0 > x0) & (y0 >= z0)).astype(np.int64)
+        k1 = ((z0 > x0) & (z0 > y0)).astype(np.int64)
+        i2 = ((x0 >= y0) | (x0 >= z0)).astype(np.int64)
+        j2 = ((y0 > x0) | (y0 >= z0)).astype(np.int64)
+        k2 = ((z0 > x0) | (z0 > y0)).astype(np.int64)
+
+        n = self.corner3dArray(x0, y0, z0, i, j, k)
+        n += self.corner3dArray(
+            x0 - i1 + G3, y0 - j1 + G3, z0 - k1 + G3, i + i1, j + j1, k + k1
+        )
+        n += self.corner3dArray(
+            x0 - i2 + 2 * G3, y0 - j2 + 2 * G3, z0 - k2 + 2 * G3, i + i2, j + j2, k + k2
+        )
+        n += self.corner3dArray(
+            x0 - 1 + 3 * G3, y0 - 1 + 3 * G3, z0 - 1 + 3 * G3, i + 1, j + 1, k + 1
+        )
+        return self.toRange(32 * n)
+
+    def noise3dArray(self, x, y, z, filterWidth=0.0):
+        """Same as noise3d, for arrays of x, y and z."""
+        return self.fractalArray(self.simplexNoise3dArray, (x, y, z), filterWidth)
+
+
+# Noise machines the NoisePatterns can use, by name
+NOISE_BACKENDS = {"value": NoiseMachine, "simplex": SimplexNoiseMachine}
+
+
+# Patterns as graphs of modules.utils.patterns nodes, for compilePattern or
+# NoisePatterns.getCompiled
+def cloudsGraph(machine, c1=COLORS["blue"], c2=COLORS["white"]):
+    """Same as NoisePatterns.clouds3D."""
+    noise = patterns.noise3d(patterns.X, patterns.Y, patterns.Z, machine)
+    return patterns.lerp(c1, c2, noise)
+
+
+def fireGraph(machine, c1=COLORS["red"], c2=COLORS["yellow"], noiseStrength=0.6):
+    """Flames rising from a midpoint of (4, 3), for NoisePatterns.fire. Its
+    two noises share y * 2 and both read y / 2."""
+    x = patterns.X
+    y = patterns.Y / 2
+
+    # get noise @ x^2,y^2 and interpolate between c1 and c2.
+    noise = patterns.noise2d(x * 2, y * 2, machine, filterScale=2)
+    color = patterns.lerp(c1, c2, noise)
+
+    # calc the radius about a midpoint (4,3)
+    radius = patterns.sqrt((x - 4) ** 2 + (y - 3) ** 2) / 4
+
+    noise = patterns.noise2d(x + patterns.sin(y * 2) * 0.5, y, machine)
+    radius = radius + (noise - 0.5) * noiseStrength
+
+    return (1.0 - patterns.smerp(0.1, 1.0, radius)) * color
+
 
 class NoisePatterns(object):
     _instance = None
@@ -177,10 +737,32 @@ class NoisePatterns(object):
             cls._instance = NoisePatterns()
         return cls._instance
 
-    def __init__(self):
+    def __init__(self, backend="value", tables=None):
+        if backend not in NOISE_BACKENDS:
+            raise ValueError(
+                f"Unknown noise backend {backend}, use one of {tuple(NOISE_BACKENDS)}"
+            )
+
+        # "simplex" is cheaper but looks different from the "value" noise
+        self.backend = backend
         self.noiseId = 0
         self.scale = 50
-        self.nms = [NoiseMachine(seed=i) for i in range(5)]
+
+        # The machines' tables are the rows of one pair of arrays, made in
+        # one pass, which getTables exports for another NoisePatterns, in
+        # this process or, through shareTables, in another one
+        if tables is None:
+            tables = makeTables(range(NOISE_MACHINES))
+        self.tables = tables
+        self.nms = [NOISE_BACKENDS[backend](tables=row) for row in zip(*tables)]
+
+        # Pattern graphs compiled by getCompiled
+        self.compiled = {}
+
+    def getTables(self):
+        """The (values, permutations) arrays of all the machines, one row
+        each."""
+        return self.tables
 
     def next(self):
         self.noiseId += 1
@@ -190,42 +772,129 @@ class NoisePatterns(object):
         self.noiseId -= 1
         self.noiseId %= len(self.nms)
 
-    def clouds(self, x, y, c1=COLORS["blue"], c2=COLORS["white"]):
-        noise = self.nms[self.noiseId].noise2d(x, y)
-        return lerp(c1, c2, noise)
-
-    def clouds3D(self, x, y, z, c1=COLORS["blue"], c2=COLORS["white"]):
-        noise = self.nms[self.noiseId].noise3d(x, y, z)
-        return lerp(c1, c2, noise)
-
-    def cloudsTiled(self, x, y, xMod, yMod, c1=COLORS["blue"], c2=COLORS["white"]):
-        noise = self.nms[self.noiseId].noise2dTiled(x, y, xMod, yMod)
-        return lerp(c1, c2, noise)
+    def getCompiled(self, build, *arguments):
+        """The pattern graph build(machine, *arguments) makes with the
+        current machine, compiled the first time it is asked for."""
+        key = (build, self.noiseId) + tuple(
+            tuple(np.ravel(a).tolist()) for a in arguments
+        )
+        if key not in self.compiled:
+            node = build(self.nms[self.noiseId], *arguments)
+            self.compiled[key] = patterns.compilePattern(node)
+        return self.compiled[key]
+
+    # The patterns take scalar coordinates and return a color, or arrays of
+    # coordinates and return an array of colors with one more axis. Their
+    # filterWidth, a scalar or one per point, drops octaves of noise too
+    # fine for it, see NoiseMachine.getOctaveWeight.
+    def getNoise2d(self, x, y, filterWidth=0.0):
+        nm = self.nms[self.noiseId]
+        if np.ndim(x) == 0 and np.ndim(y) == 0:
+            return nm.noise2d(x, y, filterWidth)
+        return nm.noise2dArray(x, y, filterWidth)
+
+    def getNoise3d(self, x, y, z, filterWidth=0.0):
+        nm = self.nms[self.noiseId]
+        if np.ndim(x) == 0 and np.ndim(y) == 0 and np.ndim(z) == 0:
+            return nm.noise3d(x, y, z, filterWidth)
+        return nm.noise3dArray(x, y, z, filterWidth)
+
+    def getNoise2dTiled(self, x, y, xMod, yMod, filterWidth=0.0):
+        nm = self.nms[self.noiseId]
+        if np.ndim(x) == 0 and np.ndim(y) == 0:
+            return nm.noise2dTiled(x, y, xMod, yMod, filterWidth)
+        return nm.noise2dTiledArray(x, y, xMod, yMod, filterWidth)
+
+    def lerpColors(self, c1, c2, value):
+        """lerp between two colors, for a value or an array of values."""
+        if np.ndim(value) == 0:
+            return lerp(c1, c2, value)
+        return lerp(c1, c2, value[..., np.newaxis])
+
+    def clouds(self, x, y, c1=COLORS["blue"], c2=COLORS["white"], filterWidth=0.0):
+        noise = self.getNoise2d(x, y, filterWidth)
+        return self.lerpColors(c1, c2, noise)
+
+    def clouds3D(self, x, y, z, c1=COLORS["blue"], c2=COLORS["white"], filterWidth=0.0):
+        noise = self.getNoise3d(x, y, z, filterWidth)
+        return self.lerpColors(c1, c2, noise)
+
+    def cloudsTiled(
+        self, x, y, xMod, yMod, c1=COLORS["blue"], c2=COLORS["white"], filterWidth=0.0
+    ):
+        noise = self.getNoise2dTiled(x, y, xMod, yMod, filterWidth)
+        return self.lerpColors(c1, c2, noise)
+
+    def clouds3DTiled(
+        self,
+        x,
+        y,
+        z,
+        xMod,
+        yMod,
+        zMod,
+        c1=COLORS["blue"],
+        c2=COLORS["white"],
+        filterWidth=0.0,
+    ):
+        noise = self.nms[self.noiseId].noise3dTiled(
+            x, y, z, xMod, yMod, zMod, filterWidth
+        )
+        return self.lerpColors(c1, c2, noise)
 
     def marble(
-        self, x, y, c1=COLORS["marble1"], c2=COLORS["marble2"], noiseStrength=0.2
+        self,
+        x,
+        y,
+        c1=COLORS["marble1"],
+        c2=COLORS["marble2"],
+        noiseStrength=0.2,
+        filterWidth=0.0,
     ):
-        noise = self.nms[self.noiseId].noise2d(x, y)
+        noise = self.getNoise2d(x, y, filterWidth)
         value = np.sin(x + y + (noise * noiseStrength * self.scale)) * 0.5 + 0.5
-        return lerp(c1, c2, value)
+        return self.lerpColors(c1, c2, value)
 
     def marble3D(
-        self, x, y, z, c1=COLORS["marble1"], c2=COLORS["marble2"], noiseStrength=0.2
+        self,
+        x,
+        y,
+        z,
+        c1=COLORS["marble1"],
+        c2=COLORS["marble2"],
+        noiseStrength=0.2,
+        filterWidth=0.0,
     ):
-        noise = self.nms[self.noiseId].noise3d(x, y, z)
+        noise = self.getNoise3d(x, y, z, filterWidth)
         value = np.sin(x + y + z + (noise * noiseStrength * self.scale)) * 0.5 + 0.5
-        return lerp(c1, c2, value)
-
-    def wood(self, x, y, c1=COLORS["wood1"], c2=COLORS["wood2"], noiseStrength=0.2):
-        noise = self.nms[self.noiseId].noise2d(x, y)
+        return self.lerpColors(c1, c2, value)
+
+    def wood(
+        self,
+        x,
+        y,
+        c1=COLORS["wood1"],
+        c2=COLORS["wood2"],
+        noiseStrength=0.2,
+        filterWidth=0.0,
+    ):
+        noise = self.getNoise2d(x, y, filterWidth)
         radius = np.sqrt(x * x + y * y) * 10
         value = np.sin(radius + noise * noiseStrength * self.scale) * 0.5 + 0.5
-        return lerp(c1, c2, value)
+        return self.lerpColors(c1, c2, value)
 
     def wood3D(
-        self, x, y, z, axis=2, c1=COLORS["wood1"], c2=COLORS["wood2"], noiseStrength=0.2
+        self,
+        x,
+        y,
+        z,
+        axis=2,
+        c1=COLORS["wood1"],
+        c2=COLORS["wood2"],
+        noiseStrength=0.2,
+        filterWidth=0.0,
     ):
-        noise = self.nms[self.noiseId].noise3d(x, y, z)
+        noise = self.getNoise3d(x, y, z, filterWidth)
         if axis == 1:
             a, b = x, y
         elif axis == 2:
@@ -234,20 +903,16 @@ class NoisePatterns(object):
             a, b = x, z
         radius = np.sqrt(a * a + b * b) * 10
         value = np.sin(radius + noise * noiseStrength * self.scale) * 0.5 + 0.5
-        return lerp(c1, c2, value)
-
-    def fire(self, x, y, c1=COLORS["red"], c2=COLORS["yellow"], noiseStrength=0.6):
-        # divide the y-axis by 2
-        y /= 2
-
-        # get noise @ x^2,y^2 and interpolate between c1 and c2.
-        color = lerp(c1, c2, self.nms[self.noiseId].noise2d(x * 2, y * 2))
-
-        # calc the radius about a midpoint (4,3)
-        radius = np.sqrt((x - 4) ** 2 + (y - 3) ** 2) / 4
-
-        noise = self.nms[self.noiseId].noise2d(x + np.sin(y * 2) * 0.5, y)
-        radius += (noise - 0.5) * noiseStrength
-        colorMultiplier = 1.0 - smerp(0.1, 1.0, radius)
-
-        return colorMultiplier * color
+        return self.lerpColors(c1, c2, value)
+
+    def fire(
+        self,
+        x,
+        y,
+        c1=COLORS["red"],
+        c2=COLORS["yellow"],
+        noiseStrength=0.6,
+        filterWidth=0.0,
+    ):
+        pattern = self.getCompiled(fireGraph, c1, c2, noiseStrength)
+        return pattern(x, y, 0.0, filterWidth)
@@ -0,0 +1,303 @@
+"""
+Patterns built as graphs of nodes, like noise, sin, lerp, smerp and color
+ramps, and compiled into one function that evaluates every distinct node
+once for whole arrays of points. The compiled pattern takes x, y, z and a
+filterWidth like the NoisePatterns, so it fits Material3D with
+vectorized=True and filtered=True.
+
+    noise = noise3d(X, Y, Z, nm)
+    veins = sin(X + Y + Z + noise * 10) * 0.5 + 0.5
+    pattern = compilePattern(ramp(veins, [(0, c1), (1, c2)]))
+"""
+
+import operator
+
+import numpy as np
+
+from . import vector
+
+
+class Node(object):
+    """A value of a pattern at every point, a number or a color. Nodes with
+    the same operation, parameters and inputs have the same key, however
+    they were built, so a compiled pattern evaluates them once."""
+
+    def __init__(self, operation, inputs=(), parameters=(), isColor=None):
+        self.operation = operation
+        self.inputs = tuple(toNode(i) for i in inputs)
+        self.parameters = parameters
+        self.key = (operation, parameters, tuple(i.key for i in self.inputs))
+
+        # Hashed once, the key nests the keys of every node below
+        self.hash = hash(self.key)
+
+        # Colors have one more axis than numbers, numbers mixed with them
+        # get one added when evaluated
+        if isColor is None:
+            isColor = any(i.isColor for i in self.inputs)
+        self.isColor = isColor
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        # Different hashes settle most comparisons without the keys
+        return self is other or (
+            isinstance(other, Node)
+            and self.hash == other.hash
+            and self.key == other.key
+        )
+
+    def __add__(self, other):
+        return Node("add", (self, other))
+
+    def __radd__(self, other):
+        return Node("add", (other, self))
+
+    def __sub__(self, other):
+        return Node("subtract", (self, other))
+
+    def __rsub__(self, other):
+        return Node("subtract", (other, self))
+
+    def __mul__(self, other):
+        return Node("multiply", (self, other))
+
+    def __rmul__(self, other):
+        return Node("multiply", (other, self))
+
+    def __truediv__(self, other):
+        return Node("divide", (self, other))
+
+    def __rtruediv__(self, other):
+        return Node("divide", (other, self))
+
+    def __neg__(self):
+        return Node("negate", (self,))
+
+    def __pow__(self, other):
+        return Node("power", (self, other))
+
+
+def toNode(value):
+    """Nodes stay as they are, numbers and colors become constants."""
+    if isinstance(value, Node):
+        return value
+    value = np.asarray(value, dtype=np.float64)
+    return Node(
+        "constant",
+        parameters=(value.shape, tuple(value.ravel().tolist())),
+        isColor=value.ndim > 0,
+    )
+
+
+# The coordinates of the points a pattern is evaluated at
+X = Node("x")
+Y = Node("y")
+Z = Node("z")
+
+
+def sin(node):
+    return Node("sin", (node,))
+
+
+def sqrt(node):
+    return Node("sqrt", (node,))
+
+
+def lerp(a, b, percent):
+    """Linear interpolation from a to b, numbers or colors."""
+    return Node("lerp", (a, b, percent))
+
+
+def smerp(a, b, percent):
+    """Smooth interpolation from a to b, like vector.smerp."""
+    return Node("smerp", (a, b, percent))
+
+
+def ramp(percent, stops):
+    """Color at percent along a ramp of (position, color) stops, in order
+    of position, interpolated linearly between them."""
+    positions = tuple(float(p) for p, _ in stops)
+    colors = tuple(tuple(np.asarray(c, dtype=np.float64).tolist()) for _, c in stops)
+    return Node("ramp", (percent,), (positions, colors), isColor=True)
+
+
+def noise2d(x, y, machine, filterScale=1.0):
+    """Noise of a NoiseMachine. filterScale is how much bigger the noise's
+    coordinates are than the point's, to scale the filterWidth by."""
+    return Node("noise2d", (x, y), (machine, filterScale))
+
+
+def noise3d(x, y, z, machine, filterScale=1.0):
+    """Same as noise2d, in three dimensions."""
+    return Node("noise3d", (x, y, z), (machine, filterScale))
+
+
+def smerpAny(a, b, percent):
+    """vector.smerp for numbers, vector.smerpArray for arrays, which is
+    slower for one point."""
+    if isinstance(a, float) and isinstance(b, float) and isinstance(percent, float):
+        return vector.smerp(a, b, percent)
+    return vector.smerpArray(a, b, percent)
+
+
+def lerpAny(a, b, percent):
+    return (1.0 - percent) * a + percent * b
+
+
+def noiseFunction(machine, filterScale, dimensions):
+    """Function of the coordinates and the filterWidth giving the noise of
+    machine, with the scalar noise for one point since it is much
+    quicker."""
+    if dimensions == 2:
+        scalarNoise, arrayNoise = machine.noise2d, machine.noise2dArray
+    else:
+        scalarNoise, arrayNoise = machine.noise3d, machine.noise3dArray
+
+    def noise(*arguments):
+        *coordinates, filterWidth = arguments
+        filterWidth = filterWidth * filterScale
+
+        # numpy's float64 is a float too, anything else takes the array
+        # noise, which gives the same values
+        if isinstance(filterWidth, float) and all(
+            isinstance(c, float) for c in coordinates
+        ):
+            return scalarNoise(*coordinates, filterWidth)
+        return arrayNoise(*coordinates, filterWidth)
+
+    return noise
+
+
+def rampFunction(positions, colors):
+    """Function of a percent giving the color at it along the ramp."""
+    channels = list(zip(*colors))
+
+    def ramp(percent):
+        return np.stack(
+            [np.interp(percent, positions, channel) for channel in channels],
+            axis=-1,
+        )
+
+    return ramp
+
+
+# Functions of the values of their inputs, by operation
+OPERATIONS = {
+    "add": operator.add,
+    "subtract": operator.sub,
+    "multiply": operator.mul,
+    "divide": operator.truediv,
+    "negate": operator.neg,
+    "power": operator.pow,
+    "sin": np.sin,
+    "sqrt": np.sqrt,
+    "lerp": lerpAny,
+    "smerp": smerpAny,
+}
+
+# Stands for the filterWidth among the inputs of noise
+FILTER_WIDTH = Node("filterWidth")
+
+
+def getConstant(node):
+    shape, value = node.parameters
+    if shape == ():
+        return value[0]
+    return np.array(value).reshape(shape)
+
+
+def getFunction(node):
+    """The function computing node and the nodes it takes the values of."""
+    operation = node.operation
+    if operation in ("noise2d", "noise3d"):
+        machine, filterScale = node.parameters
+        function = noiseFunction(machine, filterScale, len(node.inputs))
+        return function, node.inputs + (FILTER_WIDTH,)
+    if operation == "ramp":
+        return rampFunction(*node.parameters), node.inputs
+    if operation in OPERATIONS:
+        return OPERATIONS[operation], node.inputs
+    raise ValueError(f"Unknown pattern operation {operation}")
+
+
+def addAxis(value):
+    """Numbers per point take one more axis to mix with colors."""
+    if np.ndim(value) > 0:
+        return value[..., np.newaxis]
+    return value
+
+
+class CompiledPattern(object):
+    """A pattern graph as one function of x, y and z, scalars or arrays,
+    evaluating each distinct node once, inputs first. Each step is a
+    function and the indices in the list of values of its inputs, and
+    appends its value to the list."""
+
+    def __init__(self, node):
+        self.node = toNode(node)
+        order = []
+        seen = set()
+
+        # Depth first, so every node comes after its inputs
+        stack = [(self.node, False)]
+        while stack:
+            node, ready = stack.pop()
+            if node in seen:
+                continue
+            if ready:
+                seen.add(node)
+                order.append(node)
+                continue
+            stack.append((node, True))
+            stack.extend((i, False) for i in reversed(node.inputs) if i not in seen)
+        self.order = order
+
+        # The values start with the coordinates, the filterWidth and the
+        # constants, made once, and the steps append the rest in order
+        slots = {X: 0, Y: 1, Z: 2, FILTER_WIDTH: 3}
+        self.constants = []
+        for node in order:
+            if node.operation == "constant":
+                slots[node] = len(slots)
+                self.constants.append(getConstant(node))
+
+        self.steps = []
+        for node in order:
+            if node in slots:
+                continue
+            function, inputs = getFunction(node)
+            indices = []
+            for i in inputs:
+                if node.isColor and not i.isColor and node.operation != "ramp":
+                    # Numbers mixed with colors take one more axis
+                    if (addAxis, i) not in slots:
+                        self.steps.append((addAxis, (slots[i],)))
+                        slots[addAxis, i] = len(slots)
+                    indices.append(slots[addAxis, i])
+                else:
+                    indices.append(slots[i])
+            self.steps.append((function, tuple(indices)))
+            slots[node] = len(slots)
+        self.result = slots[self.node]
+
+    def evaluate(self, x, y, z, filterWidth):
+        values = [x, y, z, filterWidth, *self.constants]
+        for function, indices in self.steps:
+            values.append(function(*[values[i] for i in indices]))
+        return values[self.result]
+
+    def __call__(self, x, y, z, filterWidth=0.0):
+        if np.ndim(x) == 0 and np.ndim(y) == 0 and np.ndim(z) == 0:
+            x, y, z = float(x), float(y), float(z)
+        else:
+            x, y, z = np.broadcast_arrays(
+                *[np.asarray(c, dtype=np.float64) for c in (x, y, z)]
+            )
+        return self.evaluate(x, y, z, filterWidth)
+
+
+def compilePattern(node):
+    """Compiles a pattern graph, or a constant color, into a function."""
+    return CompiledPattern(node)
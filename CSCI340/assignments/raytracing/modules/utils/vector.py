@@ -19,6 +19,21 @@ def normalize(vector):
     return vector / mag
 
 
+def normalizeRows(vectors):
+    """Normalize each row of an (N, 3) numpy array."""
+    mags = np.sqrt(dotRows(vectors, vectors))[:, np.newaxis]
+    zero = mags == 0.0
+    rows = vectors / np.where(zero, 1.0, mags)
+    return np.where(zero, vec(1, 0, 0), rows).astype(np.float32)
+
+
+def dotRows(v, w):
+    """Dot product of each row of an (N, 3) numpy array with the matching
+    row of w, or with w itself if it is a single vector. Rounds the same
+    as np.dot on each pair."""
+    return (v[..., np.newaxis, :] @ w[..., :, np.newaxis])[..., 0, 0]
+
+
 def lerp(a, b, percent):
     """Linearly interpolate between a and b given a percent."""
     return (1.0 - percent) * a + percent * b
@@ -31,6 +46,13 @@ def smerp(a, b, percent):
     return a + smoothPercent * (b - a)
 
 
+def smerpArray(a, b, percent):
+    """Same as smerp, for numpy arrays of percents."""
+    percent = np.clip(percent, 0.0, 1.0)
+    smoothPercent = 3 * percent**2 - 2 * percent**3
+    return a + smoothPercent * (b - a)
+
+
 def vec(x, y=None, z=None):
     """Make a numpy vector of x, y, z."""
     if not (y is None) and not (z is None):
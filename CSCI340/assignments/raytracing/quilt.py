@@ -1,26 +1,172 @@
-import pygame, os, time
+import os, sys, time
+import hashlib, inspect, json, struct, zlib
+import numpy as np
 from render import ProgressiveRenderer, ShowTypes
-import subprocess
-import platform, psutil
-from tqdm import tqdm, trange
+import platform
 from multiprocessing import Pool
 
-try:
-    if platform.system() == "Windows":
-        proc = psutil.Process(os.getpid())
-        proc.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
-    else:
-        niceness = os.nice(0)
-        if niceness < 19:
-            os.nice(19)
-except Exception as e:
-    print("Unable to adjust priority of process.")
-    print(e)
+# pygame, psutil and tqdm are imported where they are used, so importing
+# this module and starting worker processes stays quick
 
 QUILT_SUBFOLDER = "quilt"
 
+# One JSON record per finished chunk, appended as each one is saved
+MANIFEST_FILE = "manifest.jsonl"
+
+# The renderer each worker process builds once and renders chunks with
+_workerRenderer = None
+
+
+def lowerPriority():
+    """Lowers the priority of this process, and of any worker processes it
+    starts after, so a long render leaves the machine usable."""
+    try:
+        if platform.system() == "Windows":
+            import psutil
+
+            proc = psutil.Process(os.getpid())
+            proc.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+        else:
+            niceness = os.nice(0)
+            if niceness < 19:
+                os.nice(19)
+    except Exception as e:
+        print("Unable to adjust priority of process.")
+        print(e)
+
+
+def getModuleSettings(folder):
+    """SHA-1 of the source and the upper case constants, like
+    RECURSIVE_RAY_LIMIT, of every loaded module in folder, by module name.
+    The constants are read as they are now, so a script that changes one
+    changes the settings too."""
+    settings = {}
+    for name, module in sorted(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if path is None or not os.path.abspath(path).startswith(folder + os.sep):
+            continue
+
+        with open(path, "rb") as source:
+            digest = hashlib.sha1(source.read()).hexdigest()
+        constants = {
+            key: value
+            for key, value in vars(module).items()
+            if key.isupper() and isinstance(value, (bool, int, float, str))
+        }
+        settings[name] = {"source": digest, "constants": constants}
+    return settings
+
+
+def _startWorker(cls, args, kwargs, fileName):
+    """Builds the renderer for this worker process."""
+    global _workerRenderer
+
+    # Renderers read the folder name from the command line
+    sys.argv = sys.argv[:1] + [fileName]
+    _workerRenderer = cls(*args, **kwargs)
+
+
+def _renderChunk(chunk):
+    x, y, chunkWidth, chunkHeight = chunk
+    return x, y, _workerRenderer.renderChunk(x, y, chunkWidth, chunkHeight)
+
+
+def fileHash(fileName):
+    with open(fileName, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def writePNG(fileName, pixels, stripHeight=256):
+    """Writes a (height, width, 3) uint8 array as a PNG, compressing a strip
+    of rows at a time so pixels can be a memory map bigger than memory."""
+    height, width = pixels.shape[:2]
+    compressor = zlib.compressobj(6)
+
+    def writeChunk(file, kind, data):
+        file.write(struct.pack(">I", len(data)))
+        file.write(kind)
+        file.write(data)
+        file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    with open(fileName, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        writeChunk(file, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+        previous = np.zeros(width * 3, dtype=np.uint8)
+        for top in range(0, height, stripHeight):
+            strip = np.asarray(pixels[top : top + stripHeight]).reshape(-1, width * 3)
+
+            # Up filter, every byte minus the one above it, wrapping around
+            rows = np.empty((len(strip), width * 3 + 1), dtype=np.uint8)
+            rows[:, 0] = 2
+            rows[0, 1:] = strip[0] - previous
+            rows[1:, 1:] = strip[1:] - strip[:-1]
+            previous = strip[-1]
+
+            data = compressor.compress(rows.tobytes())
+            if data:
+                writeChunk(file, b"IDAT", data)
+
+        writeChunk(file, b"IDAT", compressor.flush())
+        writeChunk(file, b"IEND", b"")
+
+
+def _stitchChunk(job):
+    """Decodes one chunk file into the canvas, in a worker process."""
+    import pygame
+
+    path, imageName, canvasName = job
+    x, y = [int(v) for v in imageName.split(".")[0].split("_")]
+    pixels = pygame.surfarray.array3d(pygame.image.load(os.path.join(path, imageName)))
+
+    # Chunks are indexed [x, y], the canvas is indexed [y, x]
+    canvas = np.load(canvasName, mmap_mode="r+")
+    pixels = pixels.swapaxes(0, 1)[: canvas.shape[0] - y, : canvas.shape[1] - x]
+    canvas[y : y + pixels.shape[0], x : x + pixels.shape[1]] = pixels
+    canvas.flush()
+
+
+def stitchStreaming(folderName, workers=None, fileName=None):
+    """Stitches into a .npy canvas memory mapped from disk, decoding chunks
+    in parallel, then streams the PNG out from it. Only a strip of the image
+    is ever in memory, so it works for quilts far bigger than RAM. Saves to
+    fileName, or next to the quilt folder by default."""
+    path = os.path.join(QUILT_SUBFOLDER, folderName)
+    info = open(os.path.join(path, "info.txt"), "r")
+    width, height = [int(x) for x in info.read().split()]
+    info.close()
+
+    canvasName = path + "_canvas.npy"
+    canvas = np.lib.format.open_memmap(
+        canvasName, mode="w+", dtype=np.uint8, shape=(height, width, 3)
+    )
+    del canvas
+
+    images = [x for x in os.listdir(path) if x.endswith(".png")]
+    jobs = [(path, imageName, canvasName) for imageName in images]
+
+    print("Starting...")
+
+    from tqdm import tqdm
+
+    with Pool(workers) as pool:
+        for _ in tqdm(pool.imap_unordered(_stitchChunk, jobs), total=len(jobs)):
+            pass
+
+        pool.close()
+        pool.join()
+
+    if fileName is None:
+        fileName = path + "_FINISHED.png"
+    writePNG(fileName, np.load(canvasName, mmap_mode="r"))
+    os.remove(canvasName)
+
+    print("All done!")
+
 
 def stitch(folderName):
+    import pygame
+
     path = os.path.join(QUILT_SUBFOLDER, folderName)
     info = open(os.path.join(path, "info.txt"), "r")
     width, height = [int(x) for x in info.read().split()]
@@ -50,10 +196,17 @@ def stitch(folderName):
 
 
 class QuiltRenderer(ProgressiveRenderer):
+    def __new__(cls, *args, **kwargs):
+        # Remember the arguments so worker processes can build a copy
+        renderer = super().__new__(cls)
+        renderer.initArgs = (args, kwargs)
+        return renderer
+
     @classmethod
     def main(cls, caption="Renderer"):
         """General main loop for the progressive renderer.
         Sets up pygame and everything necessary."""
+        import pygame
 
         # Initialize Pygame
         pygame.init()
@@ -72,18 +225,30 @@ class QuiltRenderer(ProgressiveRenderer):
         startPixelSize=1,
         chunkSize=100,
         displayUpdates=False,
+        packet=False,
+        workers=1,
+        fileName=None,
+        lowPriority=False,
+        **kwargs,
     ):
-        print("Enter a folder name for the QuiltRenderer")
+        if fileName is None and len(sys.argv) <= 1:
+            print("Enter a folder name for the QuiltRenderer")
         super().__init__(
-            width,
-            height,
-            showTime,
-            ShowTypes.NoShow,
+            width=width,
+            height=height,
+            showTime=showTime,
+            show=ShowTypes.NoShow,
             minimumPixel=startPixelSize // 2,
             startPixelSize=startPixelSize,
+            packet=packet,
+            fileName=fileName,
+            # Anything else, like backend, goes to the renderer
+            **kwargs,
         )
 
         self.displayUpdates = displayUpdates
+        self.workers = workers
+        self.lowPriority = lowPriority
 
         self.chunkSize = chunkSize
         self.chunkStartX = 0
@@ -107,6 +272,156 @@ class QuiltRenderer(ProgressiveRenderer):
         self.chunkEndX = x
         self.chunkEndY = y
 
+    def getChunks(self):
+        """Returns the (x, y, width, height) of every chunk to render."""
+        return [
+            (
+                x,
+                y,
+                min(self.width - x, self.chunkSize),
+                min(self.height - y, self.chunkSize),
+            )
+            for x in range(self.chunkStartX, self.chunkEndX, self.chunkSize)
+            for y in range(self.chunkStartY, self.chunkEndY, self.chunkSize)
+        ]
+
+    def renderChunk(self, x, y, chunkWidth, chunkHeight):
+        """Returns the chunk starting at x, y as a (width, height, 3) uint8
+        array, indexed the same as pygame.surfarray."""
+        xs, ys = np.meshgrid(
+            np.arange(x, x + chunkWidth), np.arange(y, y + chunkHeight), indexing="ij"
+        )
+        xs = xs.ravel()
+        ys = ys.ravel()
+
+        if self.packet:
+            colors = self.getColors(xs, ys)
+        else:
+            colors = np.array([self.getColor(ix, iy) for ix, iy in zip(xs, ys)])
+
+        colors = np.clip(np.asarray(colors) * 255, 0, 255).astype(np.uint8)
+        return colors.reshape(chunkWidth, chunkHeight, 3)
+
+    def getSettings(self):
+        """Everything that changes the pixels of a chunk, chunks rendered
+        with other settings are rendered again. The scene is built in the
+        renderer, so its source is included, along with the modules it
+        draws with from this folder. Override to add more, like the files
+        the scene loads."""
+        sources = []
+        for cls in type(self).__mro__:
+            try:
+                sources.append(inspect.getsource(cls))
+            except (OSError, TypeError):
+                sources.append(cls.__qualname__)
+
+        folder = os.path.dirname(os.path.abspath(__file__))
+        return {
+            "sources": sources,
+            "modules": getModuleSettings(folder),
+            "width": self.width,
+            "height": self.height,
+            "packet": self.packet,
+        }
+
+    def getSettingsHash(self):
+        settings = json.dumps(self.getSettings(), sort_keys=True)
+        return hashlib.sha1(settings.encode()).hexdigest()
+
+    def loadManifest(self):
+        """Returns the manifest records by chunk file name. Later records
+        replace earlier ones."""
+        records = {}
+        manifestPath = os.path.join(self.quiltFolder, MANIFEST_FILE)
+        if not os.path.exists(manifestPath):
+            return records
+
+        with open(manifestPath, "r") as manifest:
+            lines = manifest.readlines()
+
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Cut off when a render was killed
+                continue
+            records[record["file"]] = record
+
+        # Start new records on a line of their own
+        if lines and not lines[-1].endswith("\n"):
+            with open(manifestPath, "a") as manifest:
+                manifest.write("\n")
+
+        return records
+
+    def isChunkDone(self, chunk, records):
+        """True if the chunk was saved with the current settings and its
+        file is unchanged since."""
+        x, y = chunk[:2]
+        record = records.get(f"{x}_{y}.png")
+        if (
+            record is None
+            or record["settings"] != self.settingsHash
+            or record["chunk"] != list(chunk)
+        ):
+            return False
+
+        path = os.path.join(self.quiltFolder, record["file"])
+        return os.path.exists(path) and fileHash(path) == record["hash"]
+
+    def saveChunk(self, x, y, pixels):
+        import pygame
+
+        chunkFileName = f"{x}_{y}.png"
+        path = os.path.join(self.quiltFolder, chunkFileName)
+
+        # Save under a temporary name first so a killed render never leaves
+        # half a chunk behind
+        with open(path + ".tmp", "wb") as file:
+            pygame.image.save(
+                pygame.surfarray.make_surface(pixels), file, chunkFileName
+            )
+        os.replace(path + ".tmp", path)
+
+        record = {
+            "file": chunkFileName,
+            "chunk": [x, y, *pixels.shape[:2]],
+            "settings": self.settingsHash,
+            "hash": fileHash(path),
+        }
+        with open(os.path.join(self.quiltFolder, MANIFEST_FILE), "a") as manifest:
+            manifest.write(json.dumps(record) + "\n")
+
+        if self.displayUpdates:
+            print(f"{chunkFileName} completed.")
+            print("===============================")
+
+    def renderChunks(self, chunks):
+        """Renders and saves chunks, in this process if there is one worker
+        or else in a pool of worker processes, saving each as it arrives."""
+        from tqdm import tqdm
+
+        if self.workers == 1:
+            for x, y, chunkWidth, chunkHeight in tqdm(chunks):
+                if self.displayUpdates:
+                    print(f"{x}_{y}.png starting.")
+                self.saveChunk(x, y, self.renderChunk(x, y, chunkWidth, chunkHeight))
+            return
+
+        args, kwargs = self.initArgs
+        with Pool(
+            self.workers,
+            initializer=_startWorker,
+            initargs=(type(self), args, kwargs, self.fileName),
+        ) as pool:
+            for x, y, pixels in tqdm(
+                pool.imap_unordered(_renderChunk, chunks), total=len(chunks)
+            ):
+                self.saveChunk(x, y, pixels)
+
+            pool.close()
+            pool.join()
+
     def render(self):
         """The main loop of rendering the image.
         Will create pixels of progressively smaller sizes. Stops rendering
@@ -114,6 +429,10 @@ class QuiltRenderer(ProgressiveRenderer):
 
         startTime = time.time()
 
+        # Before the workers start, so they inherit it
+        if self.lowPriority:
+            lowerPriority()
+
         # First progress is to fill entire image with one color
         color = self.getColor(0, 0)
         self.image.fill(color, ((0, 0), (self.width, self.height)))
@@ -121,33 +440,16 @@ class QuiltRenderer(ProgressiveRenderer):
         info.write(f"{self.width} {self.height}")
         info.close()
 
-        # For each pixel in the image, jumping by pixel size
-        for x in trange(self.chunkStartX, self.chunkEndX, self.chunkSize):
-            for y in range(self.chunkStartY, self.chunkEndY, self.chunkSize):
-                chunkWidth = min(self.width - x, self.chunkSize)
-                chunkHeight = min(self.height - y, self.chunkSize)
-
-                chunkImage = pygame.Surface((chunkWidth, chunkHeight))
-
-                chunkFileName = f"{x}_{y}.png"
-
-                if self.displayUpdates:
-                    print(f"{chunkFileName} starting.")
-
-                for ix in range(x, x + self.chunkSize):
-                    for iy in range(y, y + self.chunkSize):
-                        # Get color
-                        color = self.getColor(ix, iy) * 255
+        # Skip chunks finished by an earlier run with the same settings
+        self.settingsHash = self.getSettingsHash()
+        records = self.loadManifest()
+        chunks = [c for c in self.getChunks() if not self.isChunkDone(c, records)]
 
-                        chunkImage.fill(color, ((ix - x, iy - y), (1, 1)))
+        finished = len(self.getChunks()) - len(chunks)
+        if finished > 0:
+            print(f"Skipping {finished} chunks that are already done.")
 
-                pygame.image.save(
-                    chunkImage, os.path.join(self.quiltFolder, chunkFileName)
-                )
-
-                if self.displayUpdates:
-                    print(f"{chunkFileName} completed.")
-                    print("===============================")
+        self.renderChunks(chunks)
 
         # Done rendering
         self.done = True
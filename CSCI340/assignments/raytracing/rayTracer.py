@@ -4,10 +4,9 @@ Author: Liz Matthews, Geoff Matthews
 """
 
 import numpy as np
-import pygame
 
 from modules.utils.definitions import COLORS, EPSILON
-from modules.utils.noise import NoisePatterns
+from modules.utils.noise import NoisePatterns, cloudsGraph
 from render import ProgressiveRenderer, ShowTypes
 
 from modules.raytracing.objects import (
@@ -31,18 +30,46 @@ from modules.raytracing.materials import (
     MaterialRefractive,
 )
 from modules.raytracing.scene import Scene
-from modules.utils.vector import lerp, normalize, vec
-from modules.raytracing.ray import Ray
-from quilt import *
+from modules.raytracing import stats
+from modules.utils.vector import dotRows, lerp, normalize, normalizeRows, vec
+from modules.raytracing.ray import Ray, RayPacket
 
 RECURSIVE_RAY_LIMIT = 9
 
+# Grazing hits stretch the footprint by at most 1 / this
+MIN_FOOTPRINT_COSINE = 0.125
+
+# "numba" traces with the compiled kernels in modules/raytracing/compiled.py,
+# which only cover untextured objects. "python" is the reference.
+BACKENDS = ("python", "numba")
+
 
 class RayTracer(ProgressiveRenderer):
-    def __init__(self, width=800, height=800, show=ShowTypes.PerColumn):
-        super().__init__(width, height, show=show)
+    def __init__(
+        self,
+        width=800,
+        height=800,
+        show=ShowTypes.PerColumn,
+        packet=False,
+        adaptive=False,
+        backend="python",
+        **kwargs,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, use one of {BACKENDS}")
+
+        # The compiled kernels trace whole packets at once
+        packet = packet or backend == "numba"
+
+        # Anything else, like fileName, goes to the renderer
+        super().__init__(
+            width, height, show=show, packet=packet, adaptive=adaptive, **kwargs
+        )
+        self.backend = backend
+        self.compiledScene = None
         self.fog = vec(0.627, 0.827, 0.929)
         self.scene = Scene(aspect=width / height, fov=35.0)
+        self.scene.camera.setResolution(width, height)
         self.enter_index = 1.0
 
         self.nm = nm = NoisePatterns()
@@ -55,12 +82,19 @@ class RayTracer(ProgressiveRenderer):
             "./textures/floor.jpg",
             scale_u=6.0,
             scale_v=6.0,
+            filtering="trilinear",
         )
 
         sky = PlaneTextured3D(
             vec(0, -21, 0),
             vec(0, 5, -1),
-            Material3D(lambda x, y, z: nm.clouds3D(x, y, z, c1=self.fog * 1.0), 0, 0),
+            Material3D(
+                nm.getCompiled(cloudsGraph, self.fog * 1.0, COLORS["white"]),
+                0,
+                0,
+                vectorized=True,
+                filtered=True,
+            ),
         )
         sky.hittable = False
 
@@ -148,6 +182,7 @@ class RayTracer(ProgressiveRenderer):
 
         self.scene.objects = [sky, floor, refractive_sphere, sphere_mirror, eye, dice]
         self.scene.lights = [light]
+        self.scene.finalize()
 
     def getColorR(self, ray: Ray, r_level=0):
         # Find any objects it collides with and calculate color
@@ -162,30 +197,38 @@ class RayTracer(ProgressiveRenderer):
 
         object_normal = normalize(obj.getNormal(intersection))
 
+        # Width of the ray where it lands, stretched when it hits at an angle
+        footprint = ray.getFootprintAt(distance_to_obj) / max(
+            abs(np.dot(object_normal, ray.direction)), MIN_FOOTPRINT_COSINE
+        )
+
         # the light energy given off ie. the diffuse amt is proportional to the cosine
 
         if not obj.hittable:
-            return obj.getDiffuse(intersection)
+            return obj.getDiffuse(intersection, footprint)
 
-        color = obj.getAmbient(intersection)
+        # Everything shading needs at this point, looked up once for all
+        # the lights and secondary rays
+        hit = obj.getInteraction(intersection, object_normal, footprint)
+        color = np.array(hit.ambient)
 
         for l in self.scene.lights:
-            light_vector = l.getVectorToLight(intersection)
+            light_vector = l.getVectorToLight(hit.point)
 
-            if self.scene.shadowed(obj, Ray(l.point, -light_vector)) >= l.getDistance(
-                intersection
+            if not self.scene.occluded(
+                obj, Ray(l.point, -light_vector), l.getDistance(hit.point), l
             ):
                 # only do this if not blocked
-                diffuse = (obj.getDiffuse(intersection) - color) * max(
-                    np.dot(object_normal, light_vector), 1e-13
+                diffuse = (hit.diffuse - color) * max(
+                    np.dot(hit.normal, light_vector), 1e-13
                 )
 
                 color += diffuse
                 reflection_vector = normalize(light_vector - ray.direction)
 
-                specular = (obj.getSpecular(intersection) - color) * (
-                    (np.dot(reflection_vector, object_normal) ** obj.getShine())
-                    * obj.getSpecularCoefficient()
+                specular = (hit.specular - color) * (
+                    (np.dot(reflection_vector, hit.normal) ** hit.shine)
+                    * hit.specularCoefficient
                 )
 
                 color += specular
@@ -193,21 +236,26 @@ class RayTracer(ProgressiveRenderer):
         if obj.material.getRecursiveRay() and r_level < RECURSIVE_RAY_LIMIT:
             # per the slides simplified because j = a -i and j -i = a -2 i:
             reflection_vector = (
-                ray.direction - 2 * np.dot(ray.direction, object_normal) * object_normal
+                ray.direction - 2 * np.dot(ray.direction, hit.normal) * hit.normal
             )
 
             # bigger epsilon
             reflection_ray = Ray(
-                (intersection + (0.001 * reflection_vector)), reflection_vector
+                (hit.point + (0.001 * reflection_vector)),
+                reflection_vector,
+                ray.getFootprintAt(distance_to_obj),
+                ray.spread,
             )
+            if stats.collector is not None:
+                stats.collector.countRays("reflection")
             reflecton_color = self.getColorR(reflection_ray, r_level + 1)
 
             if obj.material.getRefractive():
                 n_r = 1.0
-                n_t = obj.material.refractive_index
+                n_t = obj.material.getRefractiveIndex()
 
                 u_r = ray.direction
-                n = object_normal
+                n = hit.normal
 
                 entering_exiting = np.dot(u_r, n)
 
@@ -228,19 +276,28 @@ class RayTracer(ProgressiveRenderer):
 
                     reflection_vector = u_r - 2 * np.dot(u_r, n) * n
                     new_ray = Ray(
-                        (intersection + (EPSILON * reflection_vector)),
+                        (hit.point + (EPSILON * reflection_vector)),
                         reflection_vector,
+                        ray.getFootprintAt(distance_to_obj),
+                        ray.spread,
                     )
 
                 else:
                     u_t = (n_ratio * cos_theta - np.sqrt(cos_phi)) * n + n_ratio * u_r
 
-                    new_ray = Ray(intersection + (0.01 * u_t), u_t)
+                    new_ray = Ray(
+                        hit.point + (0.01 * u_t),
+                        u_t,
+                        ray.getFootprintAt(distance_to_obj),
+                        ray.spread,
+                    )
 
+                if stats.collector is not None:
+                    stats.collector.countRays("refraction")
                 refractive_color = self.getColorR(new_ray, r_level=r_level + 1)
 
                 refractive_color = lerp(
-                    obj.getAmbient(), refractive_color, obj.material.transparency_factor
+                    hit.ambient, refractive_color, obj.material.getTransparency()
                 )
 
                 # cos_theta = max(
@@ -251,17 +308,206 @@ class RayTracer(ProgressiveRenderer):
                 R_0 = ((n_r - n_t) / (n_r + n_t)) ** 2
 
                 R_theta = R_0 + (
-                    (1 - R_0)
-                    * ((1 - np.abs(np.dot(ray.direction, object_normal))) ** 5)
+                    (1 - R_0) * ((1 - np.abs(np.dot(ray.direction, hit.normal))) ** 5)
                 )
 
                 return lerp(refractive_color, reflecton_color, R_theta)
             else:
-                return lerp(color, reflecton_color, obj.material.reflective_factor)
+                return lerp(color, reflecton_color, obj.material.getReflectivity())
 
         return color
 
+    def getColorsR(self, rays: RayPacket, r_level=0):
+        # Same as getColorR, for every ray in the packet at once.
+
+        indices, distances = self.scene.nearestObjects(rays)
+
+        # Fog wherever nothing is hit
+        colors = np.empty((len(rays), 3), dtype=np.float32)
+        colors[:] = self.fog
+
+        for i, obj in enumerate(self.scene.objects):
+            hit = indices == i
+            if hit.any():
+                colors[hit] = self.getObjectColors(
+                    obj, i, rays[hit], distances[hit], r_level
+                )
+
+        return colors
+
+    def getObjectColors(self, obj, index, rays: RayPacket, distances, r_level):
+        """Shades the rays of a packet that all hit obj, which is
+        self.scene.objects[index]."""
+        intersections = rays.getPositionsAt(distances)
+
+        object_normals = normalizeRows(obj.getNormals(intersections))
+
+        # Width of each ray where it lands, stretched when it hits at an angle
+        footprints = rays.getFootprintsAt(distances) / np.maximum(
+            np.abs(dotRows(object_normals, rays.directions)), MIN_FOOTPRINT_COSINE
+        )
+
+        if not obj.hittable:
+            return obj.getDiffuses(intersections, footprints)
+
+        recursive = obj.material.getRecursiveRay() and r_level < RECURSIVE_RAY_LIMIT
+
+        if recursive and obj.material.getRefractive():
+            # The lit color is never used by refractive objects.
+            return self.getRefractedColors(
+                obj, rays, distances, object_normals, r_level
+            )
+
+        # Every color of the hit at once, so patterns are evaluated once
+        ambients, diffuses, speculars = obj.getColors(intersections, footprints)
+        color = np.array(ambients, dtype=np.float32)
+
+        for l in self.scene.lights:
+            light_vectors = l.getVectorsToLight(intersections)
+
+            # only light the points that are not blocked
+            lit = ~self.scene.occludedRays(
+                index,
+                RayPacket(l.point, -light_vectors),
+                l.getDistances(intersections),
+                l,
+            )
+
+            if not lit.any():
+                continue
+
+            normals = object_normals[lit]
+            light_vectors = light_vectors[lit]
+
+            diffuse = (diffuses[lit] - color[lit]) * np.maximum(
+                dotRows(normals, light_vectors), 1e-13
+            )[:, np.newaxis]
+
+            color[lit] += diffuse
+            reflection_vectors = normalizeRows(light_vectors - rays.directions[lit])
+
+            specular = (speculars[lit] - color[lit]) * (
+                (dotRows(reflection_vectors, normals) ** obj.getShine())
+                * obj.getSpecularCoefficient()
+            )[:, np.newaxis]
+
+            color[lit] += specular
+
+        if recursive:
+            reflection_colors = self.getReflectedColors(
+                rays, distances, object_normals, r_level
+            )
+            return lerp(color, reflection_colors, obj.material.getReflectivity())
+
+        return color
+
+    def getReflectedColors(self, rays: RayPacket, distances, normals, r_level):
+        intersections = rays.getPositionsAt(distances)
+        reflection_vectors = (
+            rays.directions
+            - 2 * dotRows(rays.directions, normals)[:, np.newaxis] * normals
+        )
+
+        # bigger epsilon
+        reflection_rays = RayPacket(
+            intersections + (0.001 * reflection_vectors),
+            reflection_vectors,
+            rays.getFootprintsAt(distances),
+            rays.spreads,
+        )
+        if stats.collector is not None:
+            stats.collector.countRays("reflection", len(reflection_rays))
+        return self.getColorsR(reflection_rays, r_level + 1)
+
+    def getRefractedColors(self, obj, rays: RayPacket, distances, normals, r_level):
+        intersections = rays.getPositionsAt(distances)
+        reflection_colors = self.getReflectedColors(rays, distances, normals, r_level)
+
+        n_r = np.full(len(rays), 1.0, dtype=np.float32)
+        n_t = np.full(len(rays), obj.material.getRefractiveIndex(), dtype=np.float32)
+
+        u_r = rays.directions
+        n = normals
+
+        # where we are leaving the object it is the transmitting medium
+        exiting = dotRows(u_r, n) > 0.001
+        n_r, n_t = np.where(exiting, n_t, n_r), np.where(exiting, n_r, n_t)
+        n = np.where(exiting[:, np.newaxis], -n, n)
+
+        cos_theta = dotRows(-u_r, n)
+        n_ratio = n_r / n_t
+
+        cos_phi = 1 - (n_ratio * n_ratio) * (1 - (cos_theta) ** 2)
+
+        # Total internal reflection where cos_phi is too small.
+        total = cos_phi < 0.001
+
+        reflection_vectors = u_r - 2 * dotRows(u_r, n)[:, np.newaxis] * n
+        u_t = (n_ratio * cos_theta - np.sqrt(np.maximum(cos_phi, 0)))[
+            :, np.newaxis
+        ] * n + n_ratio[:, np.newaxis] * u_r
+
+        new_rays = RayPacket(
+            np.where(
+                total[:, np.newaxis],
+                intersections + (EPSILON * reflection_vectors),
+                intersections + (0.01 * u_t),
+            ),
+            np.where(total[:, np.newaxis], reflection_vectors, u_t),
+            rays.getFootprintsAt(distances),
+            rays.spreads,
+        )
+
+        if stats.collector is not None:
+            stats.collector.countRays("refraction", len(new_rays))
+        refractive_colors = self.getColorsR(new_rays, r_level + 1)
+
+        refractive_colors = lerp(
+            obj.getAmbient(), refractive_colors, obj.material.getTransparency()
+        )
+
+        R_0 = ((n_r - n_t) / (n_r + n_t)) ** 2
+
+        R_theta = R_0 + (
+            (1 - R_0) * ((1 - np.abs(dotRows(rays.directions, normals))) ** 5)
+        )
+
+        return lerp(refractive_colors, reflection_colors, R_theta[:, np.newaxis])
+
+    def getCompiledColors(self, rays: RayPacket):
+        """Same as getColorsR, with the numba backend. Compiles the scene
+        the first time, so it must not change after that."""
+        # Imported here so numba is only needed for this backend
+        from modules.raytracing import compiled
+
+        if self.compiledScene is None:
+            self.compiledScene = compiled.compileScene(self.scene, self.fog)
+
+        return compiled.traceRays(
+            self.compiledScene,
+            rays.positions.astype(np.float64),
+            rays.directions.astype(np.float64),
+            RECURSIVE_RAY_LIMIT,
+        )
+
+    def getColors(self, xs, ys):
+        # Same as getColor, for arrays of x and y
+        xPercents = np.asarray(xs) / self.width
+        yPercents = np.asarray(ys) / self.height
+
+        cameraRays = self.scene.camera.getRays(xPercents, yPercents)
+
+        if self.backend == "numba":
+            colors = self.getCompiledColors(cameraRays)
+        else:
+            colors = self.getColorsR(cameraRays)
+
+        return np.nan_to_num(np.clip(colors, 0, 1), 0)
+
     def getColor(self, x, y):
+        if self.backend == "numba":
+            return self.getColors([x], [y])[0]
+
         # Calculate the percentages for x and y
 
         xPercent = x / self.width
@@ -281,5 +527,7 @@ class RayTracer(ProgressiveRenderer):
 
 # Calls the 'main' function when this script is execute
 if __name__ == "__main__":
+    import pygame
+
     RayTracer.main("Ray Tracer Basics")
     pygame.quit()
@@ -7,9 +7,8 @@ To use for a different project, extend ProgressivePixelRenderer and
 override getColor().
 """
 
-import os, pygame, time, random, sys
+import os, time, random, sys
 import numpy as np
-from pygame.locals import *
 from enum import Enum
 from abc import ABC, abstractmethod
 
@@ -25,11 +24,13 @@ class ShowTypes(Enum):
     NoShow = 4
 
 class ProgressiveRenderer(ABC):
-    """Abstract base class for renderers."""       
+    """Abstract base class for renderers. pygame is imported where it is
+    used, so worker processes and scripts that never draw don't load it."""       
     @classmethod
     def main(cls, caption="Renderer"):
         """General main loop for the progressive renderer.
         Sets up pygame and everything necessary."""
+        import pygame
 
         # Initialize Pygame
         pygame.init()
@@ -55,12 +56,29 @@ class ProgressiveRenderer(ABC):
                  showTime=True,
                  show=ShowTypes.PerColumn,
                  minimumPixel=0,
-                 startPixelSize=256): 
+                 startPixelSize=256,
+                 packet=False,
+                 adaptive=False,
+                 tolerance=0.01,
+                 adaptiveSize=16,
+                 fileName=None): 
             
         self.width = width
         self.height = height
         self.showTime = showTime
         self.minimumPixel = minimumPixel        
+        self.packet = packet
+        
+        # Only subdivide blocks that differ from a neighbor by more than
+        # tolerance in any channel, once blocks are adaptiveSize or smaller
+        self.adaptive = adaptive
+        self.tolerance = tolerance
+        self.adaptiveSize = adaptiveSize
+        
+        # Color of every pixel so far, and which pixels were traced, so
+        # later passes don't trace them again
+        self.samples = None
+        self.sampled = None
         self.screen = None
         self.fillColor = (64, 128, 255)
      
@@ -68,9 +86,14 @@ class ProgressiveRenderer(ABC):
         
         if self.show in [ShowTypes.NoShow, ShowTypes.FinalShow]:
             self.startPixelSize = max(1, minimumPixel * 2)
+            # Adaptive passes need a full pass of coarse blocks to compare
+            if self.adaptive:
+                self.startPixelSize = max(self.startPixelSize, adaptiveSize)
         else:
             self.startPixelSize = startPixelSize
-        if self.show == ShowTypes.NoShow:
+        if fileName is not None:
+            self.fileName = fileName
+        elif self.show == ShowTypes.NoShow:
             if len(sys.argv) > 1:
                 self.fileName=sys.argv[1]
             else:
@@ -82,19 +105,28 @@ class ProgressiveRenderer(ABC):
     def getColor(self, x, y):
         """Must return a color in a np.array()"""
         return np.array((0,0,255))
+
+    def getColors(self, xs, ys):
+        """Returns an (N, 3) array of colors for arrays of x and y.
+        Override with a batched version to make packet rendering fast."""
+        return np.array([self.getColor(x, y) for x, y in zip(xs, ys)])
     
     def handleExitInput(self, event):
         """For exiting the program."""
-        if event.type == QUIT:
+        import pygame
+
+        if event.type == pygame.QUIT:
             return True
-        elif event.type == KEYDOWN:
-            if event.key == K_ESCAPE:
+        elif event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_ESCAPE:
                 return True
         return False
 
     def handleSaveInput(self, event):
         """The key s will save the file."""
-        if event.type == KEYDOWN and event.key == K_s:
+        import pygame
+
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_s:
             self.save()
 
     def handleOtherInput(self, event):
@@ -103,6 +135,8 @@ class ProgressiveRenderer(ABC):
 
     def handleInput(self):
         """Checks the event queue."""
+        import pygame
+
         for event in pygame.event.get():
             exitRender = self.handleExitInput(event)
             if exitRender:
@@ -112,12 +146,16 @@ class ProgressiveRenderer(ABC):
             self.handleOtherInput(event)
 
     def save(self):
-        pygame.event.set_blocked(KEYDOWN|KEYUP)
+        import pygame
+
+        pygame.event.set_blocked(pygame.KEYDOWN|pygame.KEYUP)
         fname = input("File name?:  ")
         pygame.event.set_blocked(0)
         pygame.image.save(self.image,os.path.join("images",fname))
 
     def startPygame(self, caption):
+        import pygame
+
         if self.show != ShowTypes.NoShow:
             self.screen = pygame.display.set_mode((self.width, self.height))
             pygame.display.set_caption(caption)
@@ -125,6 +163,13 @@ class ProgressiveRenderer(ABC):
         else:
             self.screen = None
 
+        self.startImage()
+
+    def startImage(self):
+        """Creates the image and starts rendering. Needs no window, so a
+        NoShow renderer can call this and then step render() itself."""
+        import pygame
+
         #Create the image
         self.image = pygame.Surface((self.width,
                                      self.height))
@@ -146,6 +191,8 @@ class ProgressiveRenderer(ABC):
 
     def showProgress(self, fps=60):
         """Method to draw the background to the screen and flip."""
+        import pygame
+
         # Let the clock tick
         self.clock.tick(fps)
         if self.show != ShowTypes.NoShow:
@@ -154,6 +201,108 @@ class ProgressiveRenderer(ABC):
             pygame.display.flip()
          
         
+    def getPassMask(self):
+        """Returns a mask over the blocks of the current pixel size, True
+        for each block to trace this pass. Blocks whose top left pixel was
+        traced by an earlier pass already have its color, and are never
+        traced again. When adaptive, blocks are only
+        traced where their parent block from the last pass differs from
+        one of its neighbors, so detail smaller than a parent block
+        can be missed in otherwise flat areas. A parent or neighbor that
+        was never traced has no color to compare, so its blocks are
+        always traced."""
+        size = self.pixelSize
+        mask = ~self.sampled[::size, ::size]
+
+        # Big blocks are too coarse to tell where the detail is
+        if not self.adaptive or size * 2 > self.adaptiveSize:
+            return mask
+
+        # Largest difference between each parent block and its neighbors
+        parents = self.samples[::size * 2, ::size * 2]
+        traced = self.sampled[::size * 2, ::size * 2]
+        difference = np.where(traced, 0.0, np.inf).astype(np.float32)
+        for axis in range(2):
+            low = [slice(None)] * 2
+            high = [slice(None)] * 2
+            low[axis] = slice(None, -1)
+            high[axis] = slice(1, None)
+            step = np.abs(np.diff(parents, axis=axis)).max(axis=2)
+            step[~(traced[tuple(low)] & traced[tuple(high)])] = np.inf
+            difference[tuple(low)] = np.maximum(difference[tuple(low)], step)
+            difference[tuple(high)] = np.maximum(difference[tuple(high)], step)
+
+        busy = difference > self.tolerance
+        busy = busy.repeat(2, 0).repeat(2, 1)[:mask.shape[0], :mask.shape[1]]
+        return mask & busy
+
+    def fillBlock(self, x, y, color):
+        """Fills the block at x, y of the current pixel size with the
+        color traced at x, y."""
+        self.samples[x:x + self.pixelSize, y:y + self.pixelSize] = color
+        self.sampled[x, y] = True
+        self.image.fill(color * 255, ((x, y), (self.pixelSize,
+                                               self.pixelSize)))
+
+    def renderPixelPass(self):
+        """Renders one pass at the current pixel size, one getColor at a
+        time."""
+        xs, ys = np.nonzero(self.getPassMask())
+        xs = (xs * self.pixelSize).tolist()
+        ys = (ys * self.pixelSize).tolist()
+
+        # For each block to trace, column by column
+        for i, (x, y) in enumerate(zip(xs, ys)):
+            # Get color
+            self.fillBlock(x, y, self.getColor(x, y))
+
+            if self.show == ShowTypes.PerPixel:
+                self.showProgress(256 * 60 // self.pixelSize)
+
+            yield
+
+            lastInColumn = i + 1 == len(xs) or xs[i + 1] != x
+            if self.show == ShowTypes.PerColumn and lastInColumn:
+                self.showProgress(60)
+
+    def renderPacketPass(self):
+        """Renders one pass at the current pixel size with getColors.
+        Shows per column if asked to, otherwise the whole pass is one
+        packet."""
+        import pygame
+
+        mask = self.getPassMask()
+        xs, ys = np.nonzero(mask)
+        xs *= self.pixelSize
+        ys *= self.pixelSize
+
+        if self.show in [ShowTypes.PerPixel, ShowTypes.PerColumn]:
+            for x in np.unique(xs):
+                column = ys[xs == x]
+                colors = self.getColors(np.full(len(column), x), column)
+
+                for y, color in zip(column.tolist(), colors):
+                    self.fillBlock(int(x), y, color)
+
+                self.showProgress(60)
+
+                yield
+        else:
+            # Every block is still one color, so the top left pixels are
+            # the colors of the blocks
+            colors = self.samples[::self.pixelSize, ::self.pixelSize].copy()
+            if len(xs) > 0:
+                colors[mask] = self.getColors(xs, ys)
+                self.sampled[::self.pixelSize, ::self.pixelSize][mask] = True
+
+            # Blow each block up to pixelSize and blit in one go
+            colors = colors.repeat(self.pixelSize, 0).repeat(self.pixelSize, 1)
+            self.samples[:] = colors[:self.width, :self.height]
+            pygame.surfarray.blit_array(
+                self.image, (self.samples * 255).astype(np.uint8))
+
+            yield
+
     def render(self):
         """The main loop of rendering the image.
         Will create pixels of progressively smaller sizes. Stops rendering
@@ -163,7 +312,11 @@ class ProgressiveRenderer(ABC):
 
         # First progress is to fill entire image with one color
         color = self.getColor(0, 0)
-        self.image.fill(color, ((0, 0), (self.width, self.height)))
+        self.image.fill(color * 255, ((0, 0), (self.width, self.height)))
+        self.samples = np.empty((self.width, self.height, 3), dtype=np.float32)
+        self.samples[:] = color
+        self.sampled = np.zeros((self.width, self.height), dtype=bool)
+        self.sampled[0, 0] = True
 
         # Show the progress
         self.showProgress()
@@ -174,23 +327,10 @@ class ProgressiveRenderer(ABC):
         while self.pixelSize > self.minimumPixel:
             print(f"Pixel Size: {self.pixelSize:3}")
 
-            # For each pixel in the image, jumping by pixel size
-            for x in range(0, self.width, self.pixelSize):
-                for y in range(0, self.height, self.pixelSize):
-                    # Get color
-                    color = self.getColor(x, y) * 255
-
-                    self.image.fill(color, ((x, y), (self.pixelSize,
-                                                     self.pixelSize)))
-
-                    if self.show == ShowTypes.PerPixel:
-                        self.showProgress(256 * 60 // self.pixelSize)
-
-                    yield
-
-                if self.show == ShowTypes.PerColumn:
-                    self.showProgress(60)
-
+            if self.packet:
+                yield from self.renderPacketPass()
+            else:
+                yield from self.renderPixelPass()
 
             # Reduce pixel size
             self.pixelSize //= 2
@@ -211,6 +351,8 @@ class ProgressiveRenderer(ABC):
             self.showProgress(30)
             
         elif self.show == ShowTypes.NoShow:
+            import pygame
+
             pygame.image.save(self.image,os.path.join("images", self.fileName))
             
 